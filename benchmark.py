@@ -0,0 +1,403 @@
+"""
+Rough benchmarks for sqlite_object.
+
+Run everything with:
+
+    python benchmark.py
+
+or pick benchmarks by name:
+
+    python benchmark.py bulk_load
+
+Sizes can be scaled with the BENCH_SCALE environment variable (default 1.0).
+"""
+from __future__ import print_function
+from sqlite_object import SqliteList, SqliteDict, SqliteSet, SqliteQueue
+
+import io, multiprocessing, os, sys, time
+
+
+SCALE = float(os.environ.get("BENCH_SCALE", 1.0))
+
+
+def scaled(n):
+    return max(1, int(n * SCALE))
+
+
+def report(name, rows, seconds):
+    print("{0:<45} {1:>10} rows {2:>9.3f}s {3:>12.0f} rows/s".format(name, rows, seconds, rows / max(seconds, 1e-9)))
+
+
+def report_latency(name, operations, seconds):
+    print("{0:<45} {1:>10} ops {2:>10.2f} us/op".format(name, operations, seconds * 1e6 / max(operations, 1)))
+
+
+def timed(function, *args, **kwargs):
+    start = time.time()
+    result = function(*args, **kwargs)
+    return time.time() - start, result
+
+
+def bench_bulk_load():
+    """
+    Row-at-a-time loading (what update()/extend() used to do) vs the executemany bulk path
+    """
+    n = scaled(20000)
+    items = [(str(i), {"id": i, "name": "item %d" % i}) for i in range(n)]
+
+    def one_at_a_time(d):
+        for key, value in items:
+            d[key] = value
+        d.commit()
+
+    with SqliteDict(commit_every=n) as d:
+        seconds, _ = timed(one_at_a_time, d)
+        report("SqliteDict d[k] = v loop (commit_every=n)", n, seconds)
+
+    small = scaled(200)
+    with SqliteDict() as d:
+        seconds, _ = timed(lambda: [d.__setitem__(key, value) for key, value in items[:small]])
+        report("SqliteDict d[k] = v loop (commit_every=0)", small, seconds)
+
+    seconds, d = timed(SqliteDict, dict(items))
+    report("SqliteDict(init_dict)", n, seconds)
+    d.close()
+
+    with SqliteDict() as d:
+        seconds, _ = timed(d.update, items)
+        report("SqliteDict.update", n, seconds)
+
+    with SqliteList(commit_every=n) as l:
+        seconds, _ = timed(lambda: [l.append(value) for _, value in items] and l.commit())
+        report("SqliteList.append loop (commit_every=n)", n, seconds)
+
+    with SqliteList() as l:
+        seconds, _ = timed(l.extend, (value for _, value in items))
+        report("SqliteList.extend", n, seconds)
+
+    with SqliteSet(commit_every=n) as s:
+        seconds, _ = timed(lambda: [s.add(key) for key, _ in items] and s.commit())
+        report("SqliteSet.add loop (commit_every=n)", n, seconds)
+
+    with SqliteSet() as s:
+        seconds, _ = timed(s.update, (key for key, _ in items))
+        report("SqliteSet.update", n, seconds)
+
+
+def bench_compression():
+    """
+    Database size and load/scan time of multi-KB JSON documents with and without compression
+    """
+    n = scaled(5000)
+    documents = [{"id": i, "status": "ok" if i % 3 else "failed", "tags": ["tag%d" % (i % 17)] * 20,
+                  "body": "some fairly repetitive text about item %d. " % i * 40} for i in range(n)]
+    for compression in [None, "zlib", "lzma"]:
+        with SqliteDict(compression=compression, compression_threshold=512) as d:
+            load, _ = timed(d.update, ((i, document) for i, document in enumerate(documents)))
+            scan, _ = timed(lambda: sum(1 for _ in d.values()))
+            size = os.path.getsize(d.get_filename())
+            report("SqliteDict load, compression=%s" % compression, n, load)
+            report("SqliteDict scan, compression=%s" % compression, n, scan)
+            stats = d.get_compression_stats()
+            print("    file size %.1fMB%s" % (size / 1e6, "" if stats is None else
+                  ", ratio %.1f, encode %.3fs, decode %.3fs" % (stats["ratio"], stats["encode_seconds"], stats["decode_seconds"])))
+
+
+def bench_parallel_decode():
+    """
+    Full scans of a big SqliteDict decoded serially vs on a thread pool vs on a process pool.
+    Use BENCH_SCALE=10 or more for the multi-million row case.  The pools can only win with spare cores.
+    """
+    print("%d CPUs" % multiprocessing.cpu_count())
+    n = scaled(200000)
+    with SqliteDict(profile="scratch", persist=True) as d:
+        d.update((str(i), {"id": i, "name": "item %d" % i, "tags": ["a", "b", "c"], "scores": [i * 0.5, i * 1.5, i * 2.5]}) for i in range(n))
+        filename = d.get_filename()
+    try:
+        for mode in [None, "thread", "process"]:
+            with SqliteDict(filename=filename, persist=True, iter_chunk_size=5000, parallel_decode=mode) as d:
+                seconds, _ = timed(lambda: sum(1 for _ in d.values()))
+                report("SqliteDict.values() scan, parallel_decode=%s" % mode, n, seconds)
+                seconds, _ = timed(lambda: sum(1 for _ in d.items()))
+                report("SqliteDict.items() scan, parallel_decode=%s" % mode, n, seconds)
+    finally:
+        os.remove(filename)
+
+
+def bench_pop():
+    """
+    Queue-style pops: single DELETE ... RETURNING statements vs SELECT then DELETE
+    """
+    n = scaled(20000)
+    for returning in [True, False]:
+        with SqliteList(range(n), commit_every=n) as l:
+            l._returning = returning and SqliteList._returning
+            seconds, _ = timed(lambda: [l.pop_first() for _ in range(n)])
+            report("SqliteList.pop_first, returning=%s" % l._returning, n, seconds)
+        with SqliteDict(((str(i), i) for i in range(n)), commit_every=n) as d:
+            d._returning = returning and SqliteDict._returning
+            seconds, _ = timed(lambda: [d.pop(str(i)) for i in range(n)])
+            report("SqliteDict.pop, returning=%s" % d._returning, n, seconds)
+
+
+def bench_batch():
+    """
+    Tight loops of single writes: committing every write, group commit, and inside batch()
+    """
+    n = scaled(20000)
+    small = scaled(200)
+    with SqliteDict() as d:
+        seconds, _ = timed(lambda: [d.__setitem__(str(i), i) for i in range(small)])
+        report("SqliteDict d[k] = v loop (commit_every=0)", small, seconds)
+    with SqliteDict(commit_every=n) as d:
+        seconds, _ = timed(lambda: [d.__setitem__(str(i), i) for i in range(n)])
+        report("SqliteDict d[k] = v loop (commit_every=n)", n, seconds)
+
+    def batched(d):
+        with d.batch():
+            for i in range(n):
+                d[str(i)] = i
+
+    with SqliteDict() as d:
+        seconds, _ = timed(batched, d)
+        report("SqliteDict d[k] = v loop in batch()", n, seconds)
+
+    def batched_appends(l):
+        with l.batch():
+            for i in range(n):
+                l.append(i)
+
+    with SqliteList() as l:
+        seconds, _ = timed(batched_appends, l)
+        report("SqliteList.append loop in batch()", n, seconds)
+
+
+def bench_ops():
+    """
+    Per-operation latency of the single-item methods, with writes grouped by batch() so that commits don't
+    drown out the cost of the statements themselves
+    """
+    n = scaled(20000)
+    keys = [str(i) for i in range(n)]
+
+    def writes(container, method, arguments):
+        with container.batch():
+            for argument in arguments:
+                method(*argument)
+
+    def reads(method, arguments):
+        for argument in arguments:
+            method(*argument)
+
+    with SqliteDict() as d:
+        seconds, _ = timed(writes, d, d.__setitem__, [(key, 1) for key in keys])
+        report_latency("SqliteDict.__setitem__", n, seconds)
+        seconds, _ = timed(reads, d.__getitem__, [(key, ) for key in keys])
+        report_latency("SqliteDict.__getitem__", n, seconds)
+        seconds, _ = timed(reads, d.__contains__, [(key, ) for key in keys])
+        report_latency("SqliteDict.__contains__ (hits)", n, seconds)
+        seconds, _ = timed(reads, d.__contains__, [("missing" + key, ) for key in keys])
+        report_latency("SqliteDict.__contains__ (misses)", n, seconds)
+        seconds, _ = timed(reads, d.get, [(key, ) for key in keys])
+        report_latency("SqliteDict.get", n, seconds)
+        seconds, _ = timed(writes, d, d.__delitem__, [(key, ) for key in keys])
+        report_latency("SqliteDict.__delitem__", n, seconds)
+    with SqliteList() as l:
+        seconds, _ = timed(writes, l, l.append, [(i, ) for i in range(n)])
+        report_latency("SqliteList.append", n, seconds)
+        seconds, _ = timed(writes, l, l.prepend, [(i, ) for i in range(n)])
+        report_latency("SqliteList.prepend", n, seconds)
+        seconds, _ = timed(reads, l.__getitem__, [(i, ) for i in range(n)])
+        report_latency("SqliteList.__getitem__", n, seconds)
+        seconds, _ = timed(writes, l, l.__setitem__, [(i, i) for i in range(n)])
+        report_latency("SqliteList.__setitem__", n, seconds)
+        seconds, _ = timed(reads, l.__len__, [()] * n)
+        report_latency("SqliteList.__len__", n, seconds)
+    with SqliteSet() as s:
+        seconds, _ = timed(writes, s, s.add, [(key, ) for key in keys])
+        report_latency("SqliteSet.add", n, seconds)
+        seconds, _ = timed(reads, s.__contains__, [(key, ) for key in keys])
+        report_latency("SqliteSet.__contains__", n, seconds)
+        seconds, _ = timed(writes, s, s.discard, [(key, ) for key in keys])
+        report_latency("SqliteSet.discard", n, seconds)
+
+
+def bench_export():
+    """
+    write() and load_json(): stored JSON copied straight out vs decoded and re-encoded (pickle codec),
+    and streaming the file back in
+    """
+    n = scaled(200000)
+    items = [{"id": i, "name": "item %d" % i, "tags": ["a", "b"]} for i in range(n)]
+    for codec in ("json", "pickle"):
+        with SqliteList(items, codec=codec) as l:
+            out = io.StringIO()
+            seconds, _ = timed(l.write, out)
+            report("SqliteList.write (%s)" % codec, n, seconds)
+    text = out.getvalue()
+    seconds, l = timed(SqliteList.load_json, io.StringIO(text))
+    report("SqliteList.load_json", n, seconds)
+    l.close()
+    with SqliteDict(((str(i), item) for i, item in enumerate(items))) as d:
+        out = io.StringIO()
+        seconds, _ = timed(d.write, out)
+        report("SqliteDict.write", n, seconds)
+    seconds, d = timed(SqliteDict.load_json, io.StringIO(out.getvalue()))
+    report("SqliteDict.load_json", n, seconds)
+    d.close()
+
+
+def bench_find():
+    """
+    Finding values by a field inside them: a full scan that decodes everything vs find() on an index
+    """
+    n = scaled(100000)
+    lookups = 200
+    with SqliteDict(((str(i), {"user_id": i % 1000, "name": "user %d" % i}) for i in range(n))) as d:
+        def scan():
+            for user_id in range(lookups):
+                [key for key, value in d.items() if value["user_id"] == user_id]
+        seconds, _ = timed(scan)
+        report_latency("scan items() for user_id", lookups, seconds)
+        seconds, _ = timed(d.create_index, "user_id")
+        report("create_index (json_extract)", n, seconds)
+        seconds, _ = timed(lambda: [d.find(user_id=user_id) for user_id in range(lookups)])
+        report_latency("find(user_id=...)", lookups, seconds)
+        seconds, _ = timed(lambda: [d.find_range("user_id", user_id, user_id + 10) for user_id in range(lookups)])
+        report_latency("find_range over 10 user_ids", lookups, seconds)
+
+
+def bench_query():
+    """
+    Counting, summing and top-k over fields of the values: decoding everything in python vs query()
+    """
+    n = scaled(100000)
+    with SqliteDict(((str(i), {"status": "ok" if i % 3 else "error", "latency": i % 997}) for i in range(n))) as d:
+        def in_python():
+            latencies = [value["latency"] for value in d.values() if value["status"] == "ok"]
+            return len(latencies), sum(latencies), sorted(latencies, reverse=True)[:100]
+        def in_sqlite():
+            ok = d.query().where("$.status", "=", "ok")
+            return ok.count(), ok.sum("$.latency"), list(ok.select("$.latency").order_by("$.latency", descending=True).limit(100))
+        seconds, expected = timed(in_python)
+        report("count/sum/top 100 in python", n, seconds)
+        seconds, result = timed(in_sqlite)
+        assert result == expected
+        report("count/sum/top 100 with query()", n, seconds)
+        d.create_index("status")
+        seconds, result = timed(in_sqlite)
+        report("... with an index on status", n, seconds)
+
+
+def bench_list_index():
+    """
+    SqliteList index modes: append throughput and lookup latency for big items
+    """
+    n = scaled(20000)
+    lookups = scaled(2000)
+    items = [{"id": i, "payload": "x" * 500} for i in range(n)]
+    for mode in ("none", "hash", "full"):
+        with SqliteList(index=mode) as l:
+            def appends():
+                with l.batch():
+                    for item in items:
+                        l.append(item)
+            seconds, _ = timed(appends)
+            report("SqliteList.append, index=" + repr(mode), n, seconds)
+            probes = items[::max(1, n // lookups)][:lookups]
+            seconds, _ = timed(lambda: [l.index(item) for item in probes])
+            report_latency("SqliteList.index, index=" + repr(mode), len(probes), seconds)
+            seconds, _ = timed(lambda: [l.count(item) for item in probes])
+            report_latency("SqliteList.count, index=" + repr(mode), len(probes), seconds)
+            pages = l._db.execute('''PRAGMA page_count''').fetchone()[0]
+            print("{0:<45} {1:>10} pages".format("database size, index=" + repr(mode), pages))
+
+
+def bench_list_middle():
+    """
+    SqliteList inserts and deletes in the middle of a big list, next to appends and prepends
+    """
+    n = scaled(200000)
+    ops = scaled(500)
+    with SqliteList(range(n)) as l:
+        def appends():
+            with l.batch():
+                for i in range(ops):
+                    l.append(i)
+        seconds, _ = timed(appends)
+        report_latency("SqliteList.append", ops, seconds)
+        def prepends():
+            with l.batch():
+                for i in range(ops):
+                    l.prepend(i)
+        seconds, _ = timed(prepends)
+        report_latency("SqliteList.prepend", ops, seconds)
+        middle = len(l) // 2
+        def inserts():
+            with l.batch():
+                for i in range(ops):
+                    l.insert(middle + i * 7, i)
+        seconds, _ = timed(inserts)
+        report_latency("SqliteList.insert, middle of " + str(n), ops, seconds)
+        def deletes():
+            with l.batch():
+                for i in range(ops):
+                    del l[middle + i * 5]
+        seconds, _ = timed(deletes)
+        report_latency("del SqliteList[i], middle of " + str(n), ops, seconds)
+
+
+def _queue_producer(filename, n, batch):
+    q = SqliteQueue(filename=filename, persist=True, profile="durable")
+    for start in range(0, n, batch):
+        q.put_many(range(start, min(start + batch, n)))
+    q.close()
+
+
+def _queue_consumer(filename, batch, results):
+    q = SqliteQueue(filename=filename, persist=True, profile="durable", visibility_timeout=60)
+    taken = 0
+    while True:
+        messages = q.get_batch(batch, timeout=1)
+        if not messages:
+            break
+        q.ack_batch(messages)
+        taken += len(messages)
+    q.close()
+    results.put(taken)
+
+
+def bench_queue():
+    """
+    Throughput of a SqliteQueue shared by several producer and consumer processes
+    """
+    n = scaled(5000)
+    for producers, consumers, batch in [(1, 1, 1), (2, 2, 1), (2, 2, 50), (4, 4, 50)]:
+        q = SqliteQueue(profile="durable", persist=True)
+        filename = q.get_filename()
+        q.close()
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_queue_producer, args=(filename, n // producers, batch)) for _ in range(producers)]
+        processes += [multiprocessing.Process(target=_queue_consumer, args=(filename, batch, results)) for _ in range(consumers)]
+        start = time.time()
+        for process in processes:
+            process.start()
+        taken = sum(results.get() for _ in range(consumers))
+        for process in processes:
+            process.join()
+        #consumers give up after waiting a second for more work
+        seconds = time.time() - start - 1
+        report("SqliteQueue %d producers, %d consumers, batch %d" % (producers, consumers, batch), taken, seconds)
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(filename + suffix):
+                os.remove(filename + suffix)
+
+
+BENCHMARKS = dict((name[len("bench_"):], function) for name, function in list(globals().items()) if name.startswith("bench_"))
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+    for name in names:
+        print("== " + name)
+        BENCHMARKS[name]()
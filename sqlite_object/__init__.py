@@ -1,3 +1,15 @@
 from ._sqlite_dict import SqliteDict
 from ._sqlite_list import SqliteList
-from ._sqlite_set import SqliteSet
\ No newline at end of file
+from ._sqlite_set import SqliteSet
+from ._sqlite_queue import SqliteQueue, QueueMessage
+from ._sqlite_store import SqliteStore
+from ._sqlite_object import MISSING
+from ._query import Query
+from ._codecs import register_codec
+from ._compression import train_dictionary
+
+try:
+    from ._async import AsyncSqliteDict, AsyncSqliteList, AsyncSqliteSet
+except (ImportError, SyntaxError):
+    #needs python 3.6+
+    pass
@@ -0,0 +1,259 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+
+from ._sqlite_dict import SqliteDict
+from ._sqlite_list import SqliteList
+from ._sqlite_object import MISSING
+from ._sqlite_set import SqliteSet
+
+#get_event_loop() is deprecated inside coroutines, get_running_loop() needs python 3.7
+_running_loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)
+
+#one single-thread executor per database, shared by every wrapper of an object on it: they'd only take turns
+#on the file's lock anyway.  Keyed by that lock, with a count of the wrappers using each executor.
+_executors = {}
+_executors_lock = Lock()
+
+def _executor_for(lock):
+    with _executors_lock:
+        executor, users = _executors.get(lock, (None, 0))
+        if executor is None:
+            executor = ThreadPoolExecutor(1)
+        _executors[lock] = (executor, users + 1)
+        return executor
+
+def _release_executor(lock):
+    with _executors_lock:
+        executor, users = _executors[lock]
+        if users > 1:
+            _executors[lock] = (executor, users - 1)
+            return
+        del _executors[lock]
+    executor.shutdown(wait=False)
+
+
+class _AsyncSqliteObject(object):
+    """
+    Runs every call on the wrapped object on the executor thread of its database, so coroutines never block
+    the event loop on disk I/O or on the object's lock.  The wrapped object is available as .sync.
+    """
+    _sync_class = None
+
+    def __init__(self, *args, **kwargs):
+        self.sync = self._sync_class(*args, **kwargs)
+        self._executor = _executor_for(self.sync.lock)
+
+    def _run(self, function, *args, **kwargs):
+        return _running_loop().run_in_executor(self._executor, partial(function, *args, **kwargs))
+
+    async def _iterate(self, chunks):
+        #one trip to the executor per chunk rather than per item
+        while True:
+            chunk = await self._run(next, chunks, None)
+            if chunk is None:
+                return
+            for item in chunk:
+                yield item
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def len(self):
+        return await self._run(len, self.sync)
+
+    async def clear(self):
+        await self._run(self.sync.clear)
+
+    async def commit(self):
+        await self._run(self.sync.commit)
+
+    async def close(self):
+        if self._executor is None:
+            return
+        await self._run(self.sync.close)
+        self._executor = None
+        _release_executor(self.sync.lock)
+
+    def get_filename(self):
+        return self.sync.get_filename()
+
+
+class AsyncSqliteDict(_AsyncSqliteObject):
+    """
+    asyncio front-end for SqliteDict, takes the same arguments.
+
+    Lookups that are waiting at the same time are coalesced: they go to the database together as one
+    WHERE key IN (...) query, and the next lot is gathered while that query runs.
+    """
+    _sync_class = SqliteDict
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncSqliteDict, self).__init__(*args, **kwargs)
+        self._pending = []
+        self._flushing = None
+
+    def _lookup(self, key):
+        future = _running_loop().create_future()
+        self._pending.append((key, future))
+        if self._flushing is None:
+            #runs on the next turn of the loop, after everything that's ready now has queued its lookup
+            self._flushing = asyncio.ensure_future(self._flush())
+        return future
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    values = await self._run(self.sync.get_many, [key for key, future in batch])
+                except Exception as e:
+                    for key, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for (key, future), value in zip(batch, values):
+                        if not future.done():
+                            future.set_result(value)
+        finally:
+            self._flushing = None
+
+    async def get(self, key, default=None):
+        value = await self._lookup(key)
+        return default if value is MISSING else value
+
+    async def getitem(self, key):
+        value = await self._lookup(key)
+        if value is MISSING:
+            raise KeyError("Mapping key not found in dict")
+        return value
+
+    async def contains(self, key):
+        return (await self._lookup(key)) is not MISSING
+
+    async def set(self, key, value):
+        await self._run(self.sync.__setitem__, key, value)
+
+    async def delete(self, key):
+        await self._run(self.sync.__delitem__, key)
+
+    async def pop(self, key, default=MISSING):
+        return await self._run(self.sync.pop, key, default)
+
+    async def popitem(self):
+        return await self._run(self.sync.popitem)
+
+    async def setdefault(self, key, default=None):
+        return await self._run(self.sync.setdefault, key, default)
+
+    async def update(self, other=None, **kwargs):
+        await self._run(self.sync.update, other, **kwargs)
+
+    async def get_many(self, keys, default=MISSING):
+        return await self._run(self.sync.get_many, keys, default)
+
+    async def contains_many(self, keys):
+        return await self._run(self.sync.contains_many, keys)
+
+    async def set_many(self, mapping):
+        await self._run(self.sync.set_many, mapping)
+
+    async def delete_many(self, keys):
+        return await self._run(self.sync.delete_many, keys)
+
+    def keys(self):
+        return self._iterate(self.sync._scan_chunks('''key''', (self.sync._decoder, )))
+
+    def values(self):
+        return self._iterate(self.sync._scan_chunks('''value''', (self.sync._decode_value, )))
+
+    def items(self):
+        return self._iterate(self.sync._scan_chunks('''key, value''', (self.sync._decoder, self.sync._decode_value)))
+
+    def __aiter__(self):
+        return self.keys()
+
+
+class AsyncSqliteList(_AsyncSqliteObject):
+    """
+    asyncio front-end for SqliteList, takes the same arguments
+    """
+    _sync_class = SqliteList
+
+    async def get(self, index):
+        return await self._run(self.sync.__getitem__, index)
+
+    async def set(self, index, value):
+        await self._run(self.sync.__setitem__, index, value)
+
+    async def delete(self, index):
+        await self._run(self.sync.__delitem__, index)
+
+    async def contains(self, item):
+        return await self._run(self.sync.__contains__, item)
+
+    async def index(self, item, start=0, stop=None):
+        return await self._run(self.sync.index, item, start, stop)
+
+    async def count(self, item):
+        return await self._run(self.sync.count, item)
+
+    async def append(self, item):
+        await self._run(self.sync.append, item)
+
+    async def prepend(self, item):
+        await self._run(self.sync.prepend, item)
+
+    async def insert(self, position, item):
+        await self._run(self.sync.insert, position, item)
+
+    async def remove(self, item):
+        await self._run(self.sync.remove, item)
+
+    async def extend(self, iterable):
+        await self._run(self.sync.extend, iterable)
+
+    async def pop_first(self):
+        return await self._run(self.sync.pop_first)
+
+    async def pop_last(self):
+        return await self._run(self.sync.pop_last)
+
+    def reversed(self):
+        return self._iterate(self.sync._scan_chunks('''value''', (self.sync._decode_value, ), descending=True))
+
+    def __aiter__(self):
+        return self._iterate(self.sync._scan_chunks('''value''', (self.sync._decode_value, )))
+
+
+class AsyncSqliteSet(_AsyncSqliteObject):
+    """
+    asyncio front-end for SqliteSet, takes the same arguments
+    """
+    _sync_class = SqliteSet
+
+    async def contains(self, item):
+        return await self._run(self.sync.__contains__, item)
+
+    async def add(self, item):
+        await self._run(self.sync.add, item)
+
+    async def remove(self, item):
+        await self._run(self.sync.remove, item)
+
+    async def discard(self, item):
+        await self._run(self.sync.discard, item)
+
+    async def pop(self):
+        return await self._run(self.sync.pop)
+
+    async def update(self, *others):
+        await self._run(self.sync.update, *others)
+
+    def __aiter__(self):
+        return self._iterate(self.sync._scan_chunks('''key''', (self.sync._decoder, )))
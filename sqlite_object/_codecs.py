@@ -0,0 +1,48 @@
+import json, marshal, pickle
+
+from functools import partial
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec(object):
+    """
+    A named coder/decoder pair.  Binary codecs produce bytes and are stored in BLOB columns.
+    """
+    def __init__(self, name, coder, decoder, binary=False):
+        self.name = name
+        self.coder = coder
+        self.decoder = decoder
+        self.binary = binary
+
+
+_codecs = {}
+
+def register_codec(name, coder, decoder, binary=False):
+    """
+    Make a coder/decoder pair available to SqliteDict/SqliteList/SqliteSet as codec=name.
+
+    The codec name is recorded in the database, and objects that re-open the database without choosing a
+    codec pick it up from there, so register your codec before re-opening a database that uses it.
+    """
+    _codecs[name] = Codec(name, coder, decoder, binary)
+
+def get_codec(name):
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError("Unknown codec " + repr(name) + ", expected one of " + ", ".join(sorted(_codecs)))
+
+def codec_names():
+    return sorted(_codecs)
+
+
+register_codec("json", json.dumps, json.loads)
+#protocol 5 where it's available (python 3.8+), it handles large buffers without extra copies
+register_codec("pickle", partial(pickle.dumps, protocol=min(5, pickle.HIGHEST_PROTOCOL)), pickle.loads, binary=True)
+register_codec("marshal", marshal.dumps, marshal.loads, binary=True)
+if msgpack is not None:
+    register_codec("msgpack", partial(msgpack.packb, use_bin_type=True), partial(msgpack.unpackb, raw=False), binary=True)
@@ -0,0 +1,168 @@
+import threading, time, zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    _clock = time.perf_counter
+except AttributeError:
+    _clock = time.time
+
+
+#first byte of every stored value
+_COMPRESSED = 1
+_TEXT = 2
+
+METHODS = ["zlib"] + (["lzma"] if lzma is not None else []) + (["zstd"] if zstandard is not None else [])
+
+
+class Compressor(object):
+    """
+    Compresses encoded values on their way into the database and decompresses them on the way out.
+
+    Every stored value starts with a flag byte saying whether the rest is compressed and whether the coder
+    produced text (which gets stored as utf-8) or bytes.  Values shorter than threshold, or that don't get any
+    smaller, are stored as they are after the flag byte.
+
+    A shared dictionary (zlib and zstd only) helps a lot with small values that don't have enough repetition
+    of their own; see train_dictionary().
+    """
+
+    def __init__(self, method, threshold=1024, level=None, dictionary=None):
+        if method == "lzma" and lzma is None:
+            raise ValueError("lzma compression needs the lzma module (python 3.3 or newer)")
+        if method not in METHODS:
+            raise ValueError("Unknown compression " + repr(method) + ", expected one of " + ", ".join(METHODS))
+        if dictionary is not None and method == "lzma":
+            raise ValueError("lzma compression doesn't support a shared dictionary")
+        self.method = method
+        self.threshold = threshold
+        self.level = level
+        self.dictionary = dictionary
+        self._zstd = None
+        #the counters are updated by whichever threads are encoding and decoding, including parallel_decode's
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def __getstate__(self):
+        #zstd (de)compressor objects and locks can't be pickled, they get re-created on demand
+        state = self.__dict__.copy()
+        state["_zstd"] = None
+        del state["_stats_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._stats_lock = threading.Lock()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.compressed = 0
+            self.uncompressed = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.encode_seconds = 0.0
+            self.decode_seconds = 0.0
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "compressed": self.compressed,
+                "uncompressed": self.uncompressed,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "ratio": float(self.bytes_in) / self.bytes_out if self.bytes_out else None,
+                "encode_seconds": self.encode_seconds,
+                "decode_seconds": self.decode_seconds,
+            }
+
+    def _zstd_objects(self):
+        if self._zstd is None:
+            kwargs = {}
+            if self.dictionary is not None:
+                kwargs["dict_data"] = zstandard.ZstdCompressionDict(self.dictionary)
+            compressor = zstandard.ZstdCompressor(level=3 if self.level is None else self.level, **kwargs)
+            self._zstd = (compressor, zstandard.ZstdDecompressor(**kwargs))
+        return self._zstd
+
+    def _compress(self, data):
+        if self.method == "zlib":
+            level = -1 if self.level is None else self.level
+            if self.dictionary is None:
+                return zlib.compress(data, level)
+            compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, self.dictionary)
+            return compressor.compress(data) + compressor.flush()
+        if self.method == "lzma":
+            return lzma.compress(data, preset=self.level)
+        return self._zstd_objects()[0].compress(data)
+
+    def _decompress(self, data):
+        if self.method == "zlib":
+            if self.dictionary is None:
+                return zlib.decompress(data)
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS, self.dictionary)
+            return decompressor.decompress(data) + decompressor.flush()
+        if self.method == "lzma":
+            return lzma.decompress(data)
+        return self._zstd_objects()[1].decompress(data)
+
+    def compress(self, value):
+        start = _clock()
+        flags = 0
+        if not isinstance(value, bytes):
+            value = value.encode("utf-8")
+            flags |= _TEXT
+        stored = value
+        if len(value) >= self.threshold:
+            compressed = self._compress(value)
+            if len(compressed) < len(value):
+                stored = compressed
+                flags |= _COMPRESSED
+        with self._stats_lock:
+            if flags & _COMPRESSED:
+                self.compressed += 1
+            else:
+                self.uncompressed += 1
+            self.bytes_in += len(value)
+            self.bytes_out += len(stored) + 1
+            self.encode_seconds += _clock() - start
+        return bytes(bytearray([flags])) + stored
+
+    def decompress(self, stored):
+        start = _clock()
+        flags = bytearray(stored[:1])[0]
+        value = bytes(stored[1:])
+        if flags & _COMPRESSED:
+            value = self._decompress(value)
+        if flags & _TEXT:
+            value = value.decode("utf-8")
+        with self._stats_lock:
+            self.decode_seconds += _clock() - start
+        return value
+
+
+def train_dictionary(samples, size=16384, method="zlib"):
+    """
+    Build a shared compression dictionary of about size bytes from some sample encoded values.
+
+    zstd trains a proper dictionary.  zlib only looks back 32KB and gets the most out of whatever is at the end
+    of its dictionary, so for zlib this just packs as many samples as fit, most recent last.
+    """
+    samples = [sample if isinstance(sample, bytes) else sample.encode("utf-8") for sample in samples]
+    if method == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    dictionary = b""
+    for sample in reversed(samples):
+        if len(dictionary) + len(sample) > size:
+            break
+        dictionary = sample + dictionary
+    return dictionary
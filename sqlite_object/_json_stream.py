@@ -0,0 +1,106 @@
+import codecs, json, re
+
+#how much of the file to read at a time
+_read_size = 65536
+
+_decoder = json.JSONDecoder()
+_whitespace = u" \t\n\r"
+#what can come after a value: once one of these has been read, a number before it can't carry on any further
+_delimiter = re.compile(u"[ \t\n\r,\\]}:]")
+
+
+class _Reader(object):
+    """
+    A window onto a text (or utf-8 bytes) file that JSON values can be parsed from one at a time, keeping only
+    the unparsed part of the file in memory
+    """
+    def __init__(self, infile):
+        self._infile = infile
+        self._bytes_decoder = None
+        self._buffer = u""
+        self._position = 0
+        self._eof = False
+
+    def _read(self, size):
+        text = self._infile.read(size)
+        if isinstance(text, bytes):
+            if self._bytes_decoder is None:
+                self._bytes_decoder = codecs.getincrementaldecoder("utf-8")()
+            text = self._bytes_decoder.decode(text, not text)
+        if not text:
+            self._eof = True
+            return False
+        #drop what has been parsed already
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+        return True
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character, or None at the end of the file
+        """
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in _whitespace:
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if self._eof or not self._read(_read_size):
+                return None
+
+    def expect(self, characters):
+        character = self.peek()
+        if character is None or character not in characters:
+            raise ValueError("Expected one of " + repr(characters) + " in JSON, got " + repr(character))
+        self._position += 1
+        return character
+
+    def value(self):
+        """
+        Parse the next JSON value.  A number that was cut off by the end of what has been read so far parses
+        as a shorter number ("1." as 1), so a value is only taken once a delimiter has been read after it.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._position)
+            except ValueError:
+                if self._eof:
+                    raise
+            else:
+                if self._eof or _delimiter.search(self._buffer, end):
+                    self._position = end
+                    return value
+            #read at least as much again as is buffered, so a huge value doesn't get parsed over and over
+            self._read(max(_read_size, len(self._buffer) - self._position))
+
+
+def iter_array(infile):
+    """
+    Yield the items of the JSON array in infile one at a time
+    """
+    reader = _Reader(infile)
+    reader.expect(u"[")
+    if reader.peek() == u"]":
+        return
+    while True:
+        yield reader.value()
+        if reader.expect(u",]") == u"]":
+            return
+
+
+def iter_object(infile):
+    """
+    Yield the (key, value) pairs of the JSON object in infile one at a time
+    """
+    reader = _Reader(infile)
+    reader.expect(u"{")
+    if reader.peek() == u"}":
+        return
+    while True:
+        if reader.peek() != u'"':
+            raise ValueError("Expected a string key in JSON object, got " + repr(reader.peek()))
+        key = reader.value()
+        reader.expect(u":")
+        yield key, reader.value()
+        if reader.expect(u",}") == u"}":
+            return
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """
+    Bounded least-recently-used cache of decoded values, keyed by encoded key.
+
+    Entries keep the raw encoded value next to the decoded one: the raw value is what gets counted against
+    max_bytes, and with copies=True each hit is decoded again from it so callers never share an object.
+
+    Every discard() or clear() bumps the generation.  A reader that looked something up in the database can
+    pass the generation it saw before the lookup to put(), and the value is only cached if nothing was
+    invalidated in the meantime (otherwise a slow reader could cache a value that was just overwritten).
+    """
+
+    def __init__(self, decoder, max_items=None, max_bytes=None, copies=False):
+        self._decoder = decoder
+        self._max_items = max_items
+        self._max_bytes = max_bytes
+        self._copies = copies
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Return (True, value) on a hit or (False, None) on a miss
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries[key] = entry
+            self.hits += 1
+        if self._copies:
+            return True, self._decoder(entry[0])
+        return True, entry[1]
+
+    def put(self, key, raw, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            size = len(raw)
+            if self._max_bytes is not None and size > self._max_bytes:
+                self._remove(key)
+                return
+            self._remove(key)
+            self._entries[key] = (raw, value)
+            self._bytes += size
+            while self._entries and ((self._max_items is not None and len(self._entries) > self._max_items) or
+                                     (self._max_bytes is not None and self._bytes > self._max_bytes)):
+                old_key, old_entry = self._entries.popitem(last=False)
+                self._bytes -= len(old_entry[0])
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self.generation += 1
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "items": len(self._entries),
+                "bytes": self._bytes,
+            }
@@ -0,0 +1,266 @@
+import json, re
+
+try:
+    unicode("hello")
+except NameError:
+    unicode = str
+
+
+#JSON paths into values: object fields and array positions, like $.user.id or $.tags[0]
+_path_pattern = re.compile(r'^\$(\.[A-Za-z_][A-Za-z0-9_]*|\[[0-9]+\])*$')
+
+def _json_path(field):
+    """
+    Turn a field ("user_id" is short for "$.user_id") into a JSON path, or raise ValueError if it isn't one
+    """
+    path = field if field.startswith("$") else "$." + field
+    if not _path_pattern.match(path):
+        raise ValueError("Bad JSON path " + repr(field) + ", use a function for anything but .field and [position] steps")
+    return path
+
+def _path_steps(path):
+    return [int(step[1:-1]) if step.startswith("[") else step[1:] for step in re.findall(r'\.[A-Za-z0-9_]+|\[[0-9]+\]', path)]
+
+def _extract_path(steps, value):
+    """
+    What json_extract() gives for steps of a path in value: None if any step isn't there
+    """
+    for step in steps:
+        if isinstance(step, int):
+            if not isinstance(value, list) or step >= len(value):
+                return None
+        elif not isinstance(value, dict) or step not in value:
+            return None
+        value = value[step]
+    return value
+
+def _index_value(value):
+    """
+    Turn a field into the sqlite value it's stored and compared as, the same way json_extract() does
+    """
+    if value is None or isinstance(value, (int, float, unicode, bytes)):
+        #True and False become 1 and 0 on their own
+        return value
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, separators=(",", ":"))
+    return unicode(value)
+
+def _index_function(decode, extract, stored):
+    return _index_value(extract(decode(stored)))
+
+def _extract_function(decode, stored, path):
+    return _index_value(_extract_path(_path_steps(path), decode(stored)))
+
+def _loads(text):
+    return None if text is None else json.loads(text)
+
+
+class Query(object):
+    """
+    A query on the values of a SqliteDict or SqliteList that runs inside sqlite, built up a step at a time:
+
+        d.query().where("$.status", "=", "ok").select("$.latency").order_by("$.latency", descending=True).limit(100)
+
+    Fields are JSON paths into the values, like the ones create_index() takes.  Every step returns a new Query,
+    so queries can be kept and refined.  Iterating over one streams the results a chunk at a time, and count(),
+    sum(), min(), max() and avg() are worked out by sqlite without reading values into python at all.
+    """
+
+    _operators = {"=": "=", "==": "=", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">=",
+                  "in": "IN", "not in": "NOT IN", "like": "LIKE"}
+
+    def __init__(self, container, key_column=None):
+        self._container = container
+        #"key" for a dict, which can be selected as well as the value
+        self._key_column = key_column
+        #(sql, parameters) for each where(), and whether any of them use our sql functions
+        self._conditions = []
+        self._fields = None
+        self._order = []
+        self._limit = None
+        self._offset = 0
+        self._functions = False
+
+    def _copy(self):
+        query = Query(self._container, self._key_column)
+        query.__dict__.update(self.__dict__)
+        query._conditions = list(self._conditions)
+        query._order = list(self._order)
+        return query
+
+    def _expression(self, field):
+        expression, functions = self._container._field_expression(_json_path(field))
+        self._functions = self._functions or functions
+        return expression
+
+    def where(self, field, operator, value):
+        """
+        Only keep values whose field compares to value with operator: one of =, !=, <, <=, >, >=, like, in and
+        not in (which take a list of values).  Values without the field only match = None.  Calling where()
+        again adds another condition that has to hold as well.
+        """
+        if operator.lower() not in self._operators:
+            raise ValueError("Unknown operator " + repr(operator) + ", expected one of " + ", ".join(sorted(self._operators)))
+        sql = self._operators[operator.lower()]
+        query = self._copy()
+        expression = query._expression(field)
+        if sql in ('''IN''', '''NOT IN'''):
+            parameters = [_index_value(item) for item in value]
+            query._conditions.append((expression + ''' ''' + sql + ''' (''' + ", ".join("?" * len(parameters)) + ''')''', parameters))
+        elif value is None and sql in ('''=''', '''!='''):
+            query._conditions.append((expression + (''' IS NULL''' if sql == '''=''' else ''' IS NOT NULL'''), []))
+        else:
+            query._conditions.append((expression + ''' ''' + sql + ''' ?''', [_index_value(value)]))
+        return query
+
+    def select(self, *fields):
+        """
+        Give back just these fields of each value instead of whole items: a bare value for one field, or a
+        tuple of them for more.  For a dict, "key" picks the key.
+        """
+        if not fields:
+            raise ValueError("select() needs at least one field")
+        for field in fields:
+            if field != self._key_column:
+                _json_path(field)
+        query = self._copy()
+        query._fields = list(fields)
+        return query
+
+    def order_by(self, field, descending=False):
+        """
+        Sort by field (values without it come first).  Calling order_by() again sorts ties by the next field.
+        """
+        query = self._copy()
+        query._order.append(query._expression(field) + (''' DESC''' if descending else ''' ASC'''))
+        return query
+
+    def limit(self, n, offset=0):
+        """
+        Stop after n results, skipping the first offset of them
+        """
+        query = self._copy()
+        query._limit = n
+        query._offset = offset
+        return query
+
+    def _where(self, extra=None):
+        conditions = [sql for sql, parameters in self._conditions] + ([extra] if extra else [])
+        if not conditions:
+            return ''''''
+        return ''' WHERE ''' + ''' AND '''.join(conditions)
+
+    def _parameters(self):
+        return [parameter for sql, parameters in self._conditions for parameter in parameters]
+
+    def _columns(self):
+        """
+        Return the columns to read and a function turning a row of them into a result
+        """
+        container = self._container
+        decode_value = container._decode_value
+        if self._fields is None:
+            if self._key_column is None:
+                return '''value''', lambda row: decode_value(row[0])
+            decode_key = container._decoder
+            return self._key_column + ''', value''', lambda row: (decode_key(row[0]), decode_value(row[1]))
+        if container._sql_json():
+            #-> gives fields as JSON, so strings and objects can be told apart
+            columns = [self._key_column if field == self._key_column else '''value -> \'''' + _json_path(field) + '''\'''' for field in self._fields]
+            converters = [container._decoder if field == self._key_column else _loads for field in self._fields]
+            convert = lambda row: tuple(converter(column) for converter, column in zip(converters, row))
+        else:
+            #decode each value once and pick the fields out of it
+            columns = [self._key_column or '''NULL''', '''value''']
+            steps = [None if field == self._key_column else _path_steps(_json_path(field)) for field in self._fields]
+            def convert(row):
+                value = decode_value(row[1])
+                return tuple(container._decoder(row[0]) if step is None else _extract_path(step, value) for step in steps)
+        if len(self._fields) == 1:
+            return ''', '''.join(columns), lambda row: convert(row)[0]
+        return ''', '''.join(columns), convert
+
+    def __iter__(self):
+        if self._order:
+            return self._ordered()
+        return self._unordered()
+
+    def _unordered(self):
+        """
+        Results in rowid order (the order of a list), a chunk at a time starting after the last rowid seen
+        """
+        container = self._container
+        columns, convert = self._columns()
+        size = container._iter_chunk_size
+        remaining = self._limit
+        offset = self._offset
+        last = None
+        while remaining is None or remaining > 0:
+            n = size if remaining is None else min(size, remaining)
+            if last is None:
+                statement = '''SELECT rowid, ''' + columns + ''' FROM ''' + container._table + self._where() + ''' ORDER BY rowid LIMIT ? OFFSET ?'''
+                rows = container._fetch_all(statement, self._parameters() + [n, offset], self._functions)
+            else:
+                statement = '''SELECT rowid, ''' + columns + ''' FROM ''' + container._table + self._where('''rowid > ?''') + ''' ORDER BY rowid LIMIT ?'''
+                rows = container._fetch_all(statement, self._parameters() + [last, n], self._functions)
+            for row in rows:
+                yield convert(row[1:])
+            if len(rows) < n:
+                return
+            last = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def _ordered(self):
+        """
+        Results in order_by() order: the rowids are sorted by sqlite in one go, then read a chunk at a time
+        """
+        container = self._container
+        columns, convert = self._columns()
+        statement = '''SELECT rowid FROM ''' + container._table + self._where() + ''' ORDER BY ''' + ''', '''.join(self._order) + ''', rowid LIMIT ? OFFSET ?'''
+        rowids = [row[0] for row in container._fetch_all(statement, self._parameters() + [-1 if self._limit is None else self._limit, self._offset], self._functions)]
+        for chunk in container._chunked(rowids, min(container._iter_chunk_size, container._max_variables)):
+            statement = '''SELECT rowid, ''' + columns + ''' FROM ''' + container._table + ''' WHERE rowid IN (''' + ", ".join("?" * len(chunk)) + ''')'''
+            rows = dict((row[0], row[1:]) for row in container._fetch_all(statement, chunk))
+            for rowid in chunk:
+                #anything deleted since the sort is left out
+                if rowid in rows:
+                    yield convert(rows[rowid])
+
+    def _aggregate(self, function, field):
+        query = self._copy()
+        expression = '''*''' if field is None else query._expression(field)
+        table = self._container._table
+        parameters = query._parameters()
+        if query._limit is None and not query._offset:
+            statement = '''SELECT ''' + function + '''(''' + expression + ''') FROM ''' + table + query._where()
+        else:
+            #aggregate just the values the query would give
+            statement = ('''SELECT ''' + function + '''(''' + expression + ''') FROM (SELECT value FROM ''' + table + query._where() +
+                         (''' ORDER BY ''' + ''', '''.join(query._order) if query._order else '''''') + ''' LIMIT ? OFFSET ?)''')
+            parameters += [-1 if query._limit is None else query._limit, query._offset]
+        return self._container._fetch_all(statement, parameters, query._functions)[0][0]
+
+    def count(self, field=None):
+        """
+        Number of results, or of results that have field if it's given
+        """
+        return self._aggregate('''COUNT''', field)
+
+    def sum(self, field):
+        """
+        Sum of field over the results, None if none of them have it
+        """
+        return self._aggregate('''SUM''', field)
+
+    def min(self, field):
+        return self._aggregate('''MIN''', field)
+
+    def max(self, field):
+        return self._aggregate('''MAX''', field)
+
+    def avg(self, field):
+        """
+        Mean of field over the results that have it, None if none of them do
+        """
+        return self._aggregate('''AVG''', field)
@@ -1,5 +1,11 @@
-from ._sqlite_object import SqliteObject
-import json, uuid
+from ._json_stream import iter_object
+from ._sqlite_object import MISSING, SqliteObject
+from ._lru_cache import LRUCache
+from ._query import Query, _index_function, _index_value, _json_path
+import json, re
+
+from functools import partial
+from itertools import chain
 
 try:
     unicode("hello")
@@ -22,120 +28,430 @@ class SqliteDict(SqliteObject):
     - update(<another dict or list like [(key, value),]>)
     - pop() and popitem()
     """
-    __schema = '''CREATE TABLE IF NOT EXISTS dict (key TEXT PRIMARY KEY, value TEXT)'''
-    __index = '''CREATE INDEX IF NOT EXISTS dict_index ON dict (key)'''
+    __schema = '''CREATE TABLE IF NOT EXISTS {table} (key {key_type} PRIMARY KEY, value {value_type})'''
+    __index = '''CREATE INDEX IF NOT EXISTS {name}_index ON {table} (key)'''
+    _table = "dict"
+    _name = "dict"
     
     
     
-    def __init__(self, init_dict={}, filename=None, coder=json.dumps, decoder=json.loads, index=True, persist=False, commit_every=0):
-        super(SqliteDict, self).__init__(self.__schema, self.__index, filename or str(uuid.uuid4())+".sqlite3", coder, decoder, index=index, persist=persist, commit_every=commit_every)
-        for key, value in init_dict.items():
-            self[key] = value
+    def __init__(self, init_dict={}, filename=None, coder=json.dumps, decoder=json.loads, index=True, persist=False, commit_every=0, profile=None, pragmas=None,
+                 commit_interval_ms=None, commit_bytes=None, concurrent_reads=False, cache_size=0, cache_bytes=None, cache_copies=False, codec=None,
+                 compression=None, compression_threshold=1024, compression_level=None, compression_dict=None,
+                 iter_chunk_size=1000, iter_prefetch=False, parallel_decode=None, decode_workers=None, temp_dir=None, spill_mb=None, store=None, name=None):
+        super(SqliteDict, self).__init__(self.__schema, self.__index, filename or self._random_filename(temp_dir), coder, decoder, index=index, persist=persist, commit_every=commit_every, profile=profile, pragmas=pragmas,
+                                         commit_interval_ms=commit_interval_ms, commit_bytes=commit_bytes, concurrent_reads=concurrent_reads, codec=codec,
+                                         compression=compression, compression_threshold=compression_threshold, compression_level=compression_level, compression_dict=compression_dict,
+                                         iter_chunk_size=iter_chunk_size, iter_prefetch=iter_prefetch,
+                                         parallel_decode=parallel_decode, decode_workers=decode_workers,
+                                         temp_dir=temp_dir, spill_mb=spill_mb, store=store, name=name)
+        if cache_size or cache_bytes:
+            self._cache = LRUCache(self._decode_value, max_items=cache_size or None, max_bytes=cache_bytes, copies=cache_copies)
+        else:
+            self._cache = None
+        self._load_indexes()
+        self.update(init_dict)
         
     def __len__(self):
-        with self.lock:
-            with self._closeable_cursor() as cursor:
-                for row in cursor.execute('''SELECT COUNT(*) FROM dict'''):
+        with self._reading() as db:
+            with self._closeable_cursor(db) as cursor:
+                for row in cursor.execute('''SELECT COUNT(*) FROM ''' + self._table):
                     return row[0]
     
     def __getitem__(self, key):
-        with self.lock:
-            if type(key) == slice:
-                raise KeyError("Slices not allowed in SqliteDict")
+        if type(key) == slice:
+            raise KeyError("Slices not allowed in SqliteDict")
+        else:
+            key = self._coder(key)
+            cache = self._cache
+            if cache is not None:
+                self._check_cache()
+                hit, value = cache.get(key)
+                if hit:
+                    return value
+                generation = cache.generation
+            row = self._read_one('''SELECT value FROM ''' + self._table + ''' WHERE key = ?''', (key, ))
+            if row != None:
+                value = self._decode_value(row[0])
+                if cache is not None:
+                    cache.put(key, row[0], value, generation)
+                return value
             else:
-                with self._closeable_cursor() as cursor:
-                    cursor.execute('''SELECT value FROM dict WHERE key = ?''', (self._coder(key), ))
-                    row = cursor.fetchone()
-                    if row != None:
-                        return self._decoder(row[0])
-                    else:
-                        raise KeyError("Mapping key not found in dict")
+                raise KeyError("Mapping key not found in dict")
+    
+    def _check_cache(self):
+        """
+        Empty the read cache if another connection has committed since it was last checked.  Nothing else can open
+        a private in-memory database, and nothing else can commit while this connection holds the write lock, so
+        sqlite only has to be asked when neither is the case.
+        """
+        if not self._private_memory and not self._holds_write_lock() and self._changed_elsewhere():
+            self._cache.clear()
     
     def __setitem__(self, key, value):
         with self.lock:
             if type(key) == slice:
                 raise KeyError("Slices not allowed in SqliteDict")
             else:
-                with self._closeable_cursor() as cursor:
-                    cursor.execute('''REPLACE INTO dict (key, value) VALUES (?, ?)''', (self._coder(key), self._coder(value)))
-            self._do_write()
+                row = (self._coder(key), self._encode_value(value))
+                self._cursor.execute('''REPLACE INTO ''' + self._table + ''' (key, value) VALUES (?, ?)''', row)
+                if self._cache is not None:
+                    #cache what a read would return rather than the caller's (mutable) object
+                    self._cache.discard(row[0])
+                    self._cache.put(row[0], row[1], self._decode_value(row[1]))
+            self._do_write(self._payload_size(row))
                 
     def __delitem__(self, key):
         with self.lock:
             if type(key) == slice:
                 raise KeyError("Slices not allowed in SqliteDict")
             else:
-                with self._closeable_cursor() as cursor:
-                    cursor.execute('''DELETE FROM dict WHERE key = ?''', (self._coder(key),) )
+                key = self._coder(key)
+                self._cursor.execute('''DELETE FROM ''' + self._table + ''' WHERE key = ?''', (key,) )
+                if self._cache is not None:
+                    self._cache.discard(key)
             self._do_write()
                 
     def __iter__(self):
-        with self.lock:
-            with self._closeable_cursor() as cursor:
-                for row in cursor.execute('''SELECT key FROM dict'''):
-                    yield self._decoder(row[0])
+        return self._scan('''key''', (self._decoder, ))
                 
     def __contains__(self, key):
-        with self.lock:
+        if self._cache is not None:
             try:
-                val = self[key]
+                self[key]
             except KeyError:
                 return False
             else:
                 return True
+        if type(key) == slice:
+            raise KeyError("Slices not allowed in SqliteDict")
+        return self._read_one('''SELECT 1 FROM ''' + self._table + ''' WHERE key = ?''', (self._coder(key), )) is not None
         
     def clear(self):
         with self.lock:
             with self._closeable_cursor() as cursor:
-                cursor.execute('''DELETE FROM dict''')
+                cursor.execute('''DELETE FROM ''' + self._table)
+            if self._cache is not None:
+                self._cache.clear()
+            self._do_write()
             
     def get(self, key, default=None):
-        with self.lock:
-            try:
-                val = self[key]
-            except KeyError:
-                val = default
-            return val
+        try:
+            val = self[key]
+        except KeyError:
+            val = default
+        return val
     
-    def pop(self, key, default=None):
+    def pop(self, key, default=MISSING):
         with self.lock:
-            val = self[key]
-            del self[key]
-            return val
+            key = self._coder(key)
+            with self._closeable_cursor() as cursor:
+                if self._returning:
+                    rows = cursor.execute('''DELETE FROM ''' + self._table + ''' WHERE key = ? RETURNING value''', (key, )).fetchall()
+                else:
+                    rows = cursor.execute('''SELECT value FROM ''' + self._table + ''' WHERE key = ?''', (key, )).fetchall()
+                    if rows:
+                        cursor.execute('''DELETE FROM ''' + self._table + ''' WHERE key = ?''', (key, ))
+            if not rows:
+                if default is MISSING:
+                    raise KeyError("Mapping key not found in dict")
+                return default
+            if self._cache is not None:
+                self._cache.discard(key)
+            self._do_write()
+            return self._decode_value(rows[0][0])
     
     def popitem(self):
         with self.lock:
             with self._closeable_cursor() as cursor:
-                cursor.execute('''SELECT key, value FROM dict LIMIT 1''')
-                row = cursor.fetchone()
-                if row ==  None:
-                    raise KeyError("Dict has no more items to pop")
+                if self._returning:
+                    rows = cursor.execute('''DELETE FROM ''' + self._table + ''' WHERE rowid = (SELECT rowid FROM ''' + self._table + ''' LIMIT 1) RETURNING key, value''').fetchall()
                 else:
-                    key = self._decoder(row[0])
-                    value = self._decoder(row[1])
-                    del self[key]
-                    return (key, value)
+                    rows = cursor.execute('''SELECT key, value, rowid FROM ''' + self._table + ''' LIMIT 1''').fetchall()
+                    if rows:
+                        cursor.execute('''DELETE FROM ''' + self._table + ''' WHERE rowid = ?''', (rows[0][2], ))
+            if not rows:
+                raise KeyError("Dict has no more items to pop")
+            if self._cache is not None:
+                self._cache.discard(rows[0][0])
             self._do_write()
+            return (self._decoder(rows[0][0]), self._decode_value(rows[0][1]))
     
     def setdefault(self, key, default=None):
         with self.lock:
             try:
                 return self[key]
             except KeyError:
-                self[key] = default
-                return default
-            self._do_write()
+                pass
+            row = (self._coder(key), self._encode_value(default))
+            with self._closeable_cursor() as cursor:
+                #a no-op if another connection added the key since we looked
+                cursor.execute('''INSERT OR IGNORE INTO ''' + self._table + ''' (key, value) VALUES (?, ?)''', row)
+                inserted = cursor.rowcount
+            if not inserted:
+                #don't keep the write lock the insert took
+                self._end_read_transaction()
+                return self[key]
+            if self._cache is not None:
+                self._cache.discard(row[0])
+                self._cache.put(row[0], row[1], self._decode_value(row[1]))
+            self._do_write(self._payload_size(row))
+            return default
         
     def update(self, other=None, **kwargs):
         with self.lock:
-            if "items" in dir(other):
-                for key, value in other.items():
-                    self[key] = value
+            if other is None or other is self:
+                other = []
+            elif "items" in dir(other):
+                other = other.items()
+            rows = ((self._coder(key), self._encode_value(value)) for key, value in chain(other, kwargs.items()))
+            if self._cache is None:
+                self._bulk_write('''REPLACE INTO ''' + self._table + ''' (key, value) VALUES (?, ?)''', rows)
+                return
+            try:
+                self._bulk_write('''REPLACE INTO ''' + self._table + ''' (key, value) VALUES (?, ?)''', self._refresh_cached(rows))
+            except:
+                #some of the refreshed entries might have been rolled back
+                self._cache.clear()
+                raise
+    
+    def _refresh_cached(self, rows):
+        """
+        Pass rows through, updating the cache entries of keys that are already cached.
+        Keys that aren't cached are left alone so a big update doesn't flush the whole cache.
+        """
+        cache = self._cache
+        for row in rows:
+            if row[0] in cache:
+                cache.discard(row[0])
+                cache.put(row[0], row[1], self._decode_value(row[1]))
+            yield row
+    
+    def get_many(self, keys, default=MISSING):
+        """
+        Look up keys with as few IN (...) queries as possible, returning their values in the same order as keys,
+        with default (the MISSING sentinel unless given) for keys that aren't in the dict
+        """
+        encoded = [self._coder(key) for key in keys]
+        values = [default] * len(encoded)
+        cache = self._cache
+        if cache is not None:
+            self._check_cache()
+            generation = cache.generation
+        #encoded key -> positions it was asked for at
+        wanted = {}
+        for position, key in enumerate(encoded):
+            if cache is not None:
+                hit, value = cache.get(key)
+                if hit:
+                    values[position] = value
+                    continue
+            wanted.setdefault(key, []).append(position)
+        for key, raw in self._rows_for_keys('''key, value''', wanted):
+            for position in wanted[key]:
+                #like separate lookups, every position gets its own decoded object
+                values[position] = self._decode_value(raw)
+            if cache is not None:
+                cache.put(key, raw, values[position], generation)
+        return values
+    
+    def _rows_for_keys(self, columns, keys):
+        """
+        Yield columns of the rows whose encoded key is in keys, one IN (...) query per _max_variables keys.
+        The lock (or read connection) is only held while a chunk is read.
+        """
+        for chunk in self._chunked(keys, self._max_variables):
+            with self._reading() as db:
+                with self._closeable_cursor(db) as cursor:
+                    cursor.execute('''SELECT ''' + columns + ''' FROM ''' + self._table + ''' WHERE key IN (''' + ", ".join("?" * len(chunk)) + ''')''', chunk)
+                    rows = cursor.fetchall()
+            for row in rows:
+                yield row
+    
+    def contains_many(self, keys):
+        """
+        Return a list of booleans saying whether each of keys is in the dict, in the same order as keys
+        """
+        encoded = [self._coder(key) for key in keys]
+        found = set(row[0] for row in self._rows_for_keys('''key''', set(encoded)))
+        return [key in found for key in encoded]
+    
+    def set_many(self, mapping):
+        """
+        Set every key/value pair of mapping (a dict or an iterable of (key, value) pairs) in one transaction
+        """
+        self.update(mapping)
+    
+    def delete_many(self, keys):
+        """
+        Delete keys with one IN (...) statement per chunk of keys, all in one transaction.  Keys that aren't in
+        the dict are ignored.  Returns the number of keys deleted.
+        """
+        with self.lock:
+            deleted = 0
+            with self._closeable_cursor() as cursor:
+                with self._savepoint(cursor):
+                    for chunk in self._chunked(set(self._coder(key) for key in keys), self._max_variables):
+                        cursor.execute('''DELETE FROM ''' + self._table + ''' WHERE key IN (''' + ", ".join("?" * len(chunk)) + ''')''', chunk)
+                        deleted += cursor.rowcount
+                        if self._cache is not None:
+                            for key in chunk:
+                                self._cache.discard(key)
+            self._do_write()
+            return deleted
+    
+    def _load_indexes(self):
+        """
+        Set up the indexes recorded in the database.  Ones made from python functions can't be, so they're
+        dropped until create_index() is called again.
+        """
+        self._indexes = {}
+        prefix = self._meta_prefix + "index:"
+        with self.lock:
+            with self._closeable_cursor() as cursor:
+                rows = cursor.execute('''SELECT name, value FROM meta WHERE substr(name, 1, ?) = ?''', (len(prefix), prefix)).fetchall()
+                orphans = []
+                for meta_name, definition in rows:
+                    path = json.loads(definition).get("path")
+                    if path is not None:
+                        self._indexes[meta_name[len(prefix):]] = self._index_expression(meta_name[len(prefix):], path, None)
+                    else:
+                        orphans.append(meta_name)
+                if not orphans:
+                    return
+                #this connection doesn't have the function, and sqlite would fail every write on an index it can't compute
+                with self._savepoint(cursor):
+                    for meta_name in orphans:
+                        cursor.execute('''DROP INDEX IF EXISTS "''' + self._name + '''_by_''' + meta_name[len(prefix):] + '''"''')
+                        cursor.execute('''DELETE FROM meta WHERE name = ?''', (meta_name, ))
+            self._commit_setup()
+    
+    def _index_expression(self, name, path, function):
+        """
+        Return (sql expression for the indexed field, whether it needs a python function).  Paths use the same
+        expression as query(), so queries on them use the index too.
+        """
+        if path is not None:
+            return self._field_expression(path)
+        sql_name = self._name + "_field_" + name
+        self._create_function(sql_name, partial(_index_function, self._decode_value, function))
+        return sql_name + '''(value)''', True
+    
+    def create_index(self, field, name=None):
+        """
+        Index the values of the dict by field: a JSON path like "$.user.id" or "$.tags[0]" ("user_id" is short
+        for "$.user_id"), or a function that takes a value and returns what to index it by.  Values without the
+        field are indexed as None.  sqlite keeps the index up to date through every write, and find() and
+        find_range() look things up in it by name, which defaults to the path (or the function's name).
+        
+        Path indexes are recorded in the database and set up again whenever it's opened.  Indexes on functions
+        are rebuilt every time this is called, and are dropped when the dict is opened again, since the new
+        connection can't compute them.
+        """
+        with self.lock:
+            if callable(field):
+                path = None
+                name = name or getattr(field, "__name__", "")
             else:
-                for key, value in other:
-                    self[key] = value
-            for key, value in kwargs:
-                self[key] = value
+                path = _json_path(field)
+                name = name or re.sub(r'[^A-Za-z0-9_]+', "_", path[1:]).strip("_")
+            if not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', name):
+                raise ValueError("Bad index name " + repr(name) + ", pass a name made of letters, digits and underscores")
+            definition = {"path": path} if path is not None else {"function": True}
+            index_name = '''"''' + self._name + '''_by_''' + name + '''"'''
+            with self._closeable_cursor() as cursor:
+                stored = self._get_meta(cursor, "index:" + name)
+                if stored is not None and json.loads(stored) != definition:
+                    raise ValueError("There is already an index called " + repr(name) + " on something else")
+                expression = self._index_expression(name, path, field if path is None else None)
+                with self._savepoint(cursor):
+                    if path is None:
+                        #the function might not be the one the index was built with
+                        cursor.execute('''DROP INDEX IF EXISTS ''' + index_name)
+                    cursor.execute('''CREATE INDEX IF NOT EXISTS ''' + index_name + ''' ON ''' + self._table + ''' (''' + expression[0] + ''')''')
+                    self._set_meta(cursor, "index:" + name, json.dumps(definition))
+            self._indexes[name] = expression
+            self._do_write()
+    
+    def drop_index(self, name):
+        """
+        Delete the index called name
+        """
+        with self.lock:
+            if name not in self._indexes:
+                raise KeyError("No index called " + repr(name))
+            with self._closeable_cursor() as cursor:
+                with self._savepoint(cursor):
+                    cursor.execute('''DROP INDEX IF EXISTS "''' + self._name + '''_by_''' + name + '''"''')
+                    cursor.execute('''DELETE FROM meta WHERE name = ?''', (self._meta_prefix + "index:" + name, ))
+            del self._indexes[name]
+            self._do_write()
+    
+    def _index_for(self, name):
+        if name not in self._indexes:
+            raise ValueError("No index called " + repr(name) + ", make one with create_index()")
+        return self._indexes[name]
+    
+    def _found(self, expressions, condition, parameters):
+        """
+        Return the decoded (key, value) items of the rows matching condition on the indexed expressions
+        """
+        rows = self._fetch_all('''SELECT key, value FROM ''' + self._table + ''' WHERE ''' + condition, parameters,
+                               any(needs_function for expression, needs_function in expressions))
+        return [(self._decoder(key), self._decode_value(value)) for key, value in rows]
+    
+    def find(self, **fields):
+        """
+        Return a list of the (key, value) items whose indexed fields are equal to the values given for them by
+        index name, e.g. d.find(user_id=42).  With more than one field, items have to match all of them.
+        find(user_id=None) finds the values that don't have a user_id.
+        """
+        if not fields:
+            raise ValueError("find() needs at least one index name=value")
+        expressions = [self._index_for(name) for name in sorted(fields)]
+        condition = ''' AND '''.join(expression + ''' IS ?''' for expression, needs_function in expressions)
+        return self._found(expressions, condition, [_index_value(fields[name]) for name in sorted(fields)])
+    
+    def find_range(self, name, low=None, high=None, limit=None, descending=False):
+        """
+        Return a list of the (key, value) items with low <= field < high in the index called name, sorted by
+        the field.  Either end can be left open with None, and values without the field are never included.
+        Like everything in sqlite, numbers sort before strings.
+        """
+        expression = self._index_for(name)
+        conditions = [expression[0] + ''' IS NOT NULL''']
+        parameters = []
+        if low is not None:
+            conditions.append(expression[0] + ''' >= ?''')
+            parameters.append(_index_value(low))
+        if high is not None:
+            conditions.append(expression[0] + ''' < ?''')
+            parameters.append(_index_value(high))
+        condition = ''' AND '''.join(conditions) + ''' ORDER BY ''' + expression[0] + (''' DESC''' if descending else '''''')
+        if limit is not None:
+            condition += ''' LIMIT ?'''
+            parameters.append(limit)
+        return self._found([expression], condition, parameters)
+    
+    def query(self):
+        """
+        Start a Query on the values of the dict, which gives back (key, value) items unless told to select()
+        something else.  Conditions and sorts on indexed paths use the index.
+        """
+        return Query(self, "key")
+    
+    def _rolled_back(self):
+        if self._cache is not None:
+            self._cache.clear()
+    
+    def get_cache_stats(self):
+        """
+        Return a dict of read cache counters: hits, misses, evictions and the number of items and encoded bytes
+        currently cached.  Returns None if the cache is turned off.
+        """
+        if self._cache is None:
+            return None
+        return self._cache.stats()
             
     
     class ItemView(object):
@@ -144,8 +460,8 @@ class SqliteDict(SqliteObject):
         
         def __contains__(self, item):
             key, value = item
-            with self._sq_dict._closeable_cursor() as cursor:
-                cursor.execute('''SELECT * FROM dict WHERE key = ? AND value = ?''', (self._sq_dict._coder(key), self._sq_dict._coder(value)))
+            with self._sq_dict._reading() as db, self._sq_dict._closeable_cursor(db) as cursor:
+                cursor.execute('''SELECT * FROM ''' + self._sq_dict._table + ''' WHERE key = ? AND value = ?''', (self._sq_dict._coder(key), self._sq_dict._encode_value(value)))
                 val = cursor.fetchone()
                 if val == None:
                     return False
@@ -153,17 +469,15 @@ class SqliteDict(SqliteObject):
                     return True
             
         def __iter__(self):
-            with self._sq_dict._closeable_cursor() as cursor:
-                for row in cursor.execute('''SELECT key, value FROM dict'''):
-                    yield self._sq_dict._decoder(row[0]), self._sq_dict._decoder(row[1])
+            return self._sq_dict._scan('''key, value''', (self._sq_dict._decoder, self._sq_dict._decode_value))
                     
     class KeyView(object):
         def __init__(self, sq_dict):
             self._sq_dict = sq_dict
         
         def __contains__(self, key):
-            with self._sq_dict._closeable_cursor() as cursor:
-                cursor.execute('''SELECT * FROM dict WHERE key = ? ''', (self._sq_dict._coder(key), ))
+            with self._sq_dict._reading() as db, self._sq_dict._closeable_cursor(db) as cursor:
+                cursor.execute('''SELECT * FROM ''' + self._sq_dict._table + ''' WHERE key = ? ''', (self._sq_dict._coder(key), ))
                 val = cursor.fetchone()
                 if val == None:
                     return False
@@ -171,17 +485,15 @@ class SqliteDict(SqliteObject):
                     return True
             
         def __iter__(self):
-            with self._sq_dict._closeable_cursor() as cursor:
-                for row in cursor.execute('''SELECT key FROM dict'''):
-                    yield self._sq_dict._decoder(row[0])
+            return iter(self._sq_dict)
                     
     class ValueView(object):
         def __init__(self, sq_dict):
             self._sq_dict = sq_dict
         
         def __contains__(self, value):
-            with self._sq_dict._closeable_cursor() as cursor:
-                cursor.execute('''SELECT * FROM dict WHERE value = ? ''', (self._sq_dict._coder(value), ))
+            with self._sq_dict._reading() as db, self._sq_dict._closeable_cursor(db) as cursor:
+                cursor.execute('''SELECT * FROM ''' + self._sq_dict._table + ''' WHERE value = ? ''', (self._sq_dict._encode_value(value), ))
                 val = cursor.fetchone()
                 if val == None:
                     return False
@@ -189,9 +501,7 @@ class SqliteDict(SqliteObject):
                     return True
             
         def __iter__(self):
-            with self._sq_dict._closeable_cursor() as cursor:
-                for row in cursor.execute('''SELECT value FROM dict'''):
-                    yield self._sq_dict._decoder(row[0])
+            return self._sq_dict._scan('''value''', (self._sq_dict._decode_value, ))
     
     def items(self):
         return self.ItemView(self)
@@ -203,55 +513,64 @@ class SqliteDict(SqliteObject):
         return self.ValueView(self)
     
     
+    def _encoded_item_chunks(self, key_coder, value_coder):
+        """
+        Yield lists of (encoded key, encoded value) pairs.  Where a coder would just give back what's stored,
+        the stored text is passed along as it is.
+        """
+        plain_keys = key_coder is json.dumps and self._plain_json(values=False)
+        plain_values = value_coder is json.dumps and self._plain_json()
+        if plain_keys and plain_values:
+            return ([(row[1], row[2]) for row in rows] for rows in self._row_chunks('''key, value'''))
+        #unicode passes stored text through untouched (and can be pickled for a process pool)
+        chunks = self._scan_chunks('''key, value''', (unicode if plain_keys else self._decoder, unicode if plain_values else self._decode_value))
+        return ([(key if plain_keys else unicode(key_coder(key)), value if plain_values else unicode(value_coder(value))) for key, value in chunk]
+                for chunk in chunks)
+    
     def write(self, outfile):
+        """
+        Write the dict to outfile as a JSON object, with every key turned into a string
+        """
         with self.lock:
-            outfile.write(u"{")
-            iterator = iter(self.items())
-            try:
-                try:
-                    this = iterator.__next__()
-                except AttributeError:
-                    this = iterator.next()
-            except StopIteration:
-                outfile.write("}")
-                return
+            def key_text(key):
+                #plain JSON strings are already what json.dumps(str(key)) gives
+                if key[:1] == u'"':
+                    return key
+                return unicode(json.dumps(str(json.loads(key))))
+            if self._plain_json(values=False):
+                chunks = ([key_text(key) + u":" + value for key, value in chunk] for chunk in self._encoded_item_chunks(json.dumps, json.dumps))
             else:
-                while True:
-                    outfile.write(unicode(json.dumps(str(this[0]))))
-                    outfile.write(u":")
-                    outfile.write(unicode(json.dumps(this[1])))
-                    try:
-                        try:
-                            this = iterator.__next__()
-                        except AttributeError:
-                            this = iterator.next()
-                    except StopIteration:
-                        outfile.write(u"}")
-                        break
-                    else:
-                        outfile.write(u",")
+                chunks = ([key + u":" + value for key, value in chunk] for chunk in self._encoded_item_chunks(lambda key: json.dumps(str(key)), json.dumps))
+            self._write_joined(outfile, chunks, u",", u"{", u"}")
                         
     def write_lines(self, outfile, key_coder=json.dumps, value_coder=json.dumps, separator=u"\n", key_val_separator=u"\t"):
+        """
+        Write each key and value of the dict to outfile, encoded with key_coder and value_coder, separated by
+        key_val_separator and followed by separator
+        """
         with self.lock:
-            iterator = iter(self.items())
-            try:
-                try:
-                    this = iterator.__next__()
-                except AttributeError:
-                    this = iterator.next()
-            except StopIteration:
-                return
-            else:
-                while True:
-                    outfile.write(unicode(key_coder(this[0])))
-                    outfile.write(unicode(key_val_separator))
-                    outfile.write(unicode(value_coder(this[1])))
-                    outfile.write(unicode(separator))
-                    try:
-                        try:
-                            this = iterator.__next__()
-                        except AttributeError:
-                            this = iterator.next()
-                    except StopIteration:
-                        break
-                    
\ No newline at end of file
+            key_val_separator = unicode(key_val_separator)
+            chunks = ([key + key_val_separator + value for key, value in chunk] for chunk in self._encoded_item_chunks(key_coder, value_coder))
+            self._write_joined(outfile, chunks, unicode(separator), terminated=True)
+    
+    @classmethod
+    def load_lines(cls, infile, key_decoder=json.loads, value_decoder=json.loads, key_val_separator=u"\t", **kwargs):
+        """
+        Make a new SqliteDict (kwargs are passed on to SqliteDict) out of lines of infile like the ones
+        write_lines() writes: a key and a value, decoded with key_decoder and value_decoder, separated by
+        key_val_separator.  Blank lines are skipped.  The file is read and written to the database a chunk at a time.
+        """
+        def items():
+            for line in infile:
+                if line.strip():
+                    key, value = line.rstrip(u"\r\n").split(key_val_separator, 1)
+                    yield key_decoder(key), value_decoder(value)
+        return cls._loaded(kwargs, lambda loaded: loaded.update(items()))
+    
+    @classmethod
+    def load_json(cls, infile, **kwargs):
+        """
+        Make a new SqliteDict (kwargs are passed on to SqliteDict) out of the JSON object in infile, which is
+        parsed and written to the database an item at a time rather than loaded all at once
+        """
+        return cls._loaded(kwargs, lambda loaded: loaded.update(iter_object(infile)))
@@ -1,5 +1,14 @@
+from ._json_stream import iter_array
+from ._query import Query
 from ._sqlite_object import SqliteObject
-import json, uuid
+import json, struct
+
+from bisect import bisect_right
+
+try:
+    from hashlib import blake2b
+except ImportError:
+    blake2b = None
 
 """
 from sqlite_object import  SqliteList
@@ -13,250 +22,770 @@ try:
 except NameError:
     unicode = str
 
+def _value_hash(value):
+    """
+    64 bit digest of an encoded value, for the hash index
+    """
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return struct.unpack("<q", blake2b(value, digest_size=8).digest())[0]
+
 class SqliteList(SqliteObject):
     """
     List-like object backed by an on-disk SQL db
     
     Supports:
     - Indexing
-    - Slicing (fairly efficient, but not insanely so)
-    - Overwriting list elements
+    - Slicing (each slice reads its range a chunk at a time)
+    - Overwriting list elements, slice assignment
     - Adding items to either end of the list
     - Removing items from either end of the list
-    - Checking if the list contains an item
+    - Inserting and deleting items anywhere in the list (insert(), remove() and del only move the items of one block)
+    - Checking if the list contains an item, finding and counting items (through a hash index)
     - Efficient iteration over the whole list (forward and reversed()) 
     
-    Doesn't support:
-    - Inserting items into the middle of the list
-    - Deleting items from the middle of the list
+    Items are stored in blocks: runs of consecutive list_indexes, each in a region of 2**_block_bits list_indexes
+    to itself, with empty regions left between blocks.  Positions are mapped to list_indexes through a cached map
+    of the blocks, so a change in the middle of the list only has to move the items of the block it's in.  Blocks
+    that grow too big are split up into the empty regions around them, and only if there's no room left there is
+    the whole list laid out again.
     """
     
-    __schema = '''CREATE TABLE IF NOT EXISTS list (list_index INTEGER PRIMARY KEY, value TEXT)'''
-    __index = '''CREATE INDEX IF NOT EXISTS list_value ON list (value)'''
+    #value_hash is only filled in while there's a hash index
+    __schema = '''CREATE TABLE IF NOT EXISTS {table} (list_index INTEGER PRIMARY KEY, value {value_type}, value_hash INTEGER)'''
+    _table = "list"
+    _name = "list"
+    _index_modes = ("none", "hash", "full")
+    #every block has a region of 2**_block_bits list_indexes to itself
+    _block_bits = 20
+    #appends and prepends start a new block every _block_rows items, and blocks that grow past twice that are split
+    _block_rows = 512
+    #regions left empty between the blocks that appends and prepends start, for split blocks to go in
+    _block_spacing = 1024
     
     
-    def __init__(self, init_list = [], filename=None, coder=json.dumps, decoder=json.loads, index=True, persist=False, commit_every=0):
-        super(SqliteList, self).__init__(self.__schema, self.__index, filename or str(uuid.uuid4())+".sqlite3", coder, decoder, index=index, persist=persist, commit_every=commit_every)
+    def __init__(self, init_list = [], filename=None, coder=json.dumps, decoder=json.loads, index=True, persist=False, commit_every=0, profile=None, pragmas=None,
+                 commit_interval_ms=None, commit_bytes=None, concurrent_reads=False, codec=None,
+                 compression=None, compression_threshold=1024, compression_level=None, compression_dict=None,
+                 iter_chunk_size=1000, iter_prefetch=False, parallel_decode=None, decode_workers=None, temp_dir=None, spill_mb=None, store=None, name=None):
+        #the value index is set up below, once the table is there
+        super(SqliteList, self).__init__(self.__schema, None, filename or self._random_filename(temp_dir), coder, decoder, index=False, persist=persist, commit_every=commit_every, profile=profile, pragmas=pragmas,
+                                         commit_interval_ms=commit_interval_ms, commit_bytes=commit_bytes, concurrent_reads=concurrent_reads, codec=codec,
+                                         compression=compression, compression_threshold=compression_threshold, compression_level=compression_level, compression_dict=compression_dict,
+                                         iter_chunk_size=iter_chunk_size, iter_prefetch=iter_prefetch,
+                                         parallel_decode=parallel_decode, decode_workers=decode_workers,
+                                         temp_dir=temp_dir, spill_mb=spill_mb, store=store, name=name)
         
-        for item in init_list:
-            self.append(item)
+        self._set_up_index(index)
+        #the first and last list_index of each block, and the position it starts at (see _blocks())
+        self._firsts = []
+        self._lasts = []
+        self._starts = []
+        self._blocks_valid = False
+        self.extend(init_list)
                 
         
-    def _getlen(self, cursor):
-        for row in cursor.execute('''SELECT COUNT(*) FROM list'''):
-            return row[0]
-    def _getmin(self, cursor):
-        for row in cursor.execute('''SELECT MIN(list_index) FROM list'''):
-            return row[0]
-    def _getmax(self, cursor):
-        for row in cursor.execute('''SELECT MAX(list_index) FROM list'''):
-            return row[0]
-    def _getitem(self, cursor, item):
-        for row in cursor.execute('''SELECT value FROM list WHERE list_index = (SELECT MIN(list_index) FROM list) + ?''', (item, )):
-            return self._decoder(row[0])
+    def _blocks(self):
+        """
+        Make sure the cached block map is up to date and return the length of the list.
         
-    def __len__(self):
+        The map is only re-read if another connection has committed changes to the database since we last looked.
+        Reading it takes a lookup per block, hopping from each block to the first list_index in a later region.
+        Starting positions are relative to the first block's, so blocks can be added at the front without moving
+        the others along.
+        """
+        with self.lock:
+            if self._changed_elsewhere() or not self._blocks_valid:
+                region_end = '''(((first >> ''' + str(self._block_bits) + ''') + 1) << ''' + str(self._block_bits) + ''')'''
+                rows = self._cursor.execute('''WITH RECURSIVE blocks(first) AS (
+                                                   SELECT MIN(list_index) FROM ''' + self._table + '''
+                                                   UNION ALL
+                                                   SELECT (SELECT MIN(list_index) FROM ''' + self._table + ''' WHERE list_index >= ''' + region_end + ''')
+                                                   FROM blocks WHERE first IS NOT NULL)
+                                               SELECT first, (SELECT MAX(list_index) FROM ''' + self._table + ''' WHERE list_index < ''' + region_end + ''')
+                                               FROM blocks WHERE first IS NOT NULL''').fetchall()
+                self._set_blocks([row[0] for row in rows], [row[1] for row in rows])
+            return self._length()
+    
+    def _set_up_index(self, index):
+        """
+        Work out the value index mode (recorded in the database the first time) and build or drop indexes to
+        match if it has changed
+        """
+        if index is True:
+            requested = None
+        elif index is False:
+            requested = "none"
+        elif index in self._index_modes:
+            requested = index
+        else:
+            raise ValueError("index should be True, False, \"none\", \"hash\" or \"full\", not " + repr(index))
+        if requested == "hash" and blake2b is None:
+            raise ValueError("index=\"hash\" needs hashlib.blake2b (python 3.6 or newer)")
         with self.lock:
             with self._closeable_cursor() as cursor:
-                return self._getlen(cursor)
+                recorded = self._get_meta(cursor, "value_index")
+                stored = recorded
+                if stored is None and cursor.execute('''SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?''', (self._name + "_value", )).fetchone():
+                    #lists from before there were index modes have the full value index, if any
+                    stored = "full"
+                mode = requested or stored or ("hash" if blake2b is not None else "full")
+                if mode != stored:
+                    with self._savepoint(cursor):
+                        if mode != "full":
+                            cursor.execute('''DROP INDEX IF EXISTS ''' + self._name + '''_value''')
+                        if mode != "hash":
+                            cursor.execute('''DROP INDEX IF EXISTS ''' + self._name + '''_value_hash''')
+                        if mode == "full":
+                            cursor.execute('''CREATE INDEX IF NOT EXISTS ''' + self._name + '''_value ON ''' + self._table + ''' (value)''')
+                        elif mode == "hash":
+                            if "value_hash" not in [row[1] for row in cursor.execute('''PRAGMA table_info(''' + self._table + ''')''')]:
+                                cursor.execute('''ALTER TABLE ''' + self._table + ''' ADD COLUMN value_hash INTEGER''')
+                            #hashes of rows written while there wasn't a hash index are missing or out of date
+                            self._db.create_function("sqlite_object_value_hash", 1, _value_hash)
+                            cursor.execute('''UPDATE ''' + self._table + ''' SET value_hash = sqlite_object_value_hash(value)''')
+                            cursor.execute('''CREATE INDEX IF NOT EXISTS ''' + self._name + '''_value_hash ON ''' + self._table + ''' (value_hash)''')
+                if mode != recorded:
+                    self._set_meta(cursor, "value_index", mode)
+        self._hashed = mode == "hash"
+        #the columns and placeholders of every statement that writes rows
+        self._row_values = ''' (list_index, value, value_hash) VALUES (?, ?, ?)''' if self._hashed else ''' (list_index, value) VALUES (?, ?)'''
+        if mode != recorded:
+            self._commit_setup()
     
-    def _minindex(self):
+    def get_index_mode(self):
+        """
+        Return how items are indexed for lookups by value: "none", "hash" or "full"
+        """
         with self.lock:
-            #find the lowest index
             with self._closeable_cursor() as cursor:
-                for row in cursor.execute('''SELECT MIN(list_index) FROM list'''):
-                    return row[0]
-            #if there's nothing in the list, return 0
+                return self._get_meta(cursor, "value_index")
+    
+    def _row(self, list_index, value):
+        """
+        Parameters for a _row_values statement, with the hash of the encoded value if there's a hash index
+        """
+        if self._hashed:
+            return (list_index, value, _value_hash(value))
+        return (list_index, value)
+    
+    def _value_condition(self, item):
+        """
+        Return a WHERE condition and its parameters for the rows holding item, using the hash index if there is one
+        """
+        value = self._encode_value(item)
+        if self._hashed:
+            #the hash narrows it down, comparing values rules out collisions
+            return '''value_hash = ? AND value = ?''', (_value_hash(value), value)
+        return '''value = ?''', (value, )
+    
+    def _set_blocks(self, firsts, lasts):
+        self._firsts = firsts
+        self._lasts = lasts
+        self._starts = []
+        start = 0
+        for first, last in zip(firsts, lasts):
+            self._starts.append(start)
+            start += last - first + 1
+        self._blocks_valid = True
+    
+    def _rolled_back(self):
+        self._blocks_valid = False
+    
+    def _length(self):
+        if not self._firsts:
             return 0
+        return self._starts[-1] - self._starts[0] + self._lasts[-1] - self._firsts[-1] + 1
+    
+    def _locate(self, position):
+        """
+        Return (block, offset into the block) for a position in the list
+        """
+        start = self._starts[0] + position
+        block = bisect_right(self._starts, start) - 1
+        return block, start - self._starts[block]
+    
+    def _key_at(self, position):
+        block, offset = self._locate(position)
+        return self._firsts[block] + offset
+    
+    def _position_of(self, list_index):
+        block = bisect_right(self._firsts, list_index) - 1
+        return self._starts[block] - self._starts[0] + list_index - self._firsts[block]
+    
+    def _position(self, key):
+        """
+        Map a (possibly negative) position to one from the start of the list, raising IndexError if it's out of range
+        """
+        length = self._blocks()
+        if key < 0:
+            key = length + key
+        if key < 0 or key >= length:
+            raise IndexError("Sequence index out of range.")
+        return key
+    
+    def _list_index(self, key):
+        return self._key_at(self._position(key))
         
-    def _iterate(self, length, irange):
-        for i in irange:
-            if i >= 0 and i<length:
-                yield self[i]
+    def __len__(self):
+        with self.lock:
+            return self._blocks()
+        
+    def _positions(self, key):
+        """
+        Return the range of positions selected by slice key
+        """
+        return range(self._blocks())[key]
+    
+    def _slice(self, positions):
+        """
+        Generator over the items at positions, read as a range of list_index
+        """
+        if len(positions) == 0:
+            return iter(())
+        return self._between(self._key_at(min(positions[0], positions[-1])), self._key_at(max(positions[0], positions[-1])), positions.step)
+    
+    def _between(self, low, high, step):
+        """
+        Generator over every step-th item from list_index low to high (from high to low if step is negative).
+        
+        Like _row_chunks(), the range is read in keyset chunks of _iter_chunk_size rows, so the lock is only
+        held while a chunk is being read and not while the caller works through the items.
+        """
+        query = '''SELECT list_index, value FROM ''' + self._table + ''' WHERE list_index BETWEEN ? AND ? ORDER BY list_index ''' + ('''ASC''' if step > 0 else '''DESC''') + ''' LIMIT ?'''
+        size = self._iter_chunk_size
+        i = 0
+        while True:
+            with self._reading() as db:
+                with self._closeable_cursor(db) as cursor:
+                    rows = cursor.execute(query, (low, high, size)).fetchall()
+            for list_index, value in rows:
+                #there can be gaps between blocks, so the items to skip are counted rather than worked out from list_index
+                if i % step == 0:
+                    yield self._decode_value(value)
+                i += 1
+            if len(rows) < size:
+                return
+            if step > 0:
+                low = rows[-1][0] + 1
+            else:
+                high = rows[-1][0] - 1
+    
+    def _shift(self, cursor, first, last, delta):
+        """
+        Add delta to the list_index of every row between first and last (inclusive).
+        
+        The rows are moved past the end of the list first so that no row ever collides with another one on the
+        way to its new list_index.  The caller has to make sure the destination range is free.
+        """
+        if last < first or delta == 0:
+            return
+        offset = (self._lasts[-1] - first + 1) + (last - first + 1) + abs(delta)
+        cursor.execute('''UPDATE ''' + self._table + ''' SET list_index = list_index + ? WHERE list_index BETWEEN ? AND ?''', (offset, first, last))
+        cursor.execute('''UPDATE ''' + self._table + ''' SET list_index = list_index - ? WHERE list_index BETWEEN ? AND ?''', (offset - delta, first + offset, last + offset))
+    
+    def _resize(self, block, delta):
+        """
+        Account for delta items added to (or taken from) block in the block map: every later block now starts delta
+        positions further on, which is done by moving the start of every earlier block back instead if that's fewer
+        """
+        if block < len(self._starts) // 2:
+            for i in range(block + 1):
+                self._starts[i] -= delta
+        else:
+            for i in range(block + 1, len(self._starts)):
+                self._starts[i] += delta
+        
+    def _replace_blocks(self, first_block, last_block, firsts, lasts):
+        """
+        Put the blocks from firsts and lasts in place of blocks first_block to last_block in the block map
+        """
+        start = self._starts[first_block]
+        end = self._starts[last_block] + self._lasts[last_block] - self._firsts[last_block] + 1
+        starts = []
+        for first, last in zip(firsts, lasts):
+            starts.append(start)
+            start += last - first + 1
+        self._firsts[first_block:last_block + 1] = firsts
+        self._lasts[first_block:last_block + 1] = lasts
+        self._starts[first_block:last_block + 1] = starts
+        for i in range(first_block + len(firsts), len(self._starts)):
+            self._starts[i] += start - end
+    
+    def _relayout(self, cursor, first_block, last_block, pieces):
+        """
+        Replace blocks first_block to last_block with pieces, laid out again as blocks of at most _block_rows items
+        spread over the empty regions between the blocks either side.  Each piece is (list_index, count) for a run
+        of rows already in those blocks (any other rows in them have to have been deleted already) or (None, items)
+        for new encoded items.  If there aren't enough empty regions, the whole list is laid out again.
+        """
+        bits = self._block_bits
+        total = sum(len(items) if list_index is None else items for list_index, items in pieces)
+        blocks = (total + self._block_rows - 1) // self._block_rows
+        low = self._firsts[first_block - 1] >> bits if first_block > 0 else None
+        high = self._firsts[last_block + 1] >> bits if last_block + 1 < len(self._firsts) else None
+        if low is not None and high is not None:
+            if high - low - 1 < blocks:
+                pieces = ([(self._firsts[i], self._lasts[i] - self._firsts[i] + 1) for i in range(first_block)] + pieces +
+                          [(self._firsts[i], self._lasts[i] - self._firsts[i] + 1) for i in range(last_block + 1, len(self._firsts))])
+                return self._relayout(cursor, 0, len(self._firsts) - 1, pieces)
+            regions = [low + (i + 1) * (high - low) // (blocks + 1) for i in range(blocks)]
+        elif low is not None:
+            regions = [low + (i + 1) * self._block_spacing for i in range(blocks)]
+        elif high is not None:
+            regions = [high - (blocks - i) * self._block_spacing for i in range(blocks)]
+        else:
+            regions = [i * self._block_spacing for i in range(blocks)]
+        sizes = [total // blocks + (1 if i < total % blocks else 0) for i in range(blocks)]
+        #each block goes in the middle of its region, so it has room to grow either way
+        firsts = [(region << bits) + (1 << (bits - 1)) - size // 2 for region, size in zip(regions, sizes)]
+        lasts = [first + size - 1 for first, size in zip(firsts, sizes)]
+        offset = 0
+        if any(list_index is not None for list_index, items in pieces):
+            #move the old rows past the end of both the list and the new blocks, so they can't collide on the way
+            offset = max(self._lasts[-1], lasts[-1] if lasts else 0) + 1 - self._firsts[first_block]
+            cursor.execute('''UPDATE ''' + self._table + ''' SET list_index = list_index + ? WHERE list_index BETWEEN ? AND ?''',
+                           (offset, self._firsts[first_block], self._lasts[last_block]))
+        moves = []
+        rows = []
+        block = 0
+        filled = 0
+        for list_index, items in pieces:
+            size = len(items) if list_index is None else items
+            done = 0
+            while done < size:
+                n = min(size - done, sizes[block] - filled)
+                target = firsts[block] + filled
+                if list_index is None:
+                    rows.extend(self._row(target + i, items[done + i]) for i in range(n))
+                else:
+                    moved = list_index + offset + done
+                    moves.append((target - moved, moved, moved + n - 1))
+                done += n
+                filled += n
+                if filled == sizes[block]:
+                    block += 1
+                    filled = 0
+        cursor.executemany('''UPDATE ''' + self._table + ''' SET list_index = list_index + ? WHERE list_index BETWEEN ? AND ?''', moves)
+        cursor.executemany('''INSERT INTO ''' + self._table + self._row_values, rows)
+        self._replace_blocks(first_block, last_block, firsts, lasts)
+    
+    def _end_keys(self, at_end, blocks):
+        """
+        Generator over list_indexes for items added one after another at the end (or the front) of the list: the
+        next one along in the last (or first) block, or the middle of a new region once that's full.  The blocks
+        it adds to are recorded in blocks as [first, last] lists, for _add_end_blocks() once the rows are written.
+        """
+        bits = self._block_bits
+        if self._firsts:
+            blocks.append([self._firsts[-1], self._lasts[-1]] if at_end else [self._firsts[0], self._lasts[0]])
+        while True:
+            if not blocks:
+                #an empty list starts at 0
+                blocks.append([0, 0])
+                yield 0
+                continue
+            block = blocks[-1]
+            list_index = block[1] + 1 if at_end else block[0] - 1
+            if block[1] - block[0] + 1 >= self._block_rows or list_index >> bits != block[0] >> bits:
+                region = (block[0] >> bits) + (self._block_spacing if at_end else -self._block_spacing)
+                list_index = (region << bits) + (1 << (bits - 1)) - (0 if at_end else 1)
+                blocks.append([list_index, list_index])
+            elif at_end:
+                block[1] = list_index
+            else:
+                block[0] = list_index
+            yield list_index
+    
+    def _add_end_blocks(self, at_end, blocks):
+        """
+        Put the blocks recorded by _end_keys() in the block map
+        """
+        if not blocks:
+            return
+        if not self._firsts:
+            self._set_blocks([block[0] for block in blocks[::1 if at_end else -1]], [block[1] for block in blocks[::1 if at_end else -1]])
+        elif at_end:
+            self._lasts[-1] = blocks[0][1]
+            for first, last in blocks[1:]:
+                self._starts.append(self._starts[-1] + self._lasts[-1] - self._firsts[-1] + 1)
+                self._firsts.append(first)
+                self._lasts.append(last)
+        else:
+            self._starts[0] -= self._firsts[0] - blocks[0][0]
+            self._firsts[0] = blocks[0][0]
+            for first, last in blocks[1:]:
+                self._starts.insert(0, self._starts[0] - (last - first + 1))
+                self._firsts.insert(0, first)
+                self._lasts.insert(0, last)
+    
+    def _delete_positions(self, cursor, positions):
+        """
+        Delete the items at positions and close up the gap.
+    
+        A contiguous run only leaves a gap if it starts and ends in the same block, which is closed up by moving
+        whichever side of the block is shorter.  The blocks an extended slice runs through are laid out again.
+        """
+        if len(positions) == 0:
+            return
+        if positions.step < 0:
+            positions = positions[::-1]
+        first_block, offset = self._locate(positions[0])
+        low = self._firsts[first_block] + offset
+        last_block, offset = self._locate(positions[-1])
+        high = self._firsts[last_block] + offset
+        if positions.step == 1:
+            cursor.execute('''DELETE FROM ''' + self._table + ''' WHERE list_index BETWEEN ? AND ?''', (low, high))
+            first, last = self._firsts[first_block], self._lasts[last_block]
+            if first_block != last_block or low == first or high == last:
+                #whatever is left of the blocks at either end can stay where it is
+                firsts = [first] if low > first else []
+                lasts = [low - 1] if low > first else []
+                if high < last:
+                    firsts.append(high + 1)
+                    lasts.append(last)
+                self._replace_blocks(first_block, last_block, firsts, lasts)
+            elif min(low - first, last - high) > 2 * self._block_rows:
+                #a big block from before there were blocks, split it up rather than move half of it
+                self._relayout(cursor, first_block, first_block, [(first, low - first), (high + 1, last - high)])
+            else:
+                removed = high - low + 1
+                if low - first < last - high:
+                    self._shift(cursor, first, low - 1, removed)
+                    self._firsts[first_block] = first + removed
+                else:
+                    self._shift(cursor, high + 1, last, -removed)
+                    self._lasts[first_block] = last - removed
+                self._resize(first_block, -removed)
+            return
+        deleted = []
+        block = first_block
+        for position in positions:
+            start = self._starts[0] + position
+            while start - self._starts[block] > self._lasts[block] - self._firsts[block]:
+                block += 1
+            deleted.append(self._firsts[block] + start - self._starts[block])
+        cursor.executemany('''DELETE FROM ''' + self._table + ''' WHERE list_index = ?''', ((list_index, ) for list_index in deleted))
+        pieces = []
+        i = 0
+        for block in range(first_block, last_block + 1):
+            start = self._firsts[block]
+            while i < len(deleted) and deleted[i] <= self._lasts[block]:
+                pieces.append((start, deleted[i] - start))
+                start = deleted[i] + 1
+                i += 1
+            pieces.append((start, self._lasts[block] + 1 - start))
+        self._relayout(cursor, first_block, last_block, pieces)
+    
+    def _insert_at(self, cursor, position, items):
+        """
+        Insert already-encoded items before position.  Only the items of the block they go into are moved out of
+        the way (whichever side of it is shorter), and a block that gets too big is split up.
+        """
+        if not items:
+            return
+        added = len(items)
+        if position == 0 or position >= self._length():
+            at_end = position > 0 or not self._firsts
+            blocks = []
+            list_indexes = self._end_keys(at_end, blocks)
+            rows = [self._row(next(list_indexes), item) for item in (items if at_end else items[::-1])]
+            cursor.executemany('''INSERT INTO ''' + self._table + self._row_values, rows)
+            self._add_end_blocks(at_end, blocks)
+            return
+        bits = self._block_bits
+        block, offset = self._locate(position)
+        if offset == 0:
+            #the end of the block before may have room without moving anything
+            previous = self._lasts[block - 1] - self._firsts[block - 1] + 1
+            if previous + added <= 2 * self._block_rows and (self._lasts[block - 1] + added) >> bits == self._firsts[block - 1] >> bits:
+                block, offset = block - 1, previous
+        first, last = self._firsts[block], self._lasts[block]
+        size = last - first + 1
+        up = (last + added) >> bits == first >> bits
+        down = (first - added) >> bits == first >> bits
+        if size + added > 2 * self._block_rows or not (up or down):
+            self._relayout(cursor, block, block, [(first, offset), (None, items), (first + offset, size - offset)])
+            return
+        if up and (size - offset <= offset or not down):
+            self._shift(cursor, first + offset, last, added)
+            self._lasts[block] = last + added
+            start = first + offset
+        else:
+            self._shift(cursor, first, first + offset - 1, -added)
+            self._firsts[block] = first - added
+            start = first - added + offset
+        cursor.executemany('''INSERT INTO ''' + self._table + self._row_values, (self._row(start + i, item) for i, item in enumerate(items)))
+        self._resize(block, added)
     
     def __getitem__(self, key):
         with self.lock:
-            with self._closeable_cursor() as cursor:
-                length = self._getlen(cursor)
             if type(key) != int:
                 if type(key) == slice:
-                    #start = key.start or (0 if key.step > 0 else max(length, 0))
-                    #stop = key.stop or (length if key.step > 0 else 0)
-                    #step = key.step or 1
-                    #if start < 0:
-                    #    start = length + start
-                    #if stop < 0:
-                    #    stop = length + stop
-                    ##if step < 0:
-                    ##    tmp = start
-                    ##    start = max(stop - 1, 0)
-                    ##    stop = tmp
-                    return (self._iterate(length, range(length)[key.start:key.stop:key.step]))
+                    return self._slice(self._positions(key))
                 else:
                     raise TypeError("Key should be int, got " + str(type(key)))
-            elif key >= length:
-                raise IndexError("Sequence index out of range.")
             else:
-                with self._closeable_cursor() as cursor:
-                    
-                    if key < 0:
-                        key = length + key
-                        if key >= length:
-                            raise IndexError("Sequence index out of range.")
-                        if key < 0:
-                            raise IndexError("Sequence index out of range.")
-                    cursor.execute('''SELECT value FROM list WHERE list_index = (SELECT MIN(list_index) FROM list) + ?''', (key, ))
-                    return self._decoder(cursor.fetchone()[0])
+                list_index = self._list_index(key)
+                row = self._cursor.execute('''SELECT value FROM ''' + self._table + ''' WHERE list_index = ?''', (list_index, )).fetchone()
+                return self._decode_value(row[0])
     
     def __setitem__(self, key, value):
         with self.lock:
+            if type(key) == slice:
+                self._setslice(key, value)
+                return
             if type(key) != int:
                 raise TypeError("Key should be int, got " + str(type(key)))
-            with self._closeable_cursor() as cursor:
-                if key < 0:
-                    key = len(self) + key
-                    if key < 0:
-                        raise IndexError("Sequence index out of range.")
-                if key >= len(self):
-                    raise IndexError("Sequence index out of range.")
-                cursor.execute('''REPLACE INTO list (list_index, value) VALUES ((SELECT MIN(list_index) FROM list) + ?, ?)''', (key, self._coder(value)))
+            list_index = self._list_index(key)
+            value = self._encode_value(value)
+            self._cursor.execute('''REPLACE INTO ''' + self._table + self._row_values, self._row(list_index, value))
+            self._do_write(len(value))
+    
+    def _setslice(self, key, values):
+        with self.lock:
+            values = [self._encode_value(value) for value in values]
+            positions = self._positions(key)
+            if positions.step != 1 and len(positions) != len(values):
+                raise ValueError("attempt to assign sequence of size %d to extended slice of size %d" % (len(values), len(positions)))
+            replaced = min(len(positions), len(values))
+            try:
+                with self._closeable_cursor() as cursor:
+                    with self._savepoint(cursor):
+                        if replaced:
+                            cursor.executemany('''REPLACE INTO ''' + self._table + self._row_values,
+                                (self._row(self._key_at(positions[i]), values[i]) for i in range(replaced)))
+                        if len(values) > replaced:
+                            self._insert_at(cursor, positions.start + replaced, values[replaced:])
+                        elif len(positions) > replaced:
+                            self._delete_positions(cursor, positions[replaced:])
+            except:
+                self._blocks_valid = False
+                raise
+            self._do_write(self._payload_size(values))
+    
+    def __delitem__(self, key):
+        with self.lock:
+            if type(key) == slice:
+                positions = self._positions(key)
+            elif type(key) == int:
+                position = self._position(key)
+                positions = range(position, position + 1)
+            else:
+                raise TypeError("Key should be int or slice, got " + str(type(key)))
+            if len(positions) == 0:
+                return
+            try:
+                with self._closeable_cursor() as cursor:
+                    with self._savepoint(cursor):
+                        self._delete_positions(cursor, positions)
+            except:
+                self._blocks_valid = False
+                raise
             self._do_write()
         
     def __iter__(self):
-        with self.lock:
-            with self._closeable_cursor() as cursor:
-                cursor.execute('''SELECT value FROM list ORDER BY list_index ASC''')
-                for row in cursor:
-                    yield self._decoder(row[0])
+        return self._scan('''value''', (self._decode_value, ))
                 
     def __reversed__(self):
-        with self.lock:
-            with self._closeable_cursor() as cursor:
-                cursor.execute('''SELECT value FROM list ORDER BY list_index DESC''')
-                for row in cursor:
-                    yield self._decoder(row[0])
+        return self._scan('''value''', (self._decode_value, ), descending=True)
                 
     def __contains__(self, item):
+        condition, parameters = self._value_condition(item)
+        #LIMIT 1 so the statement is done with (and lets go of the database) after the first row
+        return self._read_one('''SELECT 1 FROM ''' + self._table + ''' WHERE ''' + condition + ''' LIMIT 1''', parameters) is not None
+    
+    def index(self, item, start=0, stop=None):
+        """
+        Return the position of the first occurrence of item (between start and stop, which work like a slice),
+        raising ValueError if it isn't there
+        """
         with self.lock:
-            with self._closeable_cursor() as cursor:
-                cursor.execute('''SELECT list_index FROM list WHERE value = ?''', (self._coder(item), ))
-                if cursor.fetchone() != None:
-                    return True
-                else:
-                    return False
+            positions = self._positions(slice(start, stop))
+            if len(positions) > 0:
+                condition, parameters = self._value_condition(item)
+                row = self._cursor.execute('''SELECT MIN(list_index) FROM ''' + self._table + ''' WHERE ''' + condition + ''' AND list_index BETWEEN ? AND ?''',
+                                           parameters + (self._key_at(positions[0]), self._key_at(positions[-1]))).fetchone()
+                if row[0] is not None:
+                    return self._position_of(row[0])
+            raise ValueError(repr(item) + " is not in list")
+    
+    def count(self, item):
+        """
+        Return the number of times item is in the list
+        """
+        condition, parameters = self._value_condition(item)
+        return self._read_one('''SELECT COUNT(*) FROM ''' + self._table + ''' WHERE ''' + condition, parameters)[0]
+    
+    def insert(self, position, item):
+        """
+        Insert item before position, like list.insert(): positions past either end of the list add it at that end
+        """
+        with self.lock:
+            length = self._blocks()
+            if position < 0:
+                position = max(0, length + position)
+            item = self._encode_value(item)
+            try:
+                with self._closeable_cursor() as cursor:
+                    with self._savepoint(cursor):
+                        self._insert_at(cursor, min(position, length), [item])
+            except:
+                self._blocks_valid = False
+                raise
+            self._do_write(len(item))
+    
+    def remove(self, item):
+        """
+        Delete the first occurrence of item, raising ValueError if it isn't there
+        """
+        with self.lock:
+            del self[self.index(item)]
     
     def append(self, item):
         """
         Add an item to the end of the list
         """
-        with self.lock:
-            with self._closeable_cursor() as cursor:
-                cursor.execute('''INSERT INTO list (list_index, value) VALUES ((SELECT MAX(list_index) FROM list) + 1, ?)''', (self._coder(item), ) )
-            self._do_write()
+        self._add_at_end(item, True)
         
     def prepend(self, item):
         """
         Insert an item at the front of the list
         """
+        self._add_at_end(item, False)
+    
+    def _add_at_end(self, item, at_end):
         with self.lock:
-            with self._closeable_cursor() as cursor:
-                cursor.execute('''INSERT INTO list (list_index, value) VALUES ((SELECT MIN(list_index) FROM list) - 1, ?)''', ( self._coder(item), ) )
-            self._do_write()
+            item = self._encode_value(item)
+            if self._blocks():
+                block = -1 if at_end else 0
+                first, last = self._firsts[block], self._lasts[block]
+                list_index = last + 1 if at_end else first - 1
+                if last - first + 1 < self._block_rows and list_index >> self._block_bits == first >> self._block_bits:
+                    #the usual case, the block at that end has room
+                    self._cursor.execute('''INSERT INTO ''' + self._table + self._row_values, self._row(list_index, item))
+                    if at_end:
+                        self._lasts[-1] = list_index
+                    else:
+                        self._firsts[0] = list_index
+                        self._starts[0] -= 1
+                    self._do_write(len(item))
+                    return
+            blocks = []
+            list_index = next(self._end_keys(at_end, blocks))
+            self._cursor.execute('''INSERT INTO ''' + self._table + self._row_values, self._row(list_index, item))
+            self._add_end_blocks(at_end, blocks)
+            self._do_write(len(item))
             
     
+    def _pop_at(self, list_index):
+        """
+        Delete the row at list_index, returning a list with its value row (empty if there was no such row)
+        """
+        with self._closeable_cursor() as cursor:
+            if self._returning:
+                return cursor.execute('''DELETE FROM ''' + self._table + ''' WHERE list_index = ? RETURNING value''', (list_index, )).fetchall()
+            rows = cursor.execute('''SELECT value FROM ''' + self._table + ''' WHERE list_index = ?''', (list_index, )).fetchall()
+            if rows:
+                cursor.execute('''DELETE FROM ''' + self._table + ''' WHERE list_index = ?''', (list_index, ))
+            return rows
+    
     def pop_last(self):
         with self.lock:
-            output = None
-            with self._closeable_cursor() as cursor:
-                cursor.execute('''BEGIN TRANSACTION''')
-                if self._getlen(cursor) < 1:
-                    cusror.execute('''END TRANSACTION''')
-                    raise IndexError("pop from empty list")
-                cursor.execute('''SELECT value FROM list WHERE list_index = (SELECT MAX(list_index) FROM list)''')
-                output = self._decoder(cursor.fetchone()[0])
-                cursor.execute('''DELETE FROM list WHERE list_index = (SELECT MAX(list_index) FROM list)''')
-                self._db.commit()
+            if not self._blocks():
+                raise IndexError("pop from empty list")
+            rows = self._pop_at(self._lasts[-1])
+            if not rows:
+                #the cached block map was out of date, read it again
+                self._blocks_valid = False
+                return self.pop_last()
+            self._lasts[-1] -= 1
+            if self._lasts[-1] < self._firsts[-1]:
+                self._replace_blocks(len(self._firsts) - 1, len(self._firsts) - 1, [], [])
             self._do_write()
-            return output
+            return self._decode_value(rows[0][0])
             
     
     def pop_first(self):
         with self.lock:
-            output = None
-            with self._closeable_cursor() as cursor:
-                cursor.execute('''BEGIN TRANSACTION''')
-                if self._getlen(cursor) < 1:
-                    cusror.execute('''END TRANSACTION''')
-                    raise IndexError("pop from empty list")
-                cursor.execute('''SELECT value FROM list WHERE list_index = (SELECT MIN(list_index) FROM list)''')
-                output = self._decoder(cursor.fetchone()[0])
-                cursor.execute('''DELETE FROM list WHERE list_index = (SELECT MIN(list_index) FROM list)''')
-                self._db.commit()
+            if not self._blocks():
+                raise IndexError("pop from empty list")
+            rows = self._pop_at(self._firsts[0])
+            if not rows:
+                self._blocks_valid = False
+                return self.pop_first()
+            self._firsts[0] += 1
+            self._starts[0] += 1
+            if self._lasts[0] < self._firsts[0]:
+                self._replace_blocks(0, 0, [], [])
             self._do_write()
-            return output
+            return self._decode_value(rows[0][0])
         
     def extend(self, iterable):
         """
         Add each item from iterable to the end of the list
         """
         with self.lock:
-            for item in iterable:
-                self.append(item)
+            if iterable is self:
+                iterable = list(self)
+            self._blocks()
+            blocks = []
+            list_indexes = self._end_keys(True, blocks)
+            self._bulk_write('''INSERT INTO ''' + self._table + self._row_values,
+                (self._row(next(list_indexes), self._encode_value(item)) for item in iterable))
+            #the bulk write either wrote every row or none of them, so the blocks written to are still easy to add
+            self._add_end_blocks(True, blocks)
             
             
     def clear(self):
         with self.lock:
             with self._closeable_cursor() as cursor:
-                cursor.execute('''DELETE FROM list''')
+                cursor.execute('''DELETE FROM ''' + self._table)
+            self._set_blocks([], [])
+            self._do_write()
                 
+    
+    def query(self):
+        """
+        Start a Query on the items of the list, which gives back items in list order unless sorted
+        """
+        return Query(self)
+    
+    def _encoded_chunks(self, coder):
+        """
+        Yield lists of the values encoded with coder, in order.  If that would just give back what's stored, the
+        stored text is passed along as it is.
+        """
+        if coder is json.dumps and self._plain_json():
+            return ([row[1] for row in rows] for rows in self._row_chunks('''value'''))
+        return ([unicode(coder(value)) for value in chunk] for chunk in self._scan_chunks('''value''', (self._decode_value, )))
+    
     def write(self, outfile):
+        """
+        Write the list to outfile as a JSON array
+        """
         with self.lock:
-            outfile.write(u"[")
-            iterator = iter(self)
-            try:
-                try:
-                    this = iterator.__next__()
-                except AttributeError:
-                    this = iterator.next()
-            except StopIteration:
-                outfile.write(u"]")
-                return
-            else:
-                while True:
-                    outfile.write(unicode(json.dumps(this)))
-                    try:
-                        try:
-                            this = iterator.__next__()
-                        except AttributeError:
-                            this = iterator.next()
-                    except StopIteration:
-                        outfile.write(u"]")
-                        break
-                    else:
-                        outfile.write(u",")
+            self._write_joined(outfile, self._encoded_chunks(json.dumps), u",", u"[", u"]")
                         
     def write_lines(self, outfile, coder=json.dumps, separator=u"\n"):
+        """
+        Write each item of the list to outfile, encoded with coder and followed by separator
+        """
         with self.lock:
-            iterator = iter(self)
-            try:
-                try:
-                    this = iterator.__next__()
-                except AttributeError:
-                    this = iterator.next()
-            except StopIteration:
-                return
-            else:
-                while True:
-                    outfile.write(unicode(coder(this)))
-                    outfile.write(unicode(separator))
-                    try:
-                        try:
-                            this = iterator.__next__()
-                        except AttributeError:
-                            this = iterator.next()
-                    except StopIteration:
-                        break
-            
-            
-            
-            
\ No newline at end of file
+            self._write_joined(outfile, self._encoded_chunks(coder), unicode(separator), terminated=True)
+    
+    @classmethod
+    def load_lines(cls, infile, decoder=json.loads, **kwargs):
+        """
+        Make a new SqliteList (kwargs are passed on to SqliteList) out of the lines of infile, each decoded with
+        decoder.  Blank lines are skipped.  The file is read and written to the database a chunk at a time.
+        """
+        return cls._loaded(kwargs, lambda loaded: loaded.extend(decoder(line) for line in infile if line.strip()))
+    
+    @classmethod
+    def load_json(cls, infile, **kwargs):
+        """
+        Make a new SqliteList (kwargs are passed on to SqliteList) out of the JSON array in infile, which is
+        parsed and written to the database an item at a time rather than loaded all at once
+        """
+        return cls._loaded(kwargs, lambda loaded: loaded.extend(iter_array(infile)))
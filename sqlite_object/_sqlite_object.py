@@ -1,31 +1,263 @@
-import sqlite3, os
+import json, multiprocessing, pickle, sqlite3, os, re, tempfile, time, uuid, weakref
 
-from threading import RLock
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from itertools import chain, islice
+from threading import Event, RLock, Thread, Timer, current_thread, local
 
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+
+try:
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = ThreadPoolExecutor = None
+
+from ._codecs import get_codec
+from ._compression import Compressor
+from ._query import _extract_function
+
+
+#one lock per database file, shared by every SqliteObject in the process that uses the file
+_file_locks = weakref.WeakValueDictionary()
+_file_locks_lock = RLock()
+
+def _file_lock(filename):
+    with _file_locks_lock:
+        key = os.path.abspath(filename)
+        lock = _file_locks.get(key)
+        if lock is None:
+            lock = RLock()
+            _file_locks[key] = lock
+        return lock
+
+def _decode_rows(decoders, rows):
+    """
+    Decode a chunk of (rowid, column, ...) rows with one decoder per column, dropping the rowid
+    """
+    if len(decoders) == 1:
+        decoder = decoders[0]
+        return [decoder(row[1]) for row in rows]
+    if len(decoders) == 2:
+        first, second = decoders
+        return [(first(row[1]), second(row[2])) for row in rows]
+    return [tuple(decoder(value) for decoder, value in zip(decoders, row[1:])) for row in rows]
+
+#module level (rather than lambdas) so that compressed values can be decoded in a process pool
+def _compress_value(compressor, coder, value):
+    return compressor.compress(coder(value))
+
+def _decompress_value(compressor, decoder, stored):
+    return decoder(compressor.decompress(stored))
+
+
+class _Missing(object):
+    def __repr__(self):
+        return "MISSING"
+
+#stands in for values of keys that aren't there in results of multi-key lookups
+MISSING = _Missing()
 
 
 class SqliteObject(object):
     
-    _commit_counter = 0
-    lock = RLock()
+    _bulk_chunk_size = 1000
+    #most ? parameters in one statement with the default SQLITE_MAX_VARIABLE_NUMBER of older sqlite versions
+    _max_variables = 999
+    #DELETE ... RETURNING needs sqlite 3.35
+    _returning = sqlite3.sqlite_version_info >= (3, 35, 0)
+    #json_extract() and -> are built in from sqlite 3.38
+    _json_extract = sqlite3.sqlite_version_info >= (3, 38, 0)
+    _in_memory = False
+    _private_memory = False
+    _spilled = False
+    #prepared statements kept by each connection, enough for every statement of every table in a big store
+    _cached_statements = 512
+    _iter_chunk_size = 1000
+    #write() and write_lines() gather their output into writes of about this many characters
+    _write_buffer_size = 65536
+    _iter_prefetch = False
+    _parallel_decode = None
+    _decode_pool = None
+    _commit_timer = None
+    _is_open = False
+    _readers = None
+    #name of the table holding the data, and the name its indexes start with, set by each subclass
+    _table = None
+    _name = None
+    _meta_prefix = ""
+    #the SqliteStore this object is a table of, if any
+    _store = None
+    _transaction_depth = 0
+    #total_changes of the connection when _savepoint() last ran BEGIN, see _holds_write_lock()
+    _begin_changes = None
+    _extract_function = None
+    #subclasses that expect several processes to write the same file at once run it in WAL mode
+    _shared_writers = False
+    
+    #PRAGMA presets that can be picked with the profile argument.  They're applied in order right after connecting.
+    PRAGMA_PROFILES = {
+        #temporary objects: no fsyncs and keep as much as possible in memory
+        "scratch": [("journal_mode", "MEMORY"), ("synchronous", "OFF"), ("cache_size", -65536), ("temp_store", "MEMORY")],
+        #write-ahead log, safe against application crashes and much cheaper than the default full sync
+        "durable": [("journal_mode", "WAL"), ("synchronous", "NORMAL")],
+        "custom": [],
+    }
     
     def is_open(self):
         return self._is_open
     
-    def __init__(self, schema, index_command, filename, coder, decoder, index=True, persist=False, commit_every=0):
-        self._db = sqlite3.connect(filename)
-        self._persist = persist
-        self._filename = filename
+    __meta_schema = '''CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)'''
+    
+    def __init__(self, schema, index_command, filename, coder, decoder, index=True, persist=False, commit_every=0, profile=None, pragmas=None,
+                 commit_interval_ms=None, commit_bytes=None, concurrent_reads=False, codec=None,
+                 compression=None, compression_threshold=1024, compression_level=None, compression_dict=None, iter_chunk_size=1000, iter_prefetch=False,
+                 parallel_decode=None, decode_workers=None, temp_dir=None, spill_mb=None, store=None, name=None):
+        if parallel_decode not in (None, False, True, "thread", "process"):
+            raise ValueError("parallel_decode should be None, \"thread\" or \"process\", not " + repr(parallel_decode))
+        if parallel_decode and ProcessPoolExecutor is None:
+            raise ValueError("parallel_decode needs concurrent.futures")
+        if store is None:
+            self._open(filename, persist, profile, pragmas, commit_every, commit_interval_ms, commit_bytes, concurrent_reads, temp_dir, spill_mb)
+        else:
+            self._join(store, name)
         with self.lock:
             with self._closeable_cursor() as cursor:
-                cursor.execute(schema)
+                cursor.execute(self.__meta_schema)
+                if store is not None:
+                    kind = self._get_meta(cursor, "type")
+                    if kind is not None and kind != type(self).__name__:
+                        raise ValueError(repr(name) + " in the store is a " + kind + ", not a " + type(self).__name__)
+                    self._set_meta(cursor, "type", type(self).__name__)
+                codec = self._resolve_codec(cursor, codec, coder, decoder)
+                if codec is not None:
+                    coder = codec.coder
+                    decoder = codec.decoder
+                compressor = self._resolve_compression(cursor, compression, compression_threshold, compression_level, compression_dict)
+                if schema is not None:
+                    #schemas have {key_type} and {value_type} placeholders for their data columns, and {table} and {name}
+                    #for the names of the table and its indexes
+                    key_type = "BLOB" if codec is not None and codec.binary else "TEXT"
+                    cursor.execute(schema.format(table=self._table, name=self._name, key_type=key_type, value_type="BLOB" if compressor is not None else key_type))
+                if compressor is not None and compression is not None and self._get_meta(cursor, "compression") is None:
+                    if cursor.execute('''SELECT 1 FROM ''' + self._table + ''' LIMIT 1''').fetchone() is not None:
+                        raise ValueError("Can't turn on compression for a database that already has uncompressed data in it")
+                    self._set_meta(cursor, "compression", compressor.method)
+                    if compressor.dictionary is not None:
+                        self._set_meta(cursor, "compression_dict", sqlite3.Binary(compressor.dictionary))
                 if index:
-                    cursor.execute(index_command)
-                self._db.commit()
-        self._is_open = True
+                    cursor.execute(index_command.format(table=self._table, name=self._name))
+                self._commit_setup()
+        if store is not None:
+            store._containers[self._name] = self
+        self._codec = codec
         self._coder = coder
         self._decoder = decoder
+        #values (but not keys) go through the compressor, if there is one
+        self._compressor = compressor
+        if compressor is None:
+            self._encode_value = coder
+            self._decode_value = decoder
+        else:
+            self._encode_value = partial(_compress_value, compressor, coder)
+            self._decode_value = partial(_decompress_value, compressor, decoder)
+        self._iter_chunk_size = iter_chunk_size
+        self._iter_prefetch = iter_prefetch
+        self._parallel_decode = "process" if parallel_decode is True else parallel_decode or None
+        self._decode_workers = decode_workers or multiprocessing.cpu_count()
+        if self._parallel_decode == "process":
+            try:
+                pickle.dumps((decoder, self._decode_value))
+            except Exception:
+                self.close()
+                raise ValueError("parallel_decode=\"process\" needs a decoder that can be pickled, try \"thread\"")
+    
+    def _open(self, filename, persist, profile, pragmas, commit_every, commit_interval_ms, commit_bytes, concurrent_reads, temp_dir, spill_mb):
+        """
+        Connect to our own database and set up the commit bookkeeping
+        """
+        #":memory:" and memory URIs without cache=shared are private to this object, shared ones can be opened again by name
+        in_memory = filename == ":memory:" or (filename.startswith("file:") and "mode=memory" in filename)
+        private_memory = in_memory and "cache=shared" not in filename
+        if in_memory and concurrent_reads:
+            raise ValueError("concurrent_reads needs a database file, not an in-memory database")
+        if spill_mb is not None and not private_memory:
+            raise ValueError("spill_mb only works with a private in-memory database (filename=\":memory:\")")
+        pragmas = self._pragma_list(profile, pragmas)
+        if concurrent_reads or (self._shared_writers and not in_memory):
+            #readers only get to run alongside the writer in WAL mode, and with the rollback journal a writer that
+            #commits back to back keeps everyone else locked out for as long as its fsyncs take
+            pragmas = [(name, value) for name, value in pragmas if name != "journal_mode"] + [("journal_mode", "WAL")]
+        self._persist = persist
+        self._filename = filename
+        self._in_memory = in_memory
+        self._private_memory = private_memory
+        self._temp_dir = temp_dir
+        self._spill_bytes = None if spill_mb is None else spill_mb * 1024 * 1024
+        #writes to the same file are serialized by a lock shared between all the objects using that file
+        self.lock = RLock() if private_memory else _file_lock(filename)
+        #the connection is only ever used while holding self.lock, but commits can come from the commit timer's thread
+        if filename.startswith("file:"):
+            self._db = sqlite3.connect(filename, check_same_thread=False, cached_statements=self._cached_statements, uri=True)
+        else:
+            self._db = sqlite3.connect(filename, check_same_thread=False, cached_statements=self._cached_statements)
+        #reused by the single-row statements on the hot paths, always under the lock
+        self._cursor = self._db.cursor()
+        #name -> (number of arguments, python function), for sql functions used in queries and indexes
+        self._functions = {}
+        self._is_open = True
+        self._data_version = None
+        self._pragmas = pragmas
+        self._apply_pragmas(self._db, pragmas)
+        if concurrent_reads:
+            self._readers = local()
+            self._reader_connections = []
         self._commit_every = commit_every
+        self._commit_interval_ms = commit_interval_ms
+        self._commit_bytes = commit_bytes
+        self._commit_counter = 0
+        self._pending_bytes = 0
+        self._commit_timer = None
+        self._commit_count = 0
+        self._last_commit_latency = None
+    
+    def _join(self, store, name):
+        """
+        Keep our data in a table called name in store's database, sharing its connection, lock and commits
+        """
+        if name is None or not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', name) or name.lower() == "meta" or name.lower().startswith("sqlite_"):
+            raise ValueError("Bad name for a store table: " + repr(name))
+        with store.lock:
+            if not store._is_open:
+                raise ValueError("The store is closed")
+            if store._containers.get(name) is not None:
+                raise ValueError(repr(name) + " is already open in this store")
+            self._table = '"' + name + '"'
+            self._name = name
+            self._meta_prefix = name + "."
+            self._store = store
+            self._filename = store._filename
+            self._in_memory = store._in_memory
+            self._private_memory = store._private_memory
+            self._spilled = store._spilled
+            self._temp_dir = store._temp_dir
+            self.lock = store.lock
+            self._db = store._db
+            self._cursor = store._cursor
+            self._is_open = True
+            self._data_version = None
+            self._pragmas = store._pragmas
+            if store._readers is not None:
+                self._readers = store._readers
+                self._reader_connections = store._reader_connections
+            #commits are the store's business
+            self._do_write = store._do_write
+            self._commit = store._commit
+            self.commit = store.commit
+            self.get_commit_stats = store.get_commit_stats
         
     def __enter__(self):
         return self
@@ -35,36 +267,630 @@ class SqliteObject(object):
         
     def close(self):
         with self.lock:
+            if not self._is_open:
+                return
             self._is_open = False
-            if self._persist:
-                #commit and close, don't delete
-                self._db.commit()
-                self._db.close()
+            if self._store is not None:
+                #the connection belongs to the store, just stop using it
+                if self._store._containers.get(self._name) is self:
+                    del self._store._containers[self._name]
             else:
-                #don't bother commiting, just close and delete
-                self._db.close()
-                try:
-                    os.remove(self._filename)
-                except:
-                    pass
-                
+                self._cancel_commit_timer()
+                if self._readers is not None:
+                    for thread, db in self._reader_connections:
+                        db.close()
+                    self._reader_connections = []
+                if self._persist and not self._spilled:
+                    #commit and close, don't delete
+                    self._db.commit()
+                    self._db.close()
+                else:
+                    #don't bother commiting, just close and delete (spill files are always deleted)
+                    self._db.close()
+                    if not self._in_memory:
+                        try:
+                            os.remove(self._filename)
+                        except:
+                            pass
+            if self._decode_pool is not None:
+                self._decode_pool.shutdown()
+                self._decode_pool = None
+    
     def commit(self):
         with self.lock:
-            self._db.commit()
+            self._commit()
+    
+    def get_commit_stats(self):
+        """
+        Return a dict describing uncommitted writes and the most recent commit:
+        pending_writes, pending_bytes (encoded payload written since the last commit), commits (number of commits
+        so far) and last_commit_latency (seconds, None if nothing has been committed yet)
+        """
+        with self.lock:
+            return {
+                "pending_writes": self._commit_counter,
+                "pending_bytes": self._pending_bytes,
+                "commits": self._commit_count,
+                "last_commit_latency": self._last_commit_latency,
+            }
     
     def __del__(self):
-        self.close()
+        #__init__ may have failed before there was anything to close
+        if "_db" in self.__dict__:
+            self.close()
         
-    def _do_write(self):
+    def _do_write(self, nbytes=0):
         """
-        Check commit counter and do a commit if need be
+        Record a write of nbytes of encoded data and commit if any of the group commit limits has been reached:
+        commit_every writes or commit_bytes bytes since the last commit.  If commit_interval_ms is set, a timer
+        makes sure pending writes get committed that long after the first of them even if nothing else is written.
         """
+        if self._transaction_depth:
+            #only the thread running the transaction can get here, and it commits everything when it's done
+            return
         with self.lock:
             self._commit_counter += 1
-            if self._commit_counter >= self._commit_every:
+            self._pending_bytes += nbytes
+            if self._spill_bytes is not None and not self._spilled and self._database_size() > self._spill_bytes:
+                self._spill()
+            elif self._commit_counter >= self._commit_every or (self._commit_bytes is not None and self._pending_bytes >= self._commit_bytes):
+                self._commit()
+            elif self._commit_interval_ms is not None and self._commit_timer is None:
+                self._commit_timer = Timer(self._commit_interval_ms / 1000.0, SqliteObject._timed_commit, (weakref.ref(self), ))
+                self._commit_timer.daemon = True
+                self._commit_timer.start()
+    
+    def _database_size(self):
+        with self._closeable_cursor() as cursor:
+            page_count = cursor.execute('''PRAGMA page_count''').fetchone()[0]
+            return page_count * cursor.execute('''PRAGMA page_size''').fetchone()[0]
+    
+    def _spill(self):
+        """
+        Move an in-memory database that has outgrown spill_mb into a temporary file in temp_dir (the system
+        temp directory by default), using the backup API, and carry on with the file from then on
+        """
+        with self.lock:
+            self._commit()
+            handle, filename = tempfile.mkstemp(suffix=".sqlite3", dir=self._temp_dir)
+            os.close(handle)
+            disk = sqlite3.connect(filename, check_same_thread=False, cached_statements=self._cached_statements)
+            try:
+                self._db.backup(disk)
+                self._apply_pragmas(disk, self._pragmas)
+                for name, (arguments, function) in self._functions.items():
+                    disk.create_function(name, arguments, function, deterministic=True)
+            except:
+                disk.close()
+                os.remove(filename)
+                raise
+            self._db.close()
+            self._db = disk
+            self._cursor = disk.cursor()
+            self._filename = filename
+            self._in_memory = False
+            self._private_memory = False
+            self._spilled = True
+            self._data_version = None
+    
+    def is_spilled(self):
+        """
+        Return True if this object started out in memory and has been moved to a temporary file
+        """
+        return self._spilled
+    
+    @staticmethod
+    def _random_filename(directory=None):
+        return os.path.join(directory or "", str(uuid.uuid4()) + ".sqlite3")
+    
+    def _commit_setup(self):
+        """
+        Commit the schema changes made while opening straight away, rather than as a group-committed write that
+        would keep the file locked for everyone else opening it.  Inside a transaction they wait for its commit.
+        """
+        with self.lock:
+            if not (self._store or self)._transaction_depth:
                 self._db.commit()
-                self._commit_counter = 0
-           
+    
+    def _commit(self):
+        with self.lock:
+            if self._transaction_depth:
+                return
+            self._cancel_commit_timer()
+            start = time.time()
+            self._db.commit()
+            self._last_commit_latency = time.time() - start
+            self._commit_count += 1
+            self._commit_counter = 0
+            self._pending_bytes = 0
+    
+    def _cancel_commit_timer(self):
+        if self._commit_timer is not None:
+            self._commit_timer.cancel()
+            self._commit_timer = None
+    
+    @staticmethod
+    def _timed_commit(ref):
+        #runs on the timer thread, only holds a weak reference so the timer doesn't keep the object alive
+        self = ref()
+        if self is None:
+            return
+        with self.lock:
+            self._commit_timer = None
+            if self._is_open and self._commit_counter > 0:
+                self._commit()
+    
+    def _payload_size(self, row):
+        """
+        Size of the encoded strings in a row of statement parameters
+        """
+        size = 0
+        for value in row:
+            if isinstance(value, (str, bytes)):
+                size += len(value)
+        return size
+    
+    def get_codec(self):
+        """
+        Return the name of the codec used to encode keys and values, or None if a custom coder/decoder is in use
+        """
+        if self._codec is None:
+            return None
+        return self._codec.name
+    
+    def _end_read_transaction(self):
+        """
+        Commit the open transaction if there are no writes in it, so that reads (or writes that didn't change
+        anything) don't keep the database locked
+        """
+        with self.lock:
+            owner = self._store or self
+            if self._db.in_transaction and not owner._commit_counter and not owner._transaction_depth:
+                self._db.commit()
+    
+    def _plain_json(self, values=True):
+        """
+        True if keys (or values, which also have to be uncompressed) are stored as the exact text json.dumps
+        gives for them, so they can be written out without decoding and encoding them again
+        """
+        if self._codec is None or self._codec.name != "json":
+            return False
+        return not values or self._compressor is None
+    
+    def _write_joined(self, outfile, chunks, separator, start=u"", end=u"", terminated=False):
+        """
+        Write the strings from chunks (an iterable of lists of strings) to outfile with separator between them,
+        or after each of them if terminated, all between start and end.  The output is gathered into writes of
+        about _write_buffer_size characters rather than a write per string.
+        """
+        buffered = [start]
+        size = 0
+        first = True
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if not first and not terminated:
+                buffered.append(separator)
+            first = False
+            piece = separator.join(chunk)
+            if terminated:
+                piece += separator
+            buffered.append(piece)
+            size += len(piece)
+            if size >= self._write_buffer_size:
+                outfile.write(u"".join(buffered))
+                buffered = []
+                size = 0
+        buffered.append(end)
+        outfile.write(u"".join(buffered))
+    
+    @classmethod
+    def _loaded(cls, kwargs, load):
+        """
+        Make a new object of this class with kwargs and fill it with load(object), closing it again (which
+        deletes it unless it's persisted) if that fails
+        """
+        loaded = cls(**kwargs)
+        try:
+            load(loaded)
+        except:
+            loaded.close()
+            raise
+        return loaded
+    
+    def _rolled_back(self):
+        """
+        Called after writes made through this object have been rolled back, to drop anything remembered about them
+        """
+        pass
+    
+    def _get_meta(self, cursor, name, default=None):
+        #containers in a store keep their settings under their own name
+        name = self._meta_prefix + name
+        row = cursor.execute('''SELECT value FROM meta WHERE name = ?''', (name, )).fetchone()
+        if row is None:
+            return default
+        return row[0]
+    
+    def _set_meta(self, cursor, name, value):
+        cursor.execute('''REPLACE INTO meta (name, value) VALUES (?, ?)''', (self._meta_prefix + name, value))
+    
+    def _resolve_codec(self, cursor, codec, coder, decoder):
+        """
+        Work out which Codec to use, recording its name in the meta table the first time.
+        
+        An explicit codec has to match the one recorded in the database, if any.  Without one, a database that
+        already has a codec keeps using it, unless a custom coder/decoder was passed in (which can't be recorded,
+        so it is used as-is and returns None).
+        """
+        stored = self._get_meta(cursor, "codec")
+        if codec is None:
+            if coder is not json.dumps or decoder is not json.loads:
+                return None
+            codec = stored or "json"
+        elif stored is not None and stored != codec:
+            raise ValueError("Database was created with codec " + repr(stored) + ", not " + repr(codec))
+        resolved = get_codec(codec)
+        if stored is None:
+            self._set_meta(cursor, "codec", codec)
+        return resolved
+    
+    def _resolve_compression(self, cursor, method, threshold, level, dictionary):
+        """
+        Build the Compressor for values, or return None if values aren't compressed.
+        
+        Like the codec, the compression method and shared dictionary are recorded in the database the first time
+        and re-used when it's re-opened without asking for compression.
+        """
+        stored = self._get_meta(cursor, "compression")
+        stored_dictionary = self._get_meta(cursor, "compression_dict")
+        if stored_dictionary is not None:
+            stored_dictionary = bytes(stored_dictionary)
+        if method is None:
+            if stored is None:
+                return None
+            method = stored
+            dictionary = stored_dictionary
+        elif stored is not None and (stored != method or stored_dictionary != dictionary):
+            raise ValueError("Database was created with " + repr(stored) + " compression" + (" and a different dictionary" if stored == method else ""))
+        return Compressor(method, threshold, level, dictionary)
+    
+    def get_compression_stats(self):
+        """
+        Return a dict describing how well values are compressing and what it costs: compressed and uncompressed
+        (number of values stored each way), bytes_in and bytes_out (encoded size before and after), ratio
+        (bytes_in / bytes_out) and encode_seconds and decode_seconds (time spent in the compressor).
+        Counts only cover this object's own reads and writes.  Returns None if compression is off.
+        """
+        if self._compressor is None:
+            return None
+        return self._compressor.stats()
+    
+    def _pragma_list(self, profile, pragmas):
+        """
+        Work out the (name, value) PRAGMAs for a profile name plus any explicit pragmas, which override the profile
+        """
+        if profile is None:
+            profile = "custom"
+        if profile not in self.PRAGMA_PROFILES:
+            raise ValueError("Unknown profile " + repr(profile) + ", expected one of " + ", ".join(sorted(self.PRAGMA_PROFILES)))
+        if profile == "custom" and pragmas is None:
+            return []
+        merged = list(self.PRAGMA_PROFILES[profile])
+        if pragmas:
+            overrides = pragmas.items() if "items" in dir(pragmas) else pragmas
+            for name, value in overrides:
+                merged = [(n, v) for n, v in merged if n != name]
+                merged.append((name, value))
+        for name, value in merged:
+            if not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', name):
+                raise ValueError("Bad PRAGMA name " + repr(name))
+            if not re.match(r'^-?[A-Za-z0-9_]+$', str(value)):
+                raise ValueError("Bad value for PRAGMA " + name + ": " + repr(value))
+        return merged
+    
+    def _create_function(self, name, function, arguments=1):
+        """
+        Define a deterministic sql function on our connection (and the one we spill to, if we do), so that it
+        can be used in index expressions
+        """
+        with self.lock:
+            try:
+                self._db.create_function(name, arguments, function, deterministic=True)
+            except (TypeError, sqlite3.NotSupportedError):
+                raise ValueError("Indexes and queries on python functions need python 3.8 and sqlite 3.8.3 or newer")
+            (self._store or self)._functions[name] = (arguments, function)
+    
+    def _sql_json(self):
+        """
+        True if sqlite can read values itself, with json_extract()
+        """
+        return self._json_extract and self._plain_json()
+    
+    def _field_expression(self, path):
+        """
+        Return (sql expression for the field at a JSON path in values, whether it needs one of our sql functions).
+        Plain JSON values are left to json_extract(), anything else is decoded by a function of our own.
+        """
+        if self._sql_json():
+            return '''json_extract(value, \'''' + path + '''\')''', False
+        name = self._name + "_extract"
+        if self._extract_function is None:
+            #each object registers its own, with its own decoder
+            self._extract_function = partial(_extract_function, self._decode_value)
+            self._create_function(name, self._extract_function, 2)
+        return name + '''(value, \'''' + path + '''\')''', True
+    
+    def _fetch_all(self, statement, parameters, functions=False):
+        """
+        Run a query and return all its rows.  Queries that use our sql functions run on the main connection,
+        since read connections don't have them.
+        """
+        if functions:
+            with self.lock:
+                with self._closeable_cursor() as cursor:
+                    return cursor.execute(statement, parameters).fetchall()
+        with self._reading() as db:
+            with self._closeable_cursor(db) as cursor:
+                return cursor.execute(statement, parameters).fetchall()
+    
+    def _apply_pragmas(self, db, pragmas):
+        for name, value in pragmas:
+            db.execute('''PRAGMA ''' + name + ''' = ''' + str(value)).fetchall()
+    
+    @contextmanager
+    def _reading(self):
+        """
+        Yield a connection to run read-only queries on.
+        
+        Normally that's the main connection, with the lock held.  With concurrent_reads each thread gets its own
+        read connection and no lock is taken, so reads from different threads run in parallel.  Connections of
+        threads that have finished are closed whenever a new one is opened.  Reads still go
+        through the main connection while it has uncommitted writes, which the read connections can't see yet.
+        """
+        if self._readers is None or self._db.in_transaction:
+            with self.lock:
+                yield self._db
+        else:
+            db = getattr(self._readers, "db", None)
+            if db is None:
+                with self.lock:
+                    if not self._is_open:
+                        raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+                    db = sqlite3.connect(self._filename, check_same_thread=False, cached_statements=self._cached_statements)
+                    self._apply_pragmas(db, self._pragmas)
+                    db.execute('''PRAGMA query_only = ON''')
+                    #threads that have finished won't use their connections again, close them so short-lived
+                    #threads don't pile up open files (in place, a store shares the list with its containers)
+                    alive = []
+                    for thread, reader in self._reader_connections:
+                        if thread.is_alive():
+                            alive.append((thread, reader))
+                        else:
+                            reader.close()
+                    alive.append((current_thread(), db))
+                    self._reader_connections[:] = alive
+                    self._readers.db = db
+            yield db
+    
+    def _read_one(self, statement, parameters):
+        """
+        Run a query and return its first row (or None).  Goes straight to the reused cursor when reads use the
+        main connection, skipping the _reading() context manager and a new cursor per call.
+        """
+        if self._readers is None:
+            with self.lock:
+                return self._cursor.execute(statement, parameters).fetchone()
+        with self._reading() as db:
+            return db.execute(statement, parameters).fetchone()
+    
+    def _changed_elsewhere(self):
+        """
+        Return True if another connection has committed changes to the database since the last call
+        (always True the first time).  Used to know when cached information about the table has gone stale.
+        """
+        with self.lock:
+            version = self._cursor.execute('''PRAGMA data_version''').fetchone()[0]
+            changed = version != self._data_version
+            self._data_version = version
+            return changed
+    
+    def _holds_write_lock(self):
+        """
+        True if this connection has written in its open transaction, so nothing else can commit until it does.
+        A deferred BEGIN doesn't lock anything until the first write, while the implicit BEGIN sqlite3 runs
+        before a write always comes with one.
+        """
+        return self._db.in_transaction and self._db.total_changes != (self._store or self)._begin_changes
+    
+    def _chunked(self, iterable, size=None):
+        """
+        Split iterable into lists of at most size (default _bulk_chunk_size) items
+        """
+        size = size or self._bulk_chunk_size
+        iterator = iter(iterable)
+        while True:
+            chunk = list(islice(iterator, size))
+            if not chunk:
+                return
+            yield chunk
+    
+    def _row_chunks(self, columns, descending=False):
+        """
+        Yield lists of at most _iter_chunk_size (rowid, column, ...) rows from the table, in rowid order.
+    
+        Each chunk is its own keyset query starting after the last rowid seen, so the lock (or the read
+        connection) is only held while a chunk is being read and other threads get a turn in between.
+        """
+        order, compare = ('''DESC''', '''<''') if descending else ('''ASC''', '''>''')
+        select = '''SELECT rowid, ''' + columns + ''' FROM ''' + self._table
+        size = self._iter_chunk_size
+        last = None
+        while True:
+            with self._reading() as db:
+                with self._closeable_cursor(db) as cursor:
+                    if last is None:
+                        cursor.execute(select + ''' ORDER BY rowid ''' + order + ''' LIMIT ?''', (size, ))
+                    else:
+                        cursor.execute(select + ''' WHERE rowid ''' + compare + ''' ? ORDER BY rowid ''' + order + ''' LIMIT ?''', (last, size))
+                    rows = cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < size:
+                return
+            last = rows[-1][0]
+    
+    def _scan_chunks(self, columns, decoders, descending=False):
+        """
+        Return an iterator over lists of the decoded columns of every row, see _row_chunks().  Each chunk is
+        decoded in one go after the lock has been released, on a background thread if iter_prefetch is set.
+        """
+        if self._parallel_decode:
+            chunks = self._pool_decoded(decoders, self._row_chunks(columns, descending))
+        else:
+            chunks = (_decode_rows(decoders, rows) for rows in self._row_chunks(columns, descending))
+        if self._iter_prefetch:
+            chunks = self._prefetched(chunks)
+        return chunks
+    
+    def _scan(self, columns, decoders, descending=False):
+        for chunk in self._scan_chunks(columns, decoders, descending):
+            for item in chunk:
+                yield item
+    
+    def _pool_decoded(self, decoders, chunks):
+        """
+        Decode chunks of rows on the parallel_decode pool and yield them in order.  At most two chunks per
+        worker are in flight at a time, so reading never gets far ahead of the consumer.
+        """
+        with self.lock:
+            if self._decode_pool is None:
+                if self._parallel_decode == "process":
+                    self._decode_pool = ProcessPoolExecutor(self._decode_workers)
+                else:
+                    self._decode_pool = ThreadPoolExecutor(self._decode_workers)
+            pool = self._decode_pool
+        pending = deque()
+        try:
+            for rows in chunks:
+                pending.append(pool.submit(_decode_rows, decoders, rows))
+                if len(pending) >= 2 * self._decode_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+    
+    @staticmethod
+    def _prefetched(chunks):
+        """
+        Run the chunks generator on a background thread that stays at most one chunk ahead of the consumer.
+        The thread gives up as soon as the consumer stops iterating.
+        """
+        queue = Queue(1)
+        stopped = Event()
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+        def produce():
+            try:
+                for chunk in chunks:
+                    if not put((True, chunk)):
+                        return
+            except Exception as e:
+                put((False, e))
+            else:
+                put((False, None))
+        thread = Thread(target=produce)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                more, item = queue.get()
+                if not more:
+                    if item is not None:
+                        raise item
+                    return
+                yield item
+        finally:
+            stopped.set()
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Make every write in the with block part of one transaction, which is committed when the block ends or
+        rolled back if it raises.  Group commit bookkeeping is skipped inside the block.  Uncommitted writes from
+        before the block are kept either way.  Other threads using the same file wait for the block to finish.
+        Transactions can be nested, only the outermost one commits.  For containers in a SqliteStore, this is a
+        transaction of the whole store.
+        """
+        if self._store is not None:
+            with self._store.transaction():
+                yield self
+            return
+        with self.lock:
+            with self._closeable_cursor() as cursor:
+                self._transaction_depth += 1
+                try:
+                    with self._savepoint(cursor):
+                        yield self
+                except:
+                    self._rolled_back()
+                    raise
+                finally:
+                    self._transaction_depth -= 1
+            self._commit()
+    
+    batch = transaction
+    
+    @contextmanager
+    def _savepoint(self, cursor):
+        """
+        Run the body of the with block inside a savepoint, rolling back just the body if it raises.
+        Earlier uncommitted writes are kept either way.
+        """
+        with self.lock:
+            if not self._db.in_transaction:
+                cursor.execute('''BEGIN''')
+                (self._store or self)._begin_changes = self._db.total_changes
+            cursor.execute('''SAVEPOINT sqlite_object''')
+            try:
+                yield
+            except:
+                cursor.execute('''ROLLBACK TO sqlite_object''')
+                cursor.execute('''RELEASE sqlite_object''')
+                raise
+            cursor.execute('''RELEASE sqlite_object''')
+    
+    def _bulk_write(self, statement, rows):
+        """
+        Run statement with executemany for every parameter tuple in rows.
+        
+        Rows are pulled (and so encoded) one chunk at a time, and all the chunks are written inside a single
+        transaction which counts as one write for commit_every.  If anything fails part way through, the rows
+        written by this call are rolled back but earlier uncommitted writes are kept.
+        """
+        with self.lock:
+            chunks = self._chunked(rows)
+            first = next(chunks, None)
+            if first is None:
+                #nothing to write, so don't start a transaction that nothing would ever commit
+                return
+            nbytes = 0
+            with self._closeable_cursor() as cursor:
+                with self._savepoint(cursor):
+                    for chunk in chain([first], chunks):
+                        cursor.executemany(statement, chunk)
+                        nbytes += sum(self._payload_size(row) for row in chunk)
+            self._do_write(nbytes)
+    
     class _CloseableCursor(sqlite3.Cursor):
         def __init__(self, *args, **kwargs):
             super(SqliteObject._CloseableCursor, self).__init__(*args, **kwargs)
@@ -74,7 +900,9 @@ class SqliteObject(object):
         def __exit__(self, x,y,z):
             self.close()
             
-    def _closeable_cursor(self):
+    def _closeable_cursor(self, db=None):
+        if db is not None:
+            return db.cursor(self._CloseableCursor)
         with self.lock:
             cursor = self._db.cursor(self._CloseableCursor)
             return cursor
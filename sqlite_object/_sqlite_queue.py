@@ -0,0 +1,234 @@
+from ._sqlite_object import SqliteObject
+import json, os, random, time, weakref
+
+from threading import Condition, RLock
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+
+#one condition per database file, built on the file's lock, so a put wakes consumers in the same process right away
+_conditions = weakref.WeakValueDictionary()
+_conditions_lock = RLock()
+
+def _file_condition(filename, lock):
+    with _conditions_lock:
+        key = os.path.abspath(filename)
+        condition = _conditions.get(key)
+        if condition is None:
+            condition = Condition(lock)
+            _conditions[key] = condition
+        return condition
+
+
+class QueueMessage(object):
+    """
+    An item handed out by a SqliteQueue with a visibility_timeout.  It stays in the queue, invisible to other
+    consumers, until it is acknowledged with ack() or the timeout runs out and it gets delivered again.
+    """
+    def __init__(self, queue, id, value, lease, deliveries):
+        self._queue = queue
+        self.id = id
+        self.value = value
+        self.lease = lease
+        #how many times this item has been handed out, including this one
+        self.deliveries = deliveries
+
+    def ack(self):
+        return self._queue.ack(self)
+
+    def nack(self, delay=0):
+        return self._queue.nack(self, delay)
+
+    def __repr__(self):
+        return "QueueMessage(id=%r, value=%r, deliveries=%r)" % (self.id, self.value, self.deliveries)
+
+
+class SqliteQueue(SqliteObject):
+    """
+    Durable FIFO queue backed by an sqlite db, for any number of producers and consumers in any number of
+    threads and processes sharing the file.
+
+    Without a visibility_timeout, get() removes items from the queue.  With one, get() leases them instead: the
+    items come back as QueueMessages, and are only removed once they are ack()ed.  Anything that isn't acked
+    within visibility_timeout seconds (say because the consumer crashed) is handed out again.
+
+    Blocked consumers are woken straight away by puts from the same process, and check for puts from other
+    processes with a backoff that starts at a millisecond and grows to poll_interval.
+    """
+
+    __schema = '''CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, value {value_type}, available_at REAL NOT NULL DEFAULT 0,
+                                                     lease INTEGER, deliveries INTEGER NOT NULL DEFAULT 0)'''
+    _table = "queue"
+    _name = "queue"
+    _min_poll_interval = 0.001
+    _shared_writers = True
+
+    def __init__(self, init_list=[], filename=None, coder=json.dumps, decoder=json.loads, persist=False, commit_every=0, profile=None, pragmas=None,
+                 commit_interval_ms=None, commit_bytes=None, concurrent_reads=False, codec=None,
+                 compression=None, compression_threshold=1024, compression_level=None, compression_dict=None,
+                 visibility_timeout=None, poll_interval=0.1, temp_dir=None, spill_mb=None, store=None, name=None):
+        #the primary key is all the queue needs, so there's no index to create
+        super(SqliteQueue, self).__init__(self.__schema, None, filename or self._random_filename(temp_dir), coder, decoder, index=False, persist=persist, commit_every=commit_every, profile=profile, pragmas=pragmas,
+                                          commit_interval_ms=commit_interval_ms, commit_bytes=commit_bytes, concurrent_reads=concurrent_reads, codec=codec,
+                                          compression=compression, compression_threshold=compression_threshold, compression_level=compression_level, compression_dict=compression_dict,
+                                          temp_dir=temp_dir, spill_mb=spill_mb, store=store, name=name)
+        self._visibility_timeout = visibility_timeout
+        self._poll_interval = poll_interval
+        if self._private_memory:
+            self._condition = Condition(self.lock)
+        else:
+            self._condition = _file_condition(self._filename, self.lock)
+        self.put_many(init_list)
+
+    def __len__(self):
+        """
+        Number of items in the queue, including leased items that haven't been acked yet
+        """
+        with self._reading() as db:
+            with self._closeable_cursor(db) as cursor:
+                return cursor.execute('''SELECT COUNT(*) FROM ''' + self._table).fetchone()[0]
+
+    def qsize(self):
+        return len(self)
+
+    def empty(self):
+        with self._reading() as db:
+            with self._closeable_cursor(db) as cursor:
+                return cursor.execute('''SELECT 1 FROM ''' + self._table + ''' LIMIT 1''').fetchone() is None
+
+    def put(self, item):
+        with self._condition:
+            value = self._encode_value(item)
+            with self._closeable_cursor() as cursor:
+                cursor.execute('''INSERT INTO ''' + self._table + ''' (value) VALUES (?)''', (value, ))
+            self._do_write(self._payload_size((value, )))
+            self._condition.notify_all()
+
+    def put_many(self, items):
+        """
+        Add every item from items to the queue, in one transaction
+        """
+        with self._condition:
+            self._bulk_write('''INSERT INTO ''' + self._table + ''' (value) VALUES (?)''', ((self._encode_value(item), ) for item in items))
+            self._condition.notify_all()
+
+    def get(self, block=True, timeout=None):
+        """
+        Take the item at the front of the queue.  If there isn't one, wait for up to timeout seconds (forever if
+        timeout is None) if block is True, and raise queue.Empty if there's still nothing or block is False.
+        """
+        items = self.get_batch(1, block, timeout)
+        if not items:
+            raise Empty()
+        return items[0]
+
+    def get_batch(self, n, block=True, timeout=None):
+        """
+        Take up to n items from the front of the queue in one statement.  If the queue is empty, wait like
+        get() does, but return an empty list instead of raising queue.Empty.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        delay = self._min_poll_interval
+        check = True
+        with self._condition:
+            while True:
+                if check:
+                    items, next_available = self._take(n)
+                    if items or not block:
+                        return items
+                    changes = self._db.total_changes
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    return []
+                wait = delay
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+                if next_available is not None:
+                    wait = min(wait, max(next_available - now, 0))
+                self._condition.wait(wait)
+                delay = min(delay * 2, self._poll_interval)
+                #only look at the table again if something could have changed: another connection committed,
+                #another thread wrote through this one or a lease ran out
+                check = (self._changed_elsewhere() or self._db.total_changes != changes or
+                         (next_available is not None and time.time() >= next_available))
+
+    def _take(self, n):
+        """
+        Remove (or lease) up to n available items, returning (items, time the next leased item becomes available)
+        """
+        now = time.time()
+        with self._closeable_cursor() as cursor:
+            if not self._db.in_transaction:
+                #take the write lock up front: select and update have to happen without another consumer getting in
+                #between, and a deferred transaction that reads before it writes can't wait for a busy database
+                cursor.execute('''BEGIN IMMEDIATE''')
+            available = '''SELECT id FROM ''' + self._table + ''' WHERE available_at <= ? ORDER BY id LIMIT ?'''
+            lease = None
+            if self._visibility_timeout is None:
+                if self._returning:
+                    rows = cursor.execute('''DELETE FROM ''' + self._table + ''' WHERE id IN (''' + available + ''') RETURNING id, value, deliveries''', (now, n)).fetchall()
+                else:
+                    rows = cursor.execute('''SELECT id, value, deliveries FROM ''' + self._table + ''' WHERE id IN (''' + available + ''')''', (now, n)).fetchall()
+                    cursor.execute('''DELETE FROM ''' + self._table + ''' WHERE id IN (''' + available + ''')''', (now, n))
+            else:
+                lease = random.getrandbits(62)
+                update = '''UPDATE ''' + self._table + ''' SET available_at = ?, lease = ?, deliveries = deliveries + 1 WHERE id IN (''' + available + ''')'''
+                params = (now + self._visibility_timeout, lease, now, n)
+                if self._returning:
+                    rows = cursor.execute(update + ''' RETURNING id, value, deliveries''', params).fetchall()
+                else:
+                    rows = cursor.execute('''SELECT id, value, deliveries + 1 FROM ''' + self._table + ''' WHERE id IN (''' + available + ''')''', (now, n)).fetchall()
+                    cursor.execute(update, params)
+            if not rows:
+                next_available = cursor.execute('''SELECT MIN(available_at) FROM ''' + self._table).fetchone()[0]
+        if not rows:
+            #nothing was written, don't hold on to the write lock
+            self._end_read_transaction()
+            return [], next_available
+        self._do_write()
+        rows.sort()
+        if lease is None:
+            return [self._decode_value(row[1]) for row in rows], None
+        return [QueueMessage(self, row[0], self._decode_value(row[1]), lease, row[2]) for row in rows], None
+
+    def ack(self, message):
+        """
+        Remove a leased message from the queue.  Returns False if its lease had run out and it has been handed
+        out again since (in which case it stays in the queue).
+        """
+        return self.ack_batch([message]) == 1
+
+    def ack_batch(self, messages):
+        """
+        Remove leased messages from the queue, returning how many of them were still leased to us
+        """
+        with self.lock:
+            acked = 0
+            with self._closeable_cursor() as cursor:
+                with self._savepoint(cursor):
+                    for chunk in self._chunked((message.id, message.lease) for message in messages):
+                        cursor.executemany('''DELETE FROM ''' + self._table + ''' WHERE id = ? AND lease = ?''', chunk)
+                        acked += cursor.rowcount
+            self._do_write()
+            return acked
+
+    def nack(self, message, delay=0):
+        """
+        Give a leased message back, making it available again after delay seconds
+        """
+        with self._condition:
+            with self._closeable_cursor() as cursor:
+                cursor.execute('''UPDATE ''' + self._table + ''' SET available_at = ?, lease = NULL WHERE id = ? AND lease = ?''', (time.time() + delay, message.id, message.lease))
+                returned = cursor.rowcount == 1
+            self._do_write()
+            self._condition.notify_all()
+            return returned
+
+    def clear(self):
+        with self.lock:
+            with self._closeable_cursor() as cursor:
+                cursor.execute('''DELETE FROM ''' + self._table)
+            self._do_write()
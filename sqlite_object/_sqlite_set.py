@@ -1,4 +1,8 @@
-import json, uuid
+import json, os, uuid
+
+from contextlib import contextmanager
+
+from ._json_stream import iter_array
 from ._sqlite_object import SqliteObject
 
 try:
@@ -6,24 +10,35 @@ try:
 except NameError:
     unicode = str
 
+def _is_set(other):
+    #like the builtin set, the operators only take other sets, the methods take any iterable
+    return isinstance(other, (SqliteSet, set, frozenset))
+
 class SqliteSet(SqliteObject):
-    __schema = '''CREATE TABLE IF NOT EXISTS set_table (key TEXT PRIMARY KEY)'''
-    __index = '''CREATE INDEX IF NOT EXISTS set_index ON set_table (key)'''
+    __schema = '''CREATE TABLE IF NOT EXISTS {table} (key {key_type} PRIMARY KEY)'''
+    __index = '''CREATE INDEX IF NOT EXISTS {name}_index ON {table} (key)'''
+    _table = "set_table"
+    _name = "set"
     
     
-    def __init__(self, init_set = [], filename=None, coder=json.dumps, decoder=json.loads, index=True, persist=False, commit_every=0):
-        super(SqliteSet, self).__init__(self.__schema, self.__index, filename or str(uuid.uuid4())+".sqlite3", coder, decoder, index=index, persist=persist, commit_every=commit_every)
+    def __init__(self, init_set = [], filename=None, coder=json.dumps, decoder=json.loads, index=True, persist=False, commit_every=0, profile=None, pragmas=None,
+                 commit_interval_ms=None, commit_bytes=None, concurrent_reads=False, codec=None, iter_chunk_size=1000, iter_prefetch=False,
+                 parallel_decode=None, decode_workers=None, temp_dir=None, spill_mb=None, store=None, name=None):
+        super(SqliteSet, self).__init__(self.__schema, self.__index, filename or self._random_filename(temp_dir), coder, decoder, index=index, persist=persist, commit_every=commit_every, profile=profile, pragmas=pragmas,
+                                         commit_interval_ms=commit_interval_ms, commit_bytes=commit_bytes, concurrent_reads=concurrent_reads, codec=codec,
+                                         iter_chunk_size=iter_chunk_size, iter_prefetch=iter_prefetch,
+                                         parallel_decode=parallel_decode, decode_workers=decode_workers,
+                                         temp_dir=temp_dir, spill_mb=spill_mb, store=store, name=name)
         
-        for item in init_set:
-            self.add(item)
+        self.update(init_set)
             
     
     def _getlen(self, cursor):
-        for row in cursor.execute('''SELECT COUNT(*) FROM set_table'''):
+        for row in cursor.execute('''SELECT COUNT(*) FROM ''' + self._table):
             return row[0]
     
     def _has(self, cursor, item):
-        rows = cursor.execute('''SELECT key FROM set_table WHERE key = ?''', (self._coder(item), ))
+        rows = cursor.execute('''SELECT key FROM ''' + self._table + ''' WHERE key = ?''', (self._coder(item), ))
         if rows.fetchone() != None:
             return True
         else:
@@ -36,50 +51,44 @@ class SqliteSet(SqliteObject):
             raise KeyError("Item not in set_table")
     
     def _discard(self, cursor, item):
-        cursor.execute('''DELETE FROM set_table WHERE key = ?''', (self._coder(item), ))
+        cursor.execute('''DELETE FROM ''' + self._table + ''' WHERE key = ?''', (self._coder(item), ))
         
     def _add(self, cursor, item):
-        cursor.execute('''INSERT OR IGNORE INTO set_table (key) VALUES (?)''', (self._coder(item), ))
+        key = self._coder(item)
+        cursor.execute('''INSERT OR IGNORE INTO ''' + self._table + ''' (key) VALUES (?)''', (key, ))
+        return len(key)
     
     def __len__(self):
-        with self.lock:
-            with self._closeable_cursor() as cursor:
+        with self._reading() as db:
+            with self._closeable_cursor(db) as cursor:
                 return self._getlen(cursor)
     
     def __contains__(self, item):
-        with self.lock:
-            with self._closeable_cursor() as cursor:
-                return self._has(cursor, item)
+        return self._read_one('''SELECT 1 FROM ''' + self._table + ''' WHERE key = ?''', (self._coder(item), )) is not None
             
     def __iter__(self):
-        with self.lock:
-            with self._closeable_cursor() as cursor:
-                for row in cursor.execute('''SELECT key FROM set_table'''):
-                    yield self._decoder(row[0])
+        return self._scan('''key''', (self._decoder, ))
                 
     def add(self, item):
         with self.lock:
-            with self._closeable_cursor() as cursor:
-                self._add(cursor, item)
-            self._do_write()
+            nbytes = self._add(self._cursor, item)
+            self._do_write(nbytes)
     
     def remove(self, item):
         with self.lock:
-            with self._closeable_cursor() as cursor:
-                self._remove(cursor, item)
+            self._remove(self._cursor, item)
             self._do_write()
                 
     def discard(self, item):
         with self.lock:
-            with self._closeable_cursor() as cursor:
-                self._discard(cursor, item)
+            self._discard(self._cursor, item)
             self._do_write()
         
     def pop(self):
         out = None
         with self.lock:
             with self._closeable_cursor() as cursor:
-                rows = cursor.execute('''SELECT key FROM set_table LIMIT 1''')
+                rows = cursor.execute('''SELECT key FROM ''' + self._table + ''' LIMIT 1''')
                 row = rows.fetchone()
                 if row == None:
                     raise KeyError("Tried to pop empty set_table")
@@ -89,105 +98,281 @@ class SqliteSet(SqliteObject):
             return out
             
     
+    def _attachable(self, other):
+        """
+        True if other is an SqliteSet whose encoded keys can be compared directly with ours
+        """
+        if not isinstance(other, SqliteSet) or other._in_memory:
+            return False
+        if self._codec is not None or other._codec is not None:
+            return self._codec is not None and other._codec is not None and self._codec.name == other._codec.name
+        return self._coder == other._coder and self._decoder == other._decoder
+    
+    @contextmanager
+    def _operand(self, other):
+        """
+        Make other readable from this set's connection, yielding the name of a table of its encoded keys.
+        
+        Another SqliteSet with the same encoding has its database ATTACHed (which needs committed data on both
+        sides, so pending writes get committed first and anything written while it is attached is committed
+        before it is detached).  Anything else is encoded into a temporary table, one chunk at a time.
+        """
+        if other is self or (isinstance(other, SqliteSet) and (other._db is self._db or (not self._private_memory and not other._private_memory and
+                             os.path.abspath(other.get_filename()) == os.path.abspath(self._filename)))):
+            with self.lock:
+                yield "main." + other._table
+            return
+        #ATTACH needs commits on both sides, which would break up a transaction on either of them (and other's
+        #uncommitted writes would be missed)
+        attach = self._attachable(other) and not (self._store or self)._transaction_depth and not (other._store or other)._transaction_depth
+        if attach:
+            #outside our lock, so two sets operating on each other can't deadlock
+            other.commit()
+        with self.lock:
+            name = "other_" + uuid.uuid4().hex
+            if attach:
+                if self._db.in_transaction:
+                    self._commit()
+                self._db.execute('''ATTACH DATABASE ? AS ''' + name, (other.get_filename(), ))
+                try:
+                    yield name + "." + other._table
+                finally:
+                    if self._db.in_transaction:
+                        self._commit()
+                    self._db.execute('''DETACH DATABASE ''' + name)
+                return
+            started = not self._db.in_transaction
+            with self._closeable_cursor() as cursor:
+                cursor.execute('''CREATE TABLE temp.''' + name + ''' (key PRIMARY KEY)''')
+                try:
+                    for chunk in self._chunked((self._coder(item), ) for item in other):
+                        cursor.executemany('''INSERT OR IGNORE INTO temp.''' + name + ''' (key) VALUES (?)''', chunk)
+                    yield "temp." + name
+                finally:
+                    cursor.execute('''DROP TABLE temp.''' + name)
+                    #don't hold on to the read lock on main if loading the temp table is all that opened a transaction
+                    if started:
+                        self._end_read_transaction()
+    
+    def _query(self, other, query):
+        """
+        Run a query returning a single value, with {a} standing for this set's table and {b} for other's
+        """
+        with self._operand(other) as table:
+            with self._closeable_cursor() as cursor:
+                return cursor.execute(query.format(a="main." + self._table, b=table)).fetchone()[0]
+    
+    def _new_set(self):
+        if self._codec is not None:
+            return SqliteSet(codec=self._codec.name, temp_dir=self._temp_dir)
+        return SqliteSet(coder=self._coder, decoder=self._decoder, temp_dir=self._temp_dir)
+    
+    def _combined(self, select, others, update):
+        """
+        Build a new set from a select combining this set ({a}) with the first of others ({b}), then apply
+        update to it with each of the rest of others
+        """
+        result = self._new_set()
+        try:
+            with result._operand(self) as table:
+                if not others:
+                    select, others = '''SELECT key FROM {a}''', [()]
+                with result._operand(others[0]) as other_table:
+                    with result.lock:
+                        with result._closeable_cursor() as cursor:
+                            cursor.execute('''INSERT OR IGNORE INTO main.''' + result._table + ''' (key) ''' + select.format(a=table, b=other_table))
+                        result._do_write()
+            for other in others[1:]:
+                update(result, other)
+        except:
+            result.close()
+            raise
+        return result
+    
     def isdisjoint(self, other):
-        for item in self:
-            if item in other:
-                return False
-        return True
+        return bool(self._query(other, '''SELECT NOT EXISTS (SELECT 1 FROM {a} WHERE key IN (SELECT key FROM {b}))'''))
     
     def issubset(self, other):
-        for item in self:
-            if item not in other:
-                return False
-        return True
+        return bool(self._query(other, '''SELECT NOT EXISTS (SELECT 1 FROM {a} WHERE key NOT IN (SELECT key FROM {b}))'''))
 
     def __le__(self, other):
         return self.issubset(other)
     
     def __lt__(self, other):
-        return self.issubset(other) and (len(self) < len(other))
+        return bool(self._query(other, '''SELECT NOT EXISTS (SELECT 1 FROM {a} WHERE key NOT IN (SELECT key FROM {b}))
+                                          AND (SELECT COUNT(*) FROM {a}) < (SELECT COUNT(*) FROM {b})'''))
     
     def issuperset(self, other):
-        for item in other:
-            if item not in self:
-                return False
-        return True
+        return bool(self._query(other, '''SELECT NOT EXISTS (SELECT 1 FROM {b} WHERE key NOT IN (SELECT key FROM {a}))'''))
     
     def __ge__(self, other):
         return self.issuperset(other)
     
     def __gt__(self, other):
-        return self.issuperset(other) and (len(self) > len(other))
+        return bool(self._query(other, '''SELECT NOT EXISTS (SELECT 1 FROM {b} WHERE key NOT IN (SELECT key FROM {a}))
+                                          AND (SELECT COUNT(*) FROM {a}) > (SELECT COUNT(*) FROM {b})'''))
     
     def __eq__(self, other):
-        if len(self) == len(other):
-            for item in self:
-                if item not in other:
-                    return False
-            return True
-        else:
+        try:
+            iter(other)
+        except TypeError:
             return False
+        return bool(self._query(other, '''SELECT NOT EXISTS (SELECT 1 FROM {a} WHERE key NOT IN (SELECT key FROM {b}))
+                                          AND (SELECT COUNT(*) FROM {a}) = (SELECT COUNT(*) FROM {b})'''))
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def union(self, *others):
+        return self._combined('''SELECT key FROM {a} UNION SELECT key FROM {b}''', others, SqliteSet.update)
+    
+    def intersection(self, *others):
+        return self._combined('''SELECT key FROM {a} INTERSECT SELECT key FROM {b}''', others, SqliteSet.intersection_update)
     
-    def update(self, other):
-        for item in other:
-            self.add(item)
+    def difference(self, *others):
+        return self._combined('''SELECT key FROM {a} EXCEPT SELECT key FROM {b}''', others, SqliteSet.difference_update)
+    
+    def symmetric_difference(self, other):
+        return self._combined('''SELECT key FROM {a} WHERE key NOT IN (SELECT key FROM {b})
+                                 UNION ALL SELECT key FROM {b} WHERE key NOT IN (SELECT key FROM {a})''', (other, ), None)
+    
+    def update(self, *others):
+        for other in others:
+            if other is self:
+                continue
+            if not isinstance(other, SqliteSet):
+                self._bulk_write('''INSERT OR IGNORE INTO ''' + self._table + ''' (key) VALUES (?)''', ((self._coder(item), ) for item in other))
+                continue
+            with self._operand(other) as table:
+                with self._closeable_cursor() as cursor:
+                    cursor.execute('''INSERT OR IGNORE INTO main.''' + self._table + ''' (key) SELECT key FROM ''' + table)
+                self._do_write()
+    
+    def intersection_update(self, *others):
+        for other in others:
+            with self._operand(other) as table:
+                with self._closeable_cursor() as cursor:
+                    cursor.execute('''DELETE FROM main.''' + self._table + ''' WHERE key NOT IN (SELECT key FROM ''' + table + ''')''')
+                self._do_write()
+    
+    def difference_update(self, *others):
+        for other in others:
+            with self._operand(other) as table:
+                with self._closeable_cursor() as cursor:
+                    cursor.execute('''DELETE FROM main.''' + self._table + ''' WHERE key IN (SELECT key FROM ''' + table + ''')''')
+                self._do_write()
+    
+    def symmetric_difference_update(self, other):
+        with self._operand(other) as table:
+            with self._closeable_cursor() as cursor:
+                with self._savepoint(cursor):
+                    #rows inserted now get rowids past the current last one, so the delete only sees the keys we had before
+                    last = cursor.execute('''SELECT COALESCE(MAX(rowid), 0) FROM main.''' + self._table).fetchone()[0]
+                    cursor.execute('''INSERT OR IGNORE INTO main.''' + self._table + ''' (key) SELECT key FROM ''' + table)
+                    cursor.execute('''DELETE FROM main.''' + self._table + ''' WHERE rowid <= ? AND key IN (SELECT key FROM ''' + table + ''')''', (last, ))
+            self._do_write()
+    
+    def __or__(self, other):
+        if not _is_set(other):
+            return NotImplemented
+        return self.union(other)
+    
+    def __and__(self, other):
+        if not _is_set(other):
+            return NotImplemented
+        return self.intersection(other)
+    
+    def __sub__(self, other):
+        if not _is_set(other):
+            return NotImplemented
+        return self.difference(other)
+    
+    def __xor__(self, other):
+        if not _is_set(other):
+            return NotImplemented
+        return self.symmetric_difference(other)
+    
+    __ror__ = __or__
+    __rand__ = __and__
+    __rxor__ = __xor__
+    
+    def __rsub__(self, other):
+        if not _is_set(other):
+            return NotImplemented
+        result = self._new_set()
+        try:
+            result.update(other)
+            result.difference_update(self)
+        except:
+            result.close()
+            raise
+        return result
+    
+    def __ior__(self, other):
+        if not _is_set(other):
+            return NotImplemented
+        self.update(other)
+        return self
+    
+    def __iand__(self, other):
+        if not _is_set(other):
+            return NotImplemented
+        self.intersection_update(other)
+        return self
+    
+    def __isub__(self, other):
+        if not _is_set(other):
+            return NotImplemented
+        self.difference_update(other)
+        return self
+    
+    def __ixor__(self, other):
+        if not _is_set(other):
+            return NotImplemented
+        self.symmetric_difference_update(other)
+        return self
     
     def clear(self):
         with self.lock:
             with self._closeable_cursor() as cursor:
-                cursor.execute('''DELETE FROM set_table''')
+                cursor.execute('''DELETE FROM ''' + self._table)
+            self._do_write()
                 
+    def _encoded_chunks(self, coder):
+        """
+        Yield lists of the items encoded with coder.  If that would just give back what's stored, the stored text
+        is passed along as it is.
+        """
+        if coder is json.dumps and self._plain_json(values=False):
+            return ([row[1] for row in rows] for rows in self._row_chunks('''key'''))
+        return ([unicode(coder(item)) for item in chunk] for chunk in self._scan_chunks('''key''', (self._decoder, )))
+    
     def write(self, outfile):
+        """
+        Write the set to outfile as a JSON array
+        """
         with self.lock:
-            outfile.write(u"[")
-            iterator = iter(self)
-            try:
-                try:
-                    this = iterator.__next__()
-                except AttributeError:
-                    this = iterator.next()
-            except StopIteration:
-                outfile.write(u"]")
-                return
-            else:
-                while True:
-                    outfile.write(unicode(json.dumps(this)))
-                    try:
-                        try:
-                            this = iterator.__next__()
-                        except AttributeError:
-                            this = iterator.next()
-                    except StopIteration:
-                        outfile.write(u"]")
-                        break
-                    else:
-                        outfile.write(u",")
+            self._write_joined(outfile, self._encoded_chunks(json.dumps), u",", u"[", u"]")
                         
     def write_lines(self, outfile, coder=json.dumps, separator=u"\n"):
+        """
+        Write each item of the set to outfile, encoded with coder and followed by separator
+        """
         with self.lock:
-            iterator = iter(self)
-            try:
-                try:
-                    this = iterator.__next__()
-                except AttributeError:
-                    this = iterator.next()
-            except StopIteration:
-                return
-            else:
-                while True:
-                    outfile.write(unicode(coder(this)))
-                    outfile.write(unicode(separator))
-                    try:
-                        try:
-                            this = iterator.__next__()
-                        except AttributeError:
-                            this = iterator.next()
-                    except StopIteration:
-                        break
-                        
-                        
-                
-        
-        
-        
-    
\ No newline at end of file
+            self._write_joined(outfile, self._encoded_chunks(coder), unicode(separator), terminated=True)
+    
+    @classmethod
+    def load_lines(cls, infile, decoder=json.loads, **kwargs):
+        """
+        Make a new SqliteSet (kwargs are passed on to SqliteSet) out of the lines of infile, each decoded with
+        decoder.  Blank lines are skipped.  The file is read and written to the database a chunk at a time.
+        """
+        return cls._loaded(kwargs, lambda loaded: loaded.update(decoder(line) for line in infile if line.strip()))
+    
+    @classmethod
+    def load_json(cls, infile, **kwargs):
+        """
+        Make a new SqliteSet (kwargs are passed on to SqliteSet) out of the JSON array in infile, which is
+        parsed and written to the database an item at a time rather than loaded all at once
+        """
+        return cls._loaded(kwargs, lambda loaded: loaded.update(iter_array(infile)))
@@ -0,0 +1,110 @@
+from ._sqlite_object import SqliteObject
+from ._sqlite_dict import SqliteDict
+from ._sqlite_list import SqliteList
+from ._sqlite_queue import SqliteQueue
+from ._sqlite_set import SqliteSet
+import weakref
+
+
+class SqliteStore(SqliteObject):
+    """
+    One sqlite db holding any number of named SqliteDicts, SqliteLists, SqliteSets and SqliteQueues, each in
+    a table of its own.
+
+    The containers all use the store's connection (so there is one file handle and one page cache between
+    them), its lock and its commit settings.  transaction() commits writes to any number of them at once.
+    """
+
+    def __init__(self, filename=None, persist=False, commit_every=0, profile=None, pragmas=None, commit_interval_ms=None, commit_bytes=None,
+                 concurrent_reads=False, temp_dir=None, spill_mb=None):
+        #name -> open container, so asking for the same name twice gives back the same object
+        self._containers = weakref.WeakValueDictionary()
+        #no table of its own, and no coder: each container brings its own
+        super(SqliteStore, self).__init__(None, None, filename or self._random_filename(temp_dir), None, None, index=False, persist=persist, commit_every=commit_every, profile=profile, pragmas=pragmas,
+                                          commit_interval_ms=commit_interval_ms, commit_bytes=commit_bytes, concurrent_reads=concurrent_reads,
+                                          temp_dir=temp_dir, spill_mb=spill_mb)
+
+    def close(self):
+        with self.lock:
+            for container in list(self._containers.values()):
+                container.close()
+            super(SqliteStore, self).close()
+
+    def _container(self, container_class, name, kwargs):
+        with self.lock:
+            container = self._containers.get(name)
+            if container is None:
+                return container_class(store=self, name=name, **kwargs)
+            if type(container) is not container_class:
+                raise ValueError(repr(name) + " is open as a " + type(container).__name__ + ", not a " + container_class.__name__)
+            return container
+
+    def dict(self, name, **kwargs):
+        """
+        Return the SqliteDict called name, creating it if it isn't in the store yet.  kwargs go to SqliteDict
+        (apart from the database and commit settings, which are the store's) and are ignored if it's already open.
+        """
+        return self._container(SqliteDict, name, kwargs)
+
+    def list(self, name, **kwargs):
+        """
+        Return the SqliteList called name, like dict()
+        """
+        return self._container(SqliteList, name, kwargs)
+
+    def set(self, name, **kwargs):
+        """
+        Return the SqliteSet called name, like dict()
+        """
+        return self._container(SqliteSet, name, kwargs)
+
+    def queue(self, name, **kwargs):
+        """
+        Return the SqliteQueue called name, like dict()
+        """
+        return self._container(SqliteQueue, name, kwargs)
+
+    def names(self):
+        """
+        Return the names of all the containers in the store, whether they're open or not
+        """
+        with self._reading() as db:
+            with self._closeable_cursor(db) as cursor:
+                rows = cursor.execute('''SELECT name FROM meta WHERE name LIKE '%.type' ORDER BY name''').fetchall()
+        return [row[0][:-len(".type")] for row in rows]
+
+    def __contains__(self, name):
+        return name in self.names()
+
+    def drop(self, name):
+        """
+        Close the container called name if it's open, and delete it from the store
+        """
+        with self.lock:
+            if name not in self.names():
+                raise KeyError("No " + repr(name) + " in the store")
+            container = self._containers.get(name)
+            if container is not None:
+                container.close()
+            with self._closeable_cursor() as cursor:
+                with self._savepoint(cursor):
+                    #its indexes go with it
+                    cursor.execute('''DROP TABLE IF EXISTS "''' + name + '''"''')
+                    cursor.execute('''DELETE FROM meta WHERE substr(name, 1, ?) = ?''', (len(name) + 1, name + "."))
+            self._do_write()
+
+    def _rolled_back(self):
+        for container in list(self._containers.values()):
+            container._rolled_back()
+
+    def _spill(self):
+        with self.lock:
+            super(SqliteStore, self)._spill()
+            for container in self._containers.values():
+                container._db = self._db
+                container._cursor = self._cursor
+                container._filename = self._filename
+                container._in_memory = False
+                container._private_memory = False
+                container._spilled = True
+                container._data_version = None
@@ -1,5 +1,5 @@
 from __future__ import print_function
-from sqlite_object import SqliteList, SqliteDict, SqliteSet
+from sqlite_object import SqliteList, SqliteDict, SqliteSet, SqliteQueue, SqliteStore, MISSING, register_codec, train_dictionary
 try:
     from io import StringIO
 except:
@@ -7,9 +7,36 @@ except:
 
 import json
 
-import unittest, os
+import sqlite3, threading, time, unittest, os
+from random import Random
+import multiprocessing
 
 
+#queue workers for test_queue_processes, at module level so they can be started in other processes
+def queue_producer(filename, values, results):
+    try:
+        q = SqliteQueue(filename=filename, persist=True)
+        for value in values:
+            q.put(value)
+        q.close()
+        results.put(("producer", None))
+    except Exception as e:
+        results.put(("producer", repr(e)))
+
+def queue_consumer(filename, results):
+    try:
+        q = SqliteQueue(filename=filename, persist=True)
+        got = []
+        while True:
+            batch = q.get_batch(5, timeout=2)
+            if not batch:
+                break
+            got.extend(batch)
+        q.close()
+        results.put(("consumer", got))
+    except Exception as e:
+        results.put(("consumer", repr(e)))
+
 
 class TestSqliteObjects(unittest.TestCase):
     
@@ -94,6 +121,20 @@ class TestSqliteObjects(unittest.TestCase):
         l2.append("hi")
         self.assertEqual([x for x in l], [x for x in l2])
         self.assertEqual("hi", l[-1])
+        #both objects keep track of the ends of the list, make sure they notice each other's changes
+        self.assertEqual(4, len(l))
+        l2.prepend("first")
+        self.assertEqual(5, len(l))
+        self.assertEqual("first", l[0])
+        self.assertEqual("first", l.pop_first())
+        self.assertEqual("hi", l2.pop_last())
+        self.assertEqual(["a", "b", "c"], [x for x in l2])
+        self.assertEqual("c", l[-1])
+        l2.clear()
+        self.assertEqual(0, len(l))
+        self.assertRaises(IndexError, l.pop_first)
+        l.append("again")
+        self.assertEqual(["again"], [x for x in l2])
         
         thing = SqliteList(["a", "b", "c"], filename = "doodad.sqlite3", persist=True)
         del thing
@@ -110,6 +151,35 @@ class TestSqliteObjects(unittest.TestCase):
         self.assertEqual([9], [x for x in l[9:100]])
         
         
+        self.assertEqual([8, 5, 2], [x for x in l[-2::-3]])
+        self.assertEqual([], [x for x in l[5:2]])
+        self.assertEqual([], [x for x in SqliteList()[:]])
+        
+        #slice assignment and deletion, checked against a regular list
+        for key, values in [(slice(2, 4), ["a", "b"]), (slice(2, 4), ["a", "b", "c", "d"]), (slice(6, 9), ["a"]),
+                            (slice(1, 3), []), (slice(5, 5), ["x", "y"]), (slice(None, None, 3), ["p", "q", "r", "s"]),
+                            (slice(None, None, -4), ["p", "q", "r"]), (slice(20, 30), ["end"]), (slice(0, 0), ["start"])]:
+            expected = list(range(10))
+            l = SqliteList(range(10))
+            expected[key] = values
+            l[key] = values
+            self.assertEqual(expected, [x for x in l])
+            self.assertEqual(len(expected), len(l))
+        l = SqliteList(range(10))
+        self.assertRaises(ValueError, l.__setitem__, slice(None, None, 2), [1, 2])
+        
+        for key in [slice(2, 4), slice(7, 9), slice(None, None, 3), slice(1, 8, 2), slice(None, None, -3), slice(5, 2), -1, 0, 4]:
+            expected = list(range(10))
+            l = SqliteList(range(10))
+            del expected[key]
+            del l[key]
+            self.assertEqual(expected, [x for x in l])
+            self.assertEqual(len(expected), len(l))
+            l.append("last")
+            l.prepend("first")
+            self.assertEqual(["first"] + expected + ["last"], [x for x in l])
+        self.assertRaises(IndexError, l.__delitem__, 50)
+        
         l = SqliteList(range(10))
         self.assertEqual(10, len(l))
         l.clear()
@@ -156,6 +226,112 @@ class TestSqliteObjects(unittest.TestCase):
         self.assertEqual({22, "c", "other"}, set([x for x in d.values()]))
         self.assertEqual({("1", 22), ("3", "c"), ("thing", "other")}, set([x for x in d.items()]))
         
+    def test_list_index_modes(self):
+        for mode in ("hash", "full", "none"):
+            l = SqliteList(index=mode, codec="pickle" if mode == "hash" else None)
+            self.run_list_tests(l)
+            l.clear()
+            l.extend([1, "a", {"x": 1}, "a", None])
+            l.prepend("a")
+            l[1] = "b"
+            l[2:3] = ["c", "a"]
+            self.assertEqual(["a", "b", "c", "a", {"x": 1}, "a", None], list(l))
+            self.assertEqual(mode, l.get_index_mode())
+            self.assertTrue("a" in l)
+            self.assertFalse("q" in l)
+            self.assertEqual((0, 3, 5), (l.index("a"), l.index("a", 2), l.index("a", -3)))
+            self.assertEqual(4, l.index({"x": 1}))
+            with self.assertRaises(ValueError):
+                l.index("a", 1, 3)
+            with self.assertRaises(ValueError):
+                l.index("q")
+            self.assertEqual((3, 1, 0), (l.count("a"), l.count(None), l.count("q")))
+            l.pop_first()
+            self.assertEqual((2, 2), (l.index("a"), l.count("a")))
+            l.close()
+        
+        #the mode is recorded, and switching it builds the new index
+        filename = "test_list_index.sqlite3"
+        l = SqliteList(["a", "b", "a"], filename=filename, persist=True, index="none")
+        l.close()
+        l = SqliteList(filename=filename, persist=True, index="hash")
+        l.append("a")
+        l.close()
+        l = SqliteList(filename=filename, persist=True)
+        try:
+            self.assertEqual("hash", l.get_index_mode())
+            self.assertEqual((3, 2), (l.count("a"), l.index("a", 1)))
+            plan = l._db.execute('''EXPLAIN QUERY PLAN SELECT 1 FROM list WHERE value_hash = ? AND value = ?''', (1, "x")).fetchall()
+            self.assertTrue("list_value_hash" in plan[0][-1])
+        finally:
+            l.close()
+            os.remove(filename)
+        
+    def test_list_insert_remove(self):
+        l = SqliteList(range(10))
+        l.insert(3, "a")
+        l.insert(-1, "b")
+        l.insert(100, "c")
+        l.insert(-100, "d")
+        l.remove(5)
+        del l[2]
+        self.assertEqual(["d", 0, 2, "a", 3, 4, 6, 7, 8, "b", 9, "c"], list(l))
+        with self.assertRaises(ValueError):
+            l.remove(5)
+        l.close()
+        
+        #tiny blocks, so blocks fill up, get split and run out of room between them
+        class SmallBlocks(SqliteList):
+            _block_bits = 4
+            _block_rows = 2
+            _block_spacing = 2
+        filename = "test_list_blocks.sqlite3"
+        l = SmallBlocks(range(20), filename=filename, persist=True)
+        expected = list(range(20))
+        try:
+            random = Random(4)
+            with l.transaction():
+                for i in range(300):
+                    position = random.randint(-len(expected) - 2, len(expected) + 2)
+                    if i % 3 == 0 and expected:
+                        del l[position % len(expected)]
+                        del expected[position % len(expected)]
+                    elif i % 7 == 0:
+                        l.remove(expected[0])
+                        expected.remove(expected[0])
+                    else:
+                        l.insert(position, i)
+                        expected.insert(position, i)
+            self.assertEqual(expected, list(l))
+            self.assertEqual(expected, [l[i] for i in range(len(l))])
+            self.assertEqual(expected[5:40:3], list(l[5:40:3]))
+            del l[3:50:4]
+            del expected[3:50:4]
+            l.prepend("first")
+            l.append("last")
+            expected = ["first"] + expected + ["last"]
+            self.assertEqual(expected[::-2], list(l[::-2]))
+            self.assertEqual(len(expected) - 2, l.index(expected[-2]))
+            self.assertTrue(max(last - first + 1 for first, last in zip(l._firsts, l._lasts)) <= 2 * SmallBlocks._block_rows)
+            #the block map is read back the same from the database
+            l2 = SmallBlocks(filename=filename, persist=True)
+            self.assertEqual(expected, list(l2))
+            self.assertEqual((l._firsts, l._lasts), (l2._firsts, l2._lasts))
+            l2.close()
+        finally:
+            l.close()
+            os.remove(filename)
+        
+        #lists written before blocks were numbered 0, 1, 2... straight through, which reads as a few big blocks
+        l = SmallBlocks(index=False)
+        l._cursor.executemany('''INSERT INTO list (list_index, value) VALUES (?, ?)''', ((i - 5, str(i)) for i in range(40)))
+        l._blocks_valid = False
+        self.assertEqual(list(range(40)), list(l))
+        l.insert(20, "x")
+        del l[30]
+        self.assertEqual(list(range(20)) + ["x"] + list(range(20, 29)) + list(range(30, 40)), list(l))
+        l.close()
+        
     def test_dict(self):
         d = SqliteDict()
         self.run_dict_tests( d)
@@ -277,6 +453,1061 @@ class TestSqliteObjects(unittest.TestCase):
         self.assertIn(1, s)
         self.assertNotIn(6, s)
         
+    def test_set_algebra(self):
+        a = SqliteSet({1, 2, 3, 4})
+        b = SqliteSet({3, 4, 5})
+        
+        #both SqliteSets, run against the attached database
+        self.assertEqual({1, 2, 3, 4, 5}, set(a | b))
+        self.assertEqual({3, 4}, set(a & b))
+        self.assertEqual({1, 2}, set(a - b))
+        self.assertEqual({1, 2, 5}, set(a ^ b))
+        self.assertIsInstance(a | b, SqliteSet)
+        self.assertFalse(a.isdisjoint(b))
+        self.assertTrue(a & b <= a)
+        self.assertTrue(a >= (a & b))
+        self.assertTrue(a > (a & b))
+        self.assertFalse(a < a)
+        
+        #plain iterables go through a temporary table
+        self.assertEqual({1, 2, 3, 4, 7, 8}, set(a.union([7], (8, ))))
+        self.assertEqual({2}, set(a.difference(b, [1])))
+        self.assertEqual({1, 9}, set({1, 9} | (a - a)))
+        self.assertEqual({9}, set({1, 9} - a))
+        self.assertTrue(a == [4, 3, 2, 1, 1])
+        self.assertTrue(a != {1, 2})
+        self.assertTrue(a.isdisjoint(iter([9, 10])))
+        self.assertTrue(a.issubset(range(10)))
+        with self.assertRaises(TypeError):
+            a | [1]
+        
+        #sets with different codecs are compared by value
+        p = SqliteSet({1, 2}, codec="pickle")
+        self.assertEqual({1, 2, 3, 4}, set(p | a))
+        self.assertTrue(p <= a)
+        
+        c = SqliteSet({1, 2, 3})
+        c ^= b
+        self.assertEqual({1, 2, 4, 5}, set(c))
+        c &= {1, 2, 5}
+        self.assertEqual({1, 2, 5}, set(c))
+        c -= SqliteSet([1])
+        self.assertEqual({2, 5}, set(c))
+        c |= a
+        self.assertEqual({1, 2, 3, 4, 5}, set(c))
+        c ^= c
+        self.assertEqual(0, len(c))
+        
+        #pending writes on either side are seen
+        a = SqliteSet(commit_every=100)
+        b = SqliteSet(commit_every=100)
+        a.update([1, 2, 3])
+        b.add(2)
+        self.assertEqual({1, 3}, set(a - b))
+        a.difference_update(b)
+        self.assertEqual({1, 3}, set(a))
+        #including writes made inside a transaction, which can't be committed for the operation
+        with a.transaction():
+            a.add(10)
+            self.assertEqual({1, 2, 3, 10}, set(a | b))
+            self.assertEqual({1, 2, 3, 10}, set(b | a))
+            self.assertTrue(10 in a)
+        
+    def test_bulk_writes(self):
+        d = SqliteDict(dict((str(i), i) for i in range(2500)))
+        self.assertEqual(2500, len(d))
+        self.assertEqual(1234, d["1234"])
+        d.update([("a", 1)], b=2)
+        self.assertEqual(1, d["a"])
+        self.assertEqual(2, d["b"])
+        d.update(d)
+        self.assertEqual(2502, len(d))
+        
+        l = SqliteList(range(2500))
+        self.assertEqual(2500, len(l))
+        self.assertEqual(list(range(2500)), [x for x in l])
+        l.prepend(-1)
+        l.extend(x for x in range(2500, 2503))
+        self.assertEqual([-1, 0, 1], [x for x in l[:3]])
+        self.assertEqual([2501, 2502], [x for x in l[-2:]])
+        
+        l = SqliteList([1, 2])
+        l.extend(l)
+        self.assertEqual([1, 2, 1, 2], [x for x in l])
+        
+        s = SqliteSet(range(2500))
+        s.update(range(2000, 3000))
+        self.assertEqual(3000, len(s))
+        
+        #a failed bulk write shouldn't leave half of its rows behind
+        def picky_coder(item):
+            if item == "bad":
+                raise ValueError(item)
+            return json.dumps(item)
+        l = SqliteList([1], coder=picky_coder)
+        self.assertRaises(ValueError, l.extend, ["a"] * 1500 + ["bad"])
+        self.assertEqual([1], [x for x in l])
+        
+        #an empty bulk write (which every default constructor does) doesn't leave a transaction open, so reading
+        #from one object doesn't stop another one on the same file from writing
+        filename = "test_bulk_writes.sqlite3"
+        try:
+            writes = {SqliteDict: lambda o: o.__setitem__("x", 1), SqliteList: lambda o: o.append(1),
+                      SqliteSet: lambda o: o.add(1), SqliteQueue: lambda o: o.put(1)}
+            for cls, write in writes.items():
+                a = cls(filename=filename, persist=True)
+                b = cls(filename=filename, persist=True)
+                self.assertFalse(a._db.in_transaction or b._db.in_transaction)
+                self.assertEqual(0, len(b))
+                a._db.execute('''PRAGMA busy_timeout = 100''')
+                write(a)
+                self.assertEqual(1, len(b))
+                a.close()
+                b.close()
+        finally:
+            os.remove(filename)
+        
+    def test_pragma_profiles(self):
+        def pragma(obj, name):
+            with obj._closeable_cursor() as cursor:
+                return cursor.execute("PRAGMA " + name).fetchone()[0]
+        
+        d = SqliteDict(profile="scratch")
+        self.assertEqual("memory", pragma(d, "journal_mode"))
+        self.assertEqual(0, pragma(d, "synchronous"))
+        self.assertEqual(2, pragma(d, "temp_store"))
+        self.run_dict_tests(d)
+        
+        l = SqliteList(profile="durable")
+        self.assertEqual("wal", pragma(l, "journal_mode"))
+        self.assertEqual(1, pragma(l, "synchronous"))
+        self.run_list_tests(l)
+        
+        s = SqliteSet(profile="custom", pragmas={"cache_size": -1024})
+        self.assertEqual(-1024, pragma(s, "cache_size"))
+        s = SqliteSet(profile="scratch", pragmas=[("synchronous", "NORMAL")])
+        self.assertEqual(1, pragma(s, "synchronous"))
+        self.assertEqual("memory", pragma(s, "journal_mode"))
+        self.run_set_tests(s)
+        
+        self.assertRaises(ValueError, SqliteSet, profile="fast")
+        self.assertRaises(ValueError, SqliteSet, pragmas={"synchronous": "OFF; DROP TABLE set_table"})
+        
+    def test_group_commit(self):
+        def committed_rows(obj, table):
+            db = sqlite3.connect(obj.get_filename())
+            try:
+                return db.execute("SELECT COUNT(*) FROM " + table).fetchone()[0]
+            finally:
+                db.close()
+        
+        #commit after N writes, each object has its own counter
+        d = SqliteDict(commit_every=3)
+        d2 = SqliteDict(commit_every=3)
+        d["a"] = 1
+        d2["a"] = 1
+        d["b"] = 2
+        self.assertEqual(0, committed_rows(d, "dict"))
+        self.assertEqual(2, d.get_commit_stats()["pending_writes"])
+        self.assertEqual(1, d2.get_commit_stats()["pending_writes"])
+        d["c"] = 3
+        self.assertEqual(3, committed_rows(d, "dict"))
+        stats = d.get_commit_stats()
+        self.assertEqual(0, stats["pending_writes"])
+        self.assertEqual(0, stats["pending_bytes"])
+        self.assertTrue(stats["last_commit_latency"] >= 0)
+        
+        #commit after B bytes of encoded data
+        l = SqliteList(commit_every=1000, commit_bytes=100)
+        l.append("x" * 10)
+        self.assertEqual(0, committed_rows(l, "list"))
+        self.assertEqual(12, l.get_commit_stats()["pending_bytes"])
+        l.append("x" * 100)
+        self.assertEqual(2, committed_rows(l, "list"))
+        
+        #commit T milliseconds after a write even if nothing else happens
+        s = SqliteSet(commit_every=1000, commit_interval_ms=50)
+        s.add(1)
+        s.add(2)
+        self.assertEqual(0, committed_rows(s, "set_table"))
+        for i in range(100):
+            if committed_rows(s, "set_table") == 2:
+                break
+            time.sleep(0.02)
+        self.assertEqual(2, committed_rows(s, "set_table"))
+        self.assertEqual(0, s.get_commit_stats()["pending_writes"])
+        s.add(3)
+        s.close()
+        
+        #opening an object commits its setup, so others can open the file straight away
+        filename = "test_group_commit.sqlite3"
+        try:
+            l = SqliteList(filename=filename, persist=True, commit_every=100)
+            self.assertFalse(l._db.in_transaction)
+            l2 = SqliteList(filename=filename, persist=True, commit_every=100)
+            self.assertEqual(0, l2.get_commit_stats()["pending_writes"])
+            l.close()
+            l2.close()
+            d = SqliteDict({"a": {"x": 1}}, filename=filename, persist=True)
+            d.create_index(lambda value: value["x"], name="x")
+            d.close()
+            #dropping the function index left behind is part of the setup too
+            d = SqliteDict(filename=filename, persist=True, commit_every=100)
+            self.assertFalse(d._db.in_transaction)
+            d2 = SqliteDict(filename=filename, persist=True, commit_every=100)
+            d2._db.execute('''PRAGMA busy_timeout = 100''')
+            d2["b"] = {"x": 2}
+            d2.commit()
+            self.assertEqual({"x": 2}, d["b"])
+            d.close()
+            d2.close()
+        finally:
+            os.remove(filename)
+        
+    def test_batched_iteration(self):
+        for prefetch in (False, True):
+            d = SqliteDict(dict((str(i), i) for i in range(10)), iter_chunk_size=3, iter_prefetch=prefetch)
+            self.assertEqual(set(str(i) for i in range(10)), set(d))
+            self.assertEqual(dict((str(i), i) for i in range(10)), dict(d.items()))
+            self.assertEqual(list(range(10)), sorted(d.values()))
+            l = SqliteList(range(10), iter_chunk_size=3, iter_prefetch=prefetch)
+            self.assertEqual(list(range(10)), list(l))
+            self.assertEqual(list(reversed(range(10))), list(reversed(l)))
+            self.assertEqual([0, 1, 2, 3], list(l[0:4]))
+            #slices are read a chunk at a time too, and count their steps across chunks
+            self.assertEqual([1, 3, 5, 7], list(l[1:9:2]))
+            self.assertEqual([9, 6, 3, 0], list(l[::-3]))
+            self.assertEqual([2, 3, 4, 5, 6], list(l[2:7]))
+            s = SqliteSet(range(10), iter_chunk_size=4, iter_prefetch=prefetch)
+            self.assertEqual(set(range(10)), set(s))
+            
+            #stopping early is fine
+            for x in l:
+                break
+            self.assertEqual(0, x)
+            
+            #the lock isn't held between chunks, so other threads can write while we iterate
+            iterator = iter(d)
+            next(iterator)
+            writer = threading.Thread(target=d.__setitem__, args=("new", 1))
+            writer.start()
+            writer.join(10)
+            self.assertFalse(writer.is_alive())
+            self.assertEqual(11, len(d))
+            iterator = l[1:]
+            next(iterator)
+            writer = threading.Thread(target=l.append, args=(10, ))
+            writer.start()
+            writer.join(10)
+            self.assertFalse(writer.is_alive())
+            self.assertEqual(11, len(l))
+            #keys can be deleted while iterating
+            for key in d:
+                del d[key]
+            self.assertEqual(0, len(d))
+        
+    def test_parallel_decode(self):
+        expected = dict((str(i), [i, "x" * (i % 50)]) for i in range(2000))
+        for mode in ("thread", "process"):
+            d = SqliteDict(expected, parallel_decode=mode, decode_workers=2, iter_chunk_size=100, compression="zlib", compression_threshold=20)
+            self.assertEqual(expected, dict(d.items()))
+            self.assertEqual(sorted(expected.values()), sorted(d.values()))
+            io = StringIO()
+            d.write_lines(io)
+            self.assertEqual(2000, len(io.getvalue().strip().split("\n")))
+            l = SqliteList(range(1000), parallel_decode=mode, iter_chunk_size=7)
+            self.assertEqual(list(range(1000)), list(l))
+            self.assertEqual(list(reversed(range(1000))), list(reversed(l)))
+            self.assertEqual(set(range(100)), set(SqliteSet(range(100), parallel_decode=mode, iter_chunk_size=10)))
+            d.close()
+        with self.assertRaises(ValueError):
+            SqliteDict(coder=str, decoder=lambda x: x, parallel_decode="process")
+        with self.assertRaises(ValueError):
+            SqliteDict(parallel_decode="fibers")
+        
+    def test_multi_key(self):
+        for cache_size in (0, 10):
+            d = SqliteDict(dict((str(i), i) for i in range(3000)), cache_size=cache_size)
+            d["none"] = None
+            keys = ["5", "missing", "2999", "5", "none"] + [str(i) for i in range(2000, 0, -1)]
+            values = d.get_many(keys)
+            self.assertEqual([5, MISSING, 2999, 5, None] + list(range(2000, 0, -1)), values)
+            self.assertEqual([5, "x"], d.get_many(iter(["5", "missing2"]), default="x"))
+            self.assertEqual([], d.get_many([]))
+            self.assertEqual([True, False, True], d.contains_many(["1", "missing", "none"]))
+            
+            d.set_many({"a": 1, "5": "five"})
+            d.set_many([("b", 2)])
+            self.assertEqual([1, 2, "five"], d.get_many(["a", "b", "5"]))
+            self.assertEqual(2001, d.delete_many([str(i) for i in range(2000)] + ["5", "missing", "a"]))
+            self.assertEqual(1002, len(d))
+            self.assertEqual([MISSING, MISSING, 2], d.get_many(["5", "a", "b"]))
+        
+    def test_pop_fast_paths(self):
+        for returning in (True, False):
+            if returning and not SqliteDict._returning:
+                continue
+            d = SqliteDict({"a": 1, "b": [2], "c": None}, cache_size=10)
+            d._returning = returning
+            self.assertEqual(1, d["a"])
+            self.assertEqual(1, d.pop("a"))
+            self.assertNotIn("a", d)
+            self.assertEqual("default", d.pop("a", "default"))
+            self.assertEqual(None, d.pop("a", None))
+            with self.assertRaises(KeyError):
+                d.pop("a")
+            self.assertEqual(None, d.pop("c"))
+            self.assertEqual([2], d.setdefault("b", 5))
+            self.assertEqual(5, d.setdefault("e", 5))
+            self.assertEqual(5, d["e"])
+            items = dict([d.popitem(), d.popitem()])
+            self.assertEqual({"b": [2], "e": 5}, items)
+            self.assertEqual(0, len(d))
+            with self.assertRaises(KeyError):
+                d.popitem()
+            
+            l = SqliteList(range(5), commit_every=10)
+            l._returning = returning
+            l.commit()
+            self.assertEqual(4, l.pop_last())
+            self.assertEqual(0, l.pop_first())
+            #pops no longer force a commit
+            self.assertEqual(2, l.get_commit_stats()["pending_writes"])
+            self.assertEqual([1, 2, 3], list(l))
+            #another connection changing the list is noticed
+            l.commit()
+            l2 = SqliteList(filename=l.get_filename(), persist=True)
+            l2.append(10)
+            self.assertEqual(10, l.pop_last())
+            l.commit()
+            self.assertEqual(1, l2.pop_first())
+            self.assertEqual(2, l.pop_first())
+            self.assertEqual(3, l.pop_last())
+            with self.assertRaises(IndexError):
+                l.pop_last()
+            l2.close()
+        
+    def test_queue(self):
+        try:
+            from queue import Empty
+        except ImportError:
+            from Queue import Empty
+        q = SqliteQueue([1, 2])
+        q.put(3)
+        q.put_many([4, 5])
+        self.assertEqual(5, len(q))
+        self.assertEqual(1, q.get())
+        self.assertEqual([2, 3], q.get_batch(2))
+        self.assertEqual([4, 5], q.get_batch(10, block=False))
+        self.assertTrue(q.empty())
+        with self.assertRaises(Empty):
+            q.get(block=False)
+        start = time.time()
+        with self.assertRaises(Empty):
+            q.get(timeout=0.2)
+        self.assertTrue(time.time() - start >= 0.2)
+        self.assertEqual([], q.get_batch(5, timeout=0.05))
+        
+        #a blocked consumer is woken by a producer in another thread, and by another connection
+        q2 = SqliteQueue(filename=q.get_filename(), persist=True)
+        def produce():
+            time.sleep(0.1)
+            q.put("a")
+            time.sleep(0.1)
+            q2.put("b")
+        producer = threading.Thread(target=produce)
+        producer.start()
+        self.assertEqual("a", q.get(timeout=10))
+        self.assertEqual("b", q.get(timeout=10))
+        producer.join()
+        
+        #leased items come back if they aren't acked in time
+        leased = SqliteQueue(filename=q.get_filename(), persist=True, visibility_timeout=0.3)
+        q.put_many(["x", "y"])
+        first = leased.get()
+        self.assertEqual(("x", 1), (first.value, first.deliveries))
+        self.assertEqual(2, len(leased))
+        second = leased.get()
+        self.assertEqual("y", second.value)
+        self.assertTrue(second.ack())
+        self.assertEqual(1, len(leased))
+        self.assertEqual([], leased.get_batch(1, block=False))
+        again = leased.get(timeout=5)
+        self.assertEqual(("x", 2), (again.value, again.deliveries))
+        #the first lease ran out, so it can't ack any more
+        self.assertFalse(first.ack())
+        self.assertTrue(again.nack())
+        self.assertEqual([3], [message.deliveries for message in leased.get_batch(5)])
+        self.assertEqual(0, leased.ack_batch([first]))
+        
+        #without RETURNING
+        q._returning = False
+        leased._returning = False
+        q.put_many(["p", "q"])
+        self.assertEqual("p", q.get())
+        message = leased.get()
+        self.assertEqual("q", message.value)
+        self.assertTrue(message.ack())
+        #x is still leased
+        self.assertEqual(1, len(q))
+        q2.close()
+        leased.close()
+        
+    def test_queue_processes(self):
+        #producers and consumers in separate processes, with the default pragmas
+        q = SqliteQueue()
+        filename = q.get_filename()
+        results = multiprocessing.Queue()
+        values = [list(range(start, start + 100)) for start in (0, 1000)]
+        workers = [multiprocessing.Process(target=queue_producer, args=(filename, part, results)) for part in values]
+        workers += [multiprocessing.Process(target=queue_consumer, args=(filename, results)) for i in range(2)]
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get(timeout=60) for worker in workers]
+        for worker in workers:
+            worker.join()
+        self.assertEqual([], [outcome for role, outcome in outcomes if not isinstance(outcome, (list, type(None)))])
+        got = [value for role, outcome in outcomes if role == "consumer" for value in outcome]
+        self.assertEqual(sorted(values[0] + values[1]), sorted(got))
+        self.assertTrue(q.empty())
+        q.close()
+        
+    def test_memory(self):
+        before = set(os.listdir("."))
+        d = SqliteDict({"a": 1}, filename=":memory:")
+        self.run_dict_tests(SqliteDict(filename=":memory:"))
+        self.run_list_tests(SqliteList(filename=":memory:"))
+        self.run_set_tests(SqliteSet(filename=":memory:"))
+        #private in-memory databases don't share data or locks
+        d2 = SqliteDict(filename=":memory:")
+        self.assertEqual(0, len(d2))
+        self.assertFalse(d.lock is d2.lock)
+        s = SqliteSet([1, 2], filename=":memory:")
+        self.assertEqual({1, 2, 3}, set(s | SqliteSet([2, 3], filename=":memory:")))
+        self.assertFalse(s == SqliteSet([2, 3], filename=":memory:"))
+        
+        #shared-cache databases can be opened again by name
+        name = "file:test_memory?mode=memory&cache=shared"
+        shared = SqliteDict({"x": 1}, filename=name)
+        shared2 = SqliteDict(filename=name)
+        self.assertEqual(1, shared2["x"])
+        self.assertTrue(shared.lock is shared2.lock)
+        with self.assertRaises(ValueError):
+            SqliteDict(filename=name, spill_mb=1)
+        with self.assertRaises(ValueError):
+            SqliteDict(filename=":memory:", concurrent_reads=True)
+        for o in (d, d2, s, shared, shared2):
+            o.close()
+        self.assertEqual(set(), set(os.listdir(".")) - before)
+        
+        #spill to a temp file once the database gets too big
+        import shutil, tempfile
+        temp_dir = tempfile.mkdtemp()
+        try:
+            l = SqliteList(filename=":memory:", spill_mb=1, temp_dir=temp_dir, commit_every=100)
+            l.append("small")
+            self.assertFalse(l.is_spilled())
+            self.assertEqual([], os.listdir(temp_dir))
+            for i in range(2000):
+                l.append("x" * 1000)
+            self.assertTrue(l.is_spilled())
+            self.assertEqual(temp_dir, os.path.dirname(l.get_filename()))
+            self.assertEqual(2001, len(l))
+            self.assertEqual("small", l[0])
+            l.close()
+            self.assertEqual([], os.listdir(temp_dir))
+            
+            #random filenames go in temp_dir too
+            d = SqliteDict({"a": 1}, temp_dir=temp_dir)
+            self.assertEqual(temp_dir, os.path.dirname(d.get_filename()))
+            d.close()
+        finally:
+            shutil.rmtree(temp_dir)
+        
+    def test_statement_reuse(self):
+        import sqlite3
+        from sqlite_object._sqlite_list import _value_hash
+        filename = "test_statement_reuse.sqlite3"
+        try:
+            l = SqliteList([1, 1, 1], filename=filename, persist=True)
+            s = SqliteSet([1], filename=filename, persist=True)
+            d = SqliteDict({"a": 1}, filename=filename, persist=True)
+            self.assertEqual(1, l[1])
+            self.assertTrue(1 in s)
+            self.assertTrue("a" in d)
+            self.assertFalse("b" in d)
+            self.assertTrue(1 in l)
+            #nothing is left half-read on the reused cursors, so another connection can still commit
+            other = sqlite3.connect(filename, timeout=0.1)
+            other.execute('''INSERT INTO list (list_index, value, value_hash) VALUES (3, '2', ?)''', (_value_hash("2"), ))
+            other.commit()
+            other.close()
+            self.assertEqual([1, 1, 1, 2], list(l))
+            self.assertTrue(2 in l)
+            #the same goes for objects made without an initializer, read from on the same hot paths
+            l2 = SqliteList(filename=filename, persist=True)
+            s2 = SqliteSet(filename=filename, persist=True)
+            d2 = SqliteDict(filename=filename, persist=True)
+            self.assertEqual(2, l2[3])
+            self.assertTrue(1 in s2)
+            self.assertTrue("a" in d2)
+            self.assertFalse("b" in d2)
+            self.assertTrue(2 in l2)
+            #and a write through another object's connection gets through
+            d._db.execute('''PRAGMA busy_timeout = 100''')
+            d["b"] = 2
+            s.add(3)
+            self.assertTrue("b" in d2)
+            self.assertTrue(3 in s2)
+            for o in (l, s, d, l2, s2, d2):
+                o.close()
+        finally:
+            os.remove(filename)
+    
+    def test_transaction(self):
+        with SqliteDict({"a": 1}, cache_size=10) as d:
+            with d.batch():
+                for i in range(100):
+                    d[str(i)] = i
+                d.commit()
+                self.assertEqual(0, d.get_commit_stats()["pending_writes"])
+                self.assertTrue(d._db.in_transaction)
+            self.assertFalse(d._db.in_transaction)
+            self.assertEqual(101, len(d))
+            with self.assertRaises(KeyError):
+                with d.transaction():
+                    d["a"] = 2
+                    del d["1"]
+                    self.assertEqual(2, d["a"])
+                    d.pop("missing")
+            self.assertEqual(1, d["a"])
+            self.assertEqual(1, d["1"])
+            
+            #nested blocks roll back on their own, only the outer one commits
+            with d.transaction():
+                d["b"] = 1
+                try:
+                    with d.transaction():
+                        d["c"] = 1
+                        raise ValueError()
+                except ValueError:
+                    pass
+                self.assertTrue(d._db.in_transaction)
+            self.assertTrue("b" in d)
+            self.assertFalse("c" in d)
+        
+        with SqliteList([1, 2, 3]) as l:
+            with self.assertRaises(RuntimeError):
+                with l.transaction():
+                    l.append(4)
+                    self.assertEqual(1, l.pop_first())
+                    raise RuntimeError()
+            self.assertEqual([1, 2, 3], list(l))
+            self.assertEqual(3, len(l))
+            with l.batch():
+                self.assertEqual(3, l.pop_last())
+                l.prepend(0)
+            self.assertEqual([0, 1, 2], list(l))
+    
+    def test_store(self):
+        filename = "test_store.sqlite3"
+        store = SqliteStore(filename, persist=True)
+        try:
+            self.run_dict_tests(store.dict("dict"))
+            self.run_list_tests(store.list("list"))
+            self.run_set_tests(store.set("set"))
+            d = store.dict("users", cache_size=10)
+            l = store.list("log")
+            s = store.set("tags")
+            q = store.queue("jobs")
+            self.assertTrue(store.dict("users") is d)
+            self.assertTrue(d._db is l._db is store._db)
+            with self.assertRaises(ValueError):
+                store.list("users")
+            with self.assertRaises(ValueError):
+                store.dict("no spaces")
+            d["a"] = 1
+            l.extend([1, 2])
+            s.update(["x", "y"])
+            q.put("job")
+            self.assertEqual(["dict", "jobs", "list", "log", "set", "tags", "users"], store.names())
+            
+            #all or nothing across containers
+            with store.transaction():
+                d["b"] = 2
+                l.append(3)
+            self.assertEqual(0, store.get_commit_stats()["pending_writes"])
+            with self.assertRaises(RuntimeError):
+                with store.transaction():
+                    d["c"] = 3
+                    l.append(4)
+                    s.discard("x")
+                    self.assertEqual(3, d["c"])
+                    raise RuntimeError()
+            self.assertFalse("c" in d)
+            self.assertEqual([1, 2, 3], list(l))
+            self.assertEqual({"x", "y"}, set(s))
+            
+            #set algebra between tables of the same store
+            other = store.set("other")
+            other.update(["y", "z"])
+            self.assertEqual({"y"}, set(s & other))
+            self.assertTrue(s.isdisjoint(SqliteSet(["q"])))
+            self.assertEqual("job", q.get())
+            
+            store.drop("list")
+            self.assertFalse("list" in store)
+        finally:
+            store.close()
+        self.assertFalse(d.is_open())
+        store = SqliteStore(filename, persist=True)
+        try:
+            self.assertEqual({"a": 1, "b": 2}, dict(store.dict("users").items()))
+            self.assertEqual([1, 2, 3], list(store.list("log")))
+            with self.assertRaises(ValueError):
+                store.set("users")
+        finally:
+            store.close()
+            os.remove(filename)
+        
+    def test_indexes(self):
+        for codec in ("json", "pickle"):
+            d = SqliteDict(dict((i, {"user_id": i % 5, "n": i}) for i in range(50)), codec=codec)
+            d["other"] = [1, 2]
+            d.create_index("user_id")
+            d.create_index(lambda value: value["n"] * 2 if isinstance(value, dict) else None, name="double")
+            self.assertEqual([3, 8, 13, 18, 23, 28, 33, 38, 43, 48], sorted(key for key, value in d.find(user_id=3)))
+            self.assertEqual([(4, {"user_id": 4, "n": 4})], d.find(double=8))
+            self.assertEqual([(3, {"user_id": 3, "n": 3})], d.find(user_id=3, double=6))
+            self.assertEqual(["other"], [key for key, value in d.find(user_id=None)])
+            plan = d._db.execute('''EXPLAIN QUERY PLAN SELECT key FROM dict WHERE ''' + d._indexes["user_id"][0] + ''' IS ?''', (3, )).fetchall()
+            self.assertTrue("dict_by_user_id" in plan[0][-1])
+            
+            #sqlite keeps the indexes up to date through every kind of write
+            d[3] = {"user_id": 99, "n": 1000}
+            d.update({103: {"user_id": 3, "n": 0}})
+            d.pop(8)
+            del d[13]
+            self.assertEqual([18, 23, 28, 33, 38, 43, 48, 103], sorted(key for key, value in d.find(user_id=3)))
+            self.assertEqual([3], [key for key, value in d.find(user_id=99)])
+            self.assertEqual([5, 6, 7, 9], [key for key, value in d.find_range("double", 10, 20)])
+            self.assertEqual([3, 49, 44], [key for key, value in d.find_range("user_id", 4, limit=3, descending=True)])
+            d.clear()
+            self.assertEqual([], d.find(user_id=3))
+            d.drop_index("double")
+            with self.assertRaises(ValueError):
+                d.find(double=0)
+            with self.assertRaises(ValueError):
+                d.create_index("$.no-dashes")
+            d.close()
+        
+        #path indexes come back when the file is opened again, function ones are dropped and have to be made again
+        filename = "test_indexes.sqlite3"
+        d = SqliteDict({"a": {"x": 1}}, filename=filename, persist=True, codec="pickle")
+        d.create_index("x")
+        d.create_index(lambda value: value["x"] * 2, name="double")
+        d.close()
+        d = SqliteDict(filename=filename, persist=True)
+        try:
+            d["b"] = {"x": 2}
+            self.assertEqual([("b", {"x": 2})], d.find(x=2))
+            with self.assertRaises(ValueError):
+                d.find(double=4)
+            self.assertEqual([], d._db.execute('''SELECT name FROM sqlite_master WHERE name = ?''', ("dict_by_double", )).fetchall())
+            d.create_index(lambda value: value["x"] * 2, name="double")
+            self.assertEqual([("b", {"x": 2})], d.find(double=4))
+        finally:
+            d.close()
+            os.remove(filename)
+        
+    def test_query(self):
+        for codec in ("json", "pickle"):
+            d = SqliteDict(dict(("k%d" % i, {"status": "ok" if i % 3 else "error", "latency": i, "tags": ["a", {"b": i}]}) for i in range(30)), codec=codec, iter_chunk_size=7)
+            d["other"] = 5
+            ok = d.query().where("$.status", "=", "ok")
+            self.assertEqual(20, ok.count())
+            self.assertEqual(sum(i for i in range(30) if i % 3), ok.sum("$.latency"))
+            self.assertEqual((1, 29, 15.0), (ok.min("latency"), ok.max("latency"), ok.avg("latency")))
+            self.assertEqual(31, d.query().count())
+            self.assertEqual(30, d.query().count("status"))
+            self.assertEqual([29, 28, 26], list(ok.select("$.latency").order_by("$.latency", descending=True).limit(3)))
+            self.assertEqual([("k1", {"b": 1}), ("k2", {"b": 2})], list(ok.where("latency", "<", 4).select("key", "$.tags[1]")))
+            self.assertEqual([("other", 5)], list(d.query().where("status", "=", None)))
+            self.assertEqual(["k7", "k8"], [key for key, value in ok.limit(2, offset=4)])
+            self.assertEqual(1 + 2 + 4, ok.order_by("latency").limit(3).sum("latency"))
+            self.assertEqual(10, d.query().where("status", "in", ["error", "missing"]).count())
+            self.assertEqual(20, len(list(ok)))
+            with self.assertRaises(ValueError):
+                d.query().where("status", "~", "ok")
+            #conditions on indexed paths use the index
+            d.create_index("status")
+            plan = d._db.execute('''EXPLAIN QUERY PLAN SELECT COUNT(*) FROM dict WHERE ''' + d._field_expression("$.status")[0] + ''' = ?''', ("ok", )).fetchall()
+            self.assertTrue("dict_by_status" in plan[0][-1])
+            self.assertEqual(20, ok.count())
+            d.close()
+            
+            l = SqliteList([{"n": i % 10} for i in range(25)] + ["text", None], codec=codec, iter_chunk_size=4)
+            self.assertEqual([{"n": 8}, {"n": 9}, {"n": 8}, {"n": 9}], list(l.query().where("n", ">=", 8)))
+            self.assertEqual(100, l.query().sum("n"))
+            self.assertEqual([{"n": 4}, "text", None], list(l.query().select("$").limit(3, 24)))
+            self.assertEqual([2, 3, 3, 3], list(l.query().order_by("n").select("n").limit(4, 10)))
+            l.close()
+        
+    def test_streaming(self):
+        #exports copy stored JSON straight out, and imports parse the file a value at a time
+        l = SqliteList([1, "two", {"three": [3]}, None])
+        out = StringIO()
+        l.write(out)
+        self.assertEqual([1, "two", {"three": [3]}, None], json.loads(out.getvalue()))
+        self.assertEqual([1, "two", {"three": [3]}, None], list(SqliteList.load_json(StringIO(out.getvalue()))))
+        out = StringIO()
+        l.write_lines(out)
+        self.assertEqual([1, "two", {"three": [3]}, None], list(SqliteList.load_lines(StringIO(out.getvalue() + "\n"))))
+        s = SqliteSet.load_json(StringIO(' [1, "a", 1.5] '))
+        self.assertEqual({1, "a", 1.5}, set(s))
+        
+        d = SqliteDict({1: "a", "b": [1, 2], "c": None}, codec="pickle")
+        out = StringIO()
+        d.write(out)
+        self.assertEqual({"1": "a", "b": [1, 2], "c": None}, json.loads(out.getvalue()))
+        out = StringIO()
+        d.write_lines(out)
+        self.assertEqual({1: "a", "b": [1, 2], "c": None}, dict(SqliteDict.load_lines(StringIO(out.getvalue())).items()))
+        loaded = SqliteDict.load_json(StringIO('{"a": {"b": "}"}, "c": 12345}'), compression="zlib", compression_threshold=1)
+        self.assertEqual({"a": {"b": "}"}, "c": 12345}, dict(loaded.items()))
+        with self.assertRaises(ValueError):
+            SqliteList.load_json(StringIO("[1, 2"))
+        
+        #numbers cut off by the end of a read carry on in the next one
+        from sqlite_object import _json_stream
+        read_size = _json_stream._read_size
+        _json_stream._read_size = 7
+        try:
+            values = [1.25, -3e+10, 6.5E-3, 100, 2.0, 0.125]
+            for padding in range(8):
+                self.assertEqual(values, list(SqliteList.load_json(StringIO(" " * padding + json.dumps(values)))))
+                items = dict(("k%d" % i, value) for i, value in enumerate(values))
+                self.assertEqual(items, dict(SqliteDict.load_json(StringIO(" " * padding + json.dumps(items))).items()))
+            self.assertEqual([12345], list(SqliteList.load_json(StringIO("[12345]"))))
+        finally:
+            _json_stream._read_size = read_size
+        
+    def test_async(self):
+        try:
+            import asyncio
+            from sqlite_object import AsyncSqliteDict, AsyncSqliteList, AsyncSqliteSet
+        except ImportError:
+            self.skipTest("needs python 3.6+")
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        run = loop.run_until_complete
+        def drain(iterator):
+            items = []
+            while True:
+                try:
+                    items.append(run(iterator.__anext__()))
+                except StopAsyncIteration:
+                    return items
+        try:
+            d = AsyncSqliteDict(dict((str(i), i) for i in range(1000)), iter_chunk_size=100)
+            batches = []
+            get_many = d.sync.get_many
+            d.sync.get_many = lambda keys: batches.append(len(keys)) or get_many(keys)
+            results = run(asyncio.gather(d.get("missing", -1), d.contains("5"), d.contains("missing"), *[d.get(str(i)) for i in range(1000)]))
+            self.assertEqual([-1, True, False] + list(range(1000)), results)
+            #everything waiting at once went in one query
+            self.assertEqual([1003], batches)
+            with self.assertRaises(KeyError):
+                run(d.getitem("missing"))
+            run(d.set("a", "b"))
+            self.assertEqual("b", run(d.get("a")))
+            run(d.delete("a"))
+            #pop works like dict.pop, raising KeyError for a missing key unless given a default
+            self.assertEqual(5, run(d.pop("5")))
+            self.assertEqual(None, run(d.pop("5", None)))
+            with self.assertRaises(KeyError):
+                run(d.pop("5"))
+            run(d.set("5", 5))
+            self.assertEqual(1000, run(d.len()))
+            self.assertEqual(dict((str(i), i) for i in range(1000)), dict(drain(d.items())))
+            self.assertEqual(set(str(i) for i in range(1000)), set(drain(d.__aiter__())))
+            run(d.close())
+            self.assertFalse(d.sync.is_open())
+            
+            l = AsyncSqliteList(iter_chunk_size=3)
+            run(l.extend(range(5)))
+            run(l.append(5))
+            run(l.prepend(-1))
+            self.assertEqual(list(range(-1, 6)), drain(l.__aiter__()))
+            self.assertEqual(list(reversed(range(-1, 6))), drain(l.reversed()))
+            self.assertEqual(-1, run(l.pop_first()))
+            self.assertEqual(5, run(l.pop_last()))
+            self.assertEqual(2, run(l.get(2)))
+            run(l.insert(2, "x"))
+            run(l.remove(3))
+            self.assertEqual([0, 1, "x", 2, 4], drain(l.__aiter__()))
+            run(l.close())
+            
+            s = AsyncSqliteSet([1, 2])
+            run(s.add(3))
+            run(s.discard(1))
+            self.assertTrue(run(s.contains(3)))
+            self.assertEqual({2, 3}, set(drain(s.__aiter__())))
+            
+            #wrappers on the same database share its executor until the last of them is closed
+            s2 = AsyncSqliteSet(filename=s.get_filename(), persist=True)
+            other = AsyncSqliteSet()
+            self.assertTrue(s._executor is s2._executor)
+            self.assertFalse(s._executor is other._executor)
+            executor = s._executor
+            run(s2.close())
+            run(s2.close())
+            self.assertEqual({2, 3}, set(drain(s.__aiter__())))
+            run(s.close())
+            run(other.close())
+            self.assertTrue(executor._shutdown)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        
+    def test_concurrent_reads(self):
+        #unrelated objects don't share a lock, objects using the same file do
+        d = SqliteDict()
+        d2 = SqliteDict()
+        self.assertFalse(d.lock is d2.lock)
+        d3 = SqliteDict(filename=d.get_filename())
+        self.assertTrue(d.lock is d3.lock)
+        
+        d = SqliteDict(dict((str(i), i) for i in range(1000)), concurrent_reads=True, commit_every=1000)
+        self.run_dict_tests(SqliteDict(concurrent_reads=True))
+        #reads only go to the reader connections once the writes are committed
+        d.commit()
+        errors = []
+        connections = []
+        def reader(offset):
+            try:
+                for i in range(1000):
+                    key = str((i + offset) % 1000)
+                    if d[key] != int(key) or key not in d:
+                        errors.append(key)
+                if sum(1 for _ in d) != len(d):
+                    errors.append("len")
+                connections.append(d._readers.db)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=reader, args=(i * 100, )) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        #each thread read through its own connection
+        self.assertEqual(8, len(set(connections)))
+        self.assertFalse(any(db is d._db for db in connections))
+        #and the ones of finished threads are closed when another thread opens one
+        thread = threading.Thread(target=d.__getitem__, args=("1", ))
+        thread.start()
+        thread.join()
+        self.assertEqual([thread], [reader for reader, db in d._reader_connections])
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connections[0].execute('''SELECT 1''')
+        
+        #uncommitted writes are visible to the writing object
+        d.commit()
+        d["new"] = "value"
+        self.assertEqual(1, d.get_commit_stats()["pending_writes"])
+        self.assertEqual("value", d["new"])
+        self.assertEqual(1001, len(d))
+        
+        l = SqliteList(range(10), concurrent_reads=True)
+        self.run_list_tests(SqliteList(concurrent_reads=True))
+        s = SqliteSet(range(10), concurrent_reads=True)
+        self.run_set_tests(SqliteSet(concurrent_reads=True))
+        results = []
+        def list_and_set_reader():
+            results.append(([x for x in l], 5 in s, len(s)))
+        thread = threading.Thread(target=list_and_set_reader)
+        thread.start()
+        thread.join()
+        self.assertEqual([(list(range(10)), True, 10)], results)
+        self.assertEqual((1, 1), (len(l._reader_connections), len(s._reader_connections)))
+        d.close()
+        l.close()
+        s.close()
+        
+    def test_read_cache(self):
+        d = SqliteDict(cache_size=2)
+        self.run_dict_tests(d)
+        self.assertTrue(d.get_cache_stats()["hits"] > 0)
+        self.assertEqual(None, SqliteDict().get_cache_stats())
+        
+        d = SqliteDict({"a": [1], "b": [2], "c": [3]}, cache_size=2)
+        d["a"], d["b"], d["a"], d["c"]
+        stats = d.get_cache_stats()
+        self.assertEqual((1, 3, 1, 2), (stats["hits"], stats["misses"], stats["evictions"], stats["items"]))
+        #shared references by default
+        self.assertTrue(d["a"] is d["a"])
+        
+        #write-through on set, del, pop, update and clear
+        d["a"] = [10]
+        self.assertEqual([10], d["a"])
+        del d["a"]
+        self.assertNotIn("a", d)
+        d["c"]
+        d.update({"c": [30]})
+        self.assertEqual([30], d["c"])
+        self.assertEqual([30], d.pop("c"))
+        self.assertNotIn("c", d)
+        d["b"]
+        d.clear()
+        self.assertNotIn("b", d)
+        
+        #changes made through another connection invalidate the cache
+        d["x"] = 1
+        self.assertEqual(1, d["x"])
+        other = SqliteDict(filename=d.get_filename())
+        other["x"] = 2
+        self.assertEqual(2, d["x"])
+        
+        #a transaction that hasn't written anything yet doesn't stop other connections from committing
+        d = SqliteDict({"k": 1}, cache_size=10)
+        other = SqliteDict(filename=d.get_filename())
+        other._db.execute('''PRAGMA busy_timeout = 100''')
+        self.assertEqual(1, d["k"])
+        with d.transaction():
+            other["k"] = 3
+            self.assertEqual(3, d["k"])
+        
+        #the database is only asked about other connections' changes when there can be any
+        for filename, checks in ((":memory:", 0), (None, 1)):
+            statements = []
+            d = SqliteDict({"a": 1}, filename=filename, cache_size=10)
+            d._db.set_trace_callback(statements.append)
+            with d.transaction():
+                d["b"] = 2
+                self.assertEqual([1, 2, 1], [d["a"], d["b"], d["a"]])
+                self.assertEqual([1, 2], d.get_many(["a", "b"]))
+            #outside the transaction a file has to be checked again
+            self.assertEqual(1, d["a"])
+            self.assertEqual(checks, sum("data_version" in statement for statement in statements))
+            d._db.set_trace_callback(None)
+            d.close()
+        
+        #copies and byte limits
+        d = SqliteDict({"a": [1], "big": "x" * 100}, cache_bytes=50, cache_copies=True)
+        self.assertEqual([1], d["a"])
+        self.assertFalse(d["a"] is d["a"])
+        d["a"].append(2)
+        self.assertEqual([1], d["a"])
+        d["big"]
+        self.assertEqual(1, d.get_cache_stats()["items"])
+        self.assertTrue(d.get_cache_stats()["bytes"] <= 50)
+        
+    def test_codecs(self):
+        for codec in ["json", "pickle", "marshal"]:
+            d = SqliteDict(codec=codec)
+            self.assertEqual(codec, d.get_codec())
+            self.run_dict_tests(d)
+            self.run_list_tests(SqliteList(codec=codec))
+            self.run_set_tests(SqliteSet(codec=codec))
+        
+        #binary codecs get BLOB columns and round trip things json can't
+        d = SqliteDict({(1, 2): b"\x00\xff", "set": {1, 2}}, codec="pickle")
+        self.assertEqual(b"\x00\xff", d[(1, 2)])
+        self.assertEqual({1, 2}, d["set"])
+        with d._closeable_cursor() as cursor:
+            types = [row[2] for row in cursor.execute("PRAGMA table_info(dict)")]
+            self.assertEqual(["BLOB", "BLOB"], types)
+            self.assertEqual("blob", cursor.execute("SELECT typeof(value) FROM dict LIMIT 1").fetchone()[0])
+        
+        #re-opening picks up the recorded codec, and a different one is refused
+        d2 = SqliteDict(filename=d.get_filename())
+        self.assertEqual("pickle", d2.get_codec())
+        self.assertEqual({1, 2}, d2["set"])
+        self.assertRaises(ValueError, SqliteDict, filename=d.get_filename(), codec="marshal")
+        self.assertRaises(ValueError, SqliteDict, codec="nope")
+        
+        #custom coders are used as-is
+        l = SqliteList([1, 2], coder=str, decoder=int)
+        self.assertEqual(None, l.get_codec())
+        self.assertEqual([1, 2], [x for x in l])
+        
+        register_codec("upper", lambda x: json.dumps(x).upper(), lambda x: json.loads(x.lower()))
+        s = SqliteSet(["a", "b"], codec="upper")
+        self.assertIn("a", s)
+        with s._closeable_cursor() as cursor:
+            self.assertEqual(['"A"', '"B"'], sorted(row[0] for row in cursor.execute("SELECT key FROM set_table")))
+        
+    def test_compression(self):
+        document = {"name": "something", "tags": ["a", "b", "c"] * 50, "text": "lorem ipsum " * 100}
+        for method in ["zlib", "lzma"]:
+            d = SqliteDict(compression=method, compression_threshold=100)
+            self.run_dict_tests(d)
+            d["doc"] = document
+            self.assertEqual(document, d["doc"])
+            self.assertIn(("doc", document), d.items())
+            self.assertIn(document, d.values())
+            stats = d.get_compression_stats()
+            self.assertTrue(stats["compressed"] >= 1)
+            self.assertTrue(stats["ratio"] > 1)
+            self.assertTrue(stats["encode_seconds"] > 0)
+            l = SqliteList(compression=method, compression_threshold=100)
+            self.run_list_tests(l)
+            l.append(document)
+            self.assertEqual(document, l[-1])
+            self.assertIn(document, l)
+        self.assertEqual(None, SqliteDict().get_compression_stats())
+        
+        #small values are stored as-is, big ones get compressed, and the choice is remembered
+        d = SqliteDict({"small": "x", "big": document}, compression="zlib", compression_threshold=100)
+        with d._closeable_cursor() as cursor:
+            stored = dict(cursor.execute("SELECT key, value FROM dict").fetchall())
+        self.assertEqual(b"\x02\"x\"", stored['"small"'])
+        self.assertEqual(1, bytearray(stored['"big"'][:1])[0] & 1)
+        self.assertTrue(len(stored['"big"']) < len(json.dumps(document)) / 4)
+        d2 = SqliteDict(filename=d.get_filename())
+        self.assertEqual(document, d2["big"])
+        self.assertRaises(ValueError, SqliteDict, filename=d.get_filename(), compression="lzma")
+        uncompressed = SqliteDict({"a": 1})
+        self.assertRaises(ValueError, SqliteDict, filename=uncompressed.get_filename(), compression="zlib")
+        
+        #shared dictionaries, with binary codecs too
+        samples = [json.dumps({"user_id": i, "status": "active", "role": "member"}) for i in range(100)]
+        dictionary = train_dictionary(samples, size=1024)
+        d = SqliteDict(codec="pickle", compression="zlib", compression_threshold=10, compression_dict=dictionary)
+        plain = SqliteDict(codec="pickle", compression="zlib", compression_threshold=10)
+        for i in range(20):
+            value = {"user_id": i, "status": "active", "role": "member"}
+            d[i] = value
+            plain[i] = value
+            self.assertEqual(value, d[i])
+        self.assertTrue(d.get_compression_stats()["bytes_out"] <= plain.get_compression_stats()["bytes_out"])
+        d2 = SqliteDict(filename=d.get_filename())
+        self.assertEqual({"user_id": 3, "status": "active", "role": "member"}, d2[3])
+        self.assertRaises(ValueError, SqliteDict, filename=d.get_filename(), compression="zlib")
+        
+        #without the lzma module only lzma compression is unavailable
+        from sqlite_object import _compression
+        lzma = _compression.lzma
+        _compression.lzma = None
+        try:
+            self.assertRaises(ValueError, SqliteDict, compression="lzma")
+            self.assertEqual({"a": "x" * 100}, dict(SqliteDict({"a": "x" * 100}, compression="zlib", compression_threshold=10).items()))
+        finally:
+            _compression.lzma = lzma
+        
+        #compressors can be sent to decode processes, and count everything done on any thread
+        import pickle
+        copy = pickle.loads(pickle.dumps(d._compressor))
+        self.assertEqual(b"x" * 100, copy.decompress(copy.compress(b"x" * 100)))
+        compressor = _compression.Compressor("zlib", threshold=10)
+        threads = [threading.Thread(target=lambda: [compressor.compress(b"y" * 50) for i in range(2000)]) for j in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((8000, 8000 * 50), (compressor.stats()["compressed"], compressor.stats()["bytes_in"]))
+        
         
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file